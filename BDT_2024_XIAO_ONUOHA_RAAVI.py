@@ -19,6 +19,31 @@ test_items_path = "/FileStore/tables/test_order_items.csv"
 payments_path = "/FileStore/tables/order_payments.csv"
 test_payments_path = "/FileStore/tables/test_order_payments.csv"
 order_review_path = "/FileStore/tables/order_reviews.csv"
+parquet_cache_dir = "/FileStore/parquet"
+profile_report_path = "/dbfs/FileStore/reports/data_profile"
+stage_metrics_path = "/dbfs/FileStore/reports/stage_metrics.json"
+checkpoint_dir = "/FileStore/checkpoints"
+model_dir = "/FileStore/models/blu"
+vocabulary_path = f"{model_dir}/vocabulary.json"
+category_encoder_path = f"{model_dir}/category_encoder.json"
+feature_store_dir = "/FileStore/features"
+profile_data = True  # set to False in production runs to skip the data-quality profiling
+basetable_backend = "spark"  # "pandas" builds the basetables on the driver without Spark jobs (small data only)
+detect_skew = False  # set to True to sample the order and product keys and salt the heavy ones
+category_hash_width = None  # product_categories vector width with feature hashing; None = one position per category (Spark backend only)
+incremental_refresh = False  # set to True to rebuild only the orders that changed since the latest feature version
+
+source_paths = {
+    "products": product_path,
+    "test_products": test_product_path,
+    "orders": orders_path,
+    "test_orders": test_orders_path,
+    "order_items": items_path,
+    "test_order_items": test_items_path,
+    "order_payments": payments_path,
+    "test_order_payments": test_payments_path,
+    "order_reviews": order_review_path,
+}
 
 # COMMAND ----------
 
@@ -40,6 +65,26 @@ order_review_path = "/FileStore/tables/order_reviews.csv"
 
 #Load functions
 from pyspark.sql.functions import *
+from blu.ingest import ingest, load_sources
+from blu.instrumentation import StageMetrics
+from blu.persistence import PersistManager
+from blu.profiling import Profiler
+
+# COMMAND ----------
+
+# Time, Spark jobs, shuffle bytes and spill of each named stage below; the summary is printed in the last cell
+stage_metrics = StageMetrics(spark)
+
+# Convert the CSVs to Parquet (only the ones that changed since the last run) and read from there
+with stage_metrics.stage("ingest"):
+    parquet_paths = ingest(spark, source_paths, parquet_cache_dir)
+sources = load_sources(spark, parquet_paths)
+
+# Each profile is a single aggregation (nulls, NaNs, distinct values, min/max/mean, duplicates)
+profiler = Profiler(enabled=profile_data)
+
+# Persisted stages are released as soon as their last consumer is done
+persist_manager = PersistManager(spark, checkpoint_dir=checkpoint_dir)
 
 # COMMAND ----------
 
@@ -64,56 +109,12 @@ Metadata description:
 
 # COMMAND ----------
 
+#read in and profile the product and test_product dataset
+product = sources["products"]
+test_product = sources["test_products"]
 
-#read in the product and test_product dataset
-product = spark.read.format("csv").option("header", "True").option("inferSchema", "True").option("escape", "\"").load(product_path)
-test_product = spark.read.format("csv").option("header", "True").option("inferSchema", "True").option("escape", "\"").load(test_product_path)
-
-product.show(2)
-product.printSchema()
-product.describe().show()
-product.dropDuplicates()
-
-test_product.show(2)
-test_product.printSchema()
-test_product.describe().show()
-test_product.dropDuplicates()
-
-# COMMAND ----------
-
-#check for null and na values in the product and test_product dataset
-product.select([count(when(isnull(c)| isnan(c), c)).alias(c) for c in product.columns]).show()
-test_product.select([count(when(isnull(c)| isnan(c), c)).alias(c) for c in test_product.columns]).show()
-
-# COMMAND ----------
-
-#Creating new variables for the product and test_product tables
-
-# length, m
-product = product.withColumn("product_length", col("product_length_cm")/100).drop("product_length_cm")
-test_product = test_product.withColumn("product_length", col("product_length_cm") /100).drop("product_length_cm")
-
-# height, m
-product = product.withColumn("product_height", col("product_height_cm")/100).drop("product_height_cm")
-test_product = test_product.withColumn("product_height", col("product_height_cm")/100).drop("product_height_cm")
-
-# width, m
-product = product.withColumn("product_width", col("product_width_cm")/100).drop("product_width_cm")
-test_product = test_product.withColumn("product_width", col("product_width_cm")/100).drop("product_width_cm")
-
-# Volume, m3
-product = product.withColumn("Prod_volume_m3", round(col("product_length") * col("product_height") * col("product_width"),2))
-test_product = test_product.withColumn("Prod_volume_m3", round(col("product_length") * col("product_height") * col("product_width"),2))
-
-# Weight in kg
-product = product.withColumn("weight_kg", round(col("product_weight_g") /1000, 2)).drop("product_weight_g")
-test_product = test_product.withColumn("weight_kg", round(col("product_weight_g") / 1000, 2)).drop("product_weight_g")
-
-
-# COMMAND ----------
-
-product.show(2)
-test_product.show(2)
+profiler.profile("products", product)
+profiler.profile("test_products", test_product)
 
 # COMMAND ----------
 
@@ -132,76 +133,12 @@ Metadata description:
 
 # COMMAND ----------
 
-#Read table: orders
-orders = spark.read.format("csv").option("header", "true").option("multiline", "true").load(orders_path)
-orders.show(5)
-orders.printSchema()
-orders.dropDuplicates()
-
-#Read table: test_orders
-test_orders = spark.read.format("csv").option("header", "true").option("multiline", "true").load(test_orders_path)
-test_orders.show(5)
-test_orders.printSchema()
-test_orders.dropDuplicates()
-
-
-# COMMAND ----------
-
-#Count the number of nulls per column for orders 
-orders.select([count(when(col(c).isNull(), c)).alias(c) for c in orders.columns]).show()
-#Count the number of nulls per column for test_orders 
-test_orders.select([count(when(col(c).isNull(), c)).alias(c) for c in test_orders.columns]).show()
-
-# remove where orderid is NA
-orders =orders.where(orders["order_id"] != "NA")
-test_orders = test_orders.where(test_orders['order_id']!= "NA")
-
-# COMMAND ----------
-
-# Calculate the weekly purchases on the day as per the timestamp (Mon=1, Sun=7)
-orders = orders.withColumn("orders_of_week", dayofweek("order_purchase_timestamp"))
-test_orders = test_orders.withColumn("orders_of_week", dayofweek("order_purchase_timestamp"))
-
-# Create a new variable for weekend delivery where 1=weekend delivery and 0=weekday delivery
-orders = orders.withColumn("weekend_delivered", when((dayofweek("order_delivered_customer_date") >= 6), 1).otherwise(0)).drop("orders_of_week")
-test_orders = test_orders.withColumn("weekend_delivered", when((dayofweek("order_delivered_customer_date") >= 6), 1).otherwise(0)).drop("orders_of_week")
-
-# Time gap between order purchase timestamp and order approved at (efficiency of the supplier) in hours
-orders = orders.withColumn("approve_efficiency", round((unix_timestamp("order_approved_at", "yyyy-MM-dd HH:mm:ss") - unix_timestamp("order_purchase_timestamp", "yyyy-MM-dd HH:mm:ss")) / 3600,2))
-test_orders = test_orders.withColumn("approve_efficiency", round((unix_timestamp("order_approved_at", "yyyy-MM-dd HH:mm:ss") - unix_timestamp("order_purchase_timestamp", "yyyy-MM-dd HH:mm:ss")) / 3600,2))
-
-# Time gap between order approved at and order delivered carrier date (supplier packaging efficiency) in hours
-orders = orders.withColumn("package_efficiency", round((unix_timestamp("order_delivered_carrier_date", "yyyy-MM-dd HH:mm:ss") - unix_timestamp("order_approved_at", "yyyy-MM-dd HH:mm:ss")) / 3600,2))
-test_orders = test_orders.withColumn("package_efficiency",round((unix_timestamp("order_delivered_carrier_date", "yyyy-MM-dd HH:mm:ss") - unix_timestamp("order_approved_at", "yyyy-MM-dd HH:mm:ss")) / 3600,2))
-
-# Time gap between delivered carrier date and delivered customer date (efficiency of delivery) in hours
-orders = orders.withColumn("delivery_efficiency",round((unix_timestamp("order_delivered_customer_date", "yyyy-MM-dd HH:mm:ss") - unix_timestamp("order_delivered_carrier_date", "yyyy-MM-dd HH:mm:ss")) / 3600,2))
-test_orders = test_orders.withColumn("delivery_efficiency", round((unix_timestamp("order_delivered_customer_date", "yyyy-MM-dd HH:mm:ss") - unix_timestamp("order_delivered_carrier_date", "yyyy-MM-dd HH:mm:ss")) / 3600,2))
-
-# Time gap between order delivered customer date and estimated delivery date (check if there is overtime shipping) in hours
-orders = orders.withColumn("on_time", round((unix_timestamp("order_estimated_delivery_date", "yyyy-MM-dd HH:mm:ss") - unix_timestamp("order_delivered_customer_date", "yyyy-MM-dd HH:mm:ss")) / 3600,2))
-test_orders = test_orders.withColumn("on_time", round((unix_timestamp("order_estimated_delivery_date", "yyyy-MM-dd HH:mm:ss") - unix_timestamp("order_delivered_customer_date", "yyyy-MM-dd HH:mm:ss")) / 3600,2))
-
-# Time gap between order delivered customer date and order purchase timestamp in hours (total time used for the customer to receive their delivery)
-orders = orders.withColumn("total_delivery_time", round((unix_timestamp("order_delivered_customer_date", "yyyy-MM-dd HH:mm:ss") - unix_timestamp("order_purchase_timestamp", "yyyy-MM-dd HH:mm:ss")) / 3600,2))
-test_orders = test_orders.withColumn("total_delivery_time", round((unix_timestamp("order_delivered_customer_date", "yyyy-MM-dd HH:mm:ss") - unix_timestamp("order_purchase_timestamp", "yyyy-MM-dd HH:mm:ss")) / 3600,2))
-
-# drop unnecessary columns 
-orders = orders.drop("order_purchase_timestamp","order_approved_at","order_delivered_carrier_date","order_delivered_customer_date","order_estimated_delivery_date","order_hour")
-test_orders = test_orders.drop("order_purchase_timestamp","order_approved_at","order_delivered_carrier_date","order_delivered_customer_date","order_estimated_delivery_date","order_hour")
+#Read and profile table: orders & test_orders
+orders = sources["orders"]
+test_orders = sources["test_orders"]
 
-# Convert all numeric columns to double()
-orders = orders.select(col("order_id"), col("customer_id"), col("weekend_delivered").cast("double"), col("approve_efficiency").cast("double"), col("package_efficiency").cast("double"), col("delivery_efficiency").cast("double"), col("on_time").cast("double"),col("total_delivery_time").cast("double"))
-test_orders = test_orders.select(col("order_id"), col("customer_id"), col("weekend_delivered").cast("double"), col("approve_efficiency").cast("double"), col("package_efficiency").cast("double"), col("delivery_efficiency").cast("double"),col("on_time").cast("double"), col("total_delivery_time").cast("double"))
-
-# COMMAND ----------
-
-orders.show(5)
-test_orders.show(5)
-
-# COMMAND ----------
-
-orders.printSchema()
+profiler.profile("orders", orders)
+profiler.profile("test_orders", test_orders)
 
 # COMMAND ----------
 
@@ -217,78 +154,12 @@ Metadata description:
 
 # COMMAND ----------
 
-#Read table: order_items 
-items =spark\
-.read\
-.format("csv")\
-.option("header","true")\
-.option("inferSchema","true")\
-.option("escape","\"")\
-.load(items_path)
-
-items.show(3)
-items.printSchema()
-items.count()
-items.dropDuplicates()
-
-#Read table: test_order_items 
-test_items =spark\
-.read\
-.format("csv")\
-.option("header","true")\
-.option("inferSchema","true")\
-.option("escape","\"")\
-.load(test_items_path)
-
-test_items.show(3)
-test_items.printSchema()
-test_items.count()
-test_items.dropDuplicates()
-
-# COMMAND ----------
-
-#Count the number of nulls per column for order_items
-items.select([count(when(col(c).isNull(), c)).alias(c) for c in items.columns]).show()
-#Count the number of nulls per column for test_order_items
-test_items.select([count(when(col(c).isNull(), c)).alias(c) for c in test_items.columns]).show()
-
-# COMMAND ----------
-
-# Calculate total price, shipping cost, and total cost grouped by orderid
-items_nv = items.groupBy("order_id").agg(
-    round(sum("price"),2).alias("total_price"),
-    round(sum("shipping_cost"),2).alias("total_shipping_cost"),
-    round((sum("price") + sum("shipping_cost")),2).alias("total_cost"),
-    round(sum("shipping_cost")/(sum("price") + sum("shipping_cost")),2).alias("shipping_cost%"),
-    max("order_item_id").alias("max_order_item_id"),
-    countDistinct("product_id").alias("num_unique_products_per_id"))
-
-test_items_nv = test_items.groupBy("order_id").agg(
-    round(sum("price"),2).alias("total_price"),
-    round(sum("shipping_cost"),2).alias("total_shipping_cost"),
-    round((sum("price") + sum("shipping_cost")),2).alias("total_cost"),
-    round(sum("shipping_cost")/(sum("price") + sum("shipping_cost")),2).alias("shipping_cost%"),
-    max("order_item_id").alias("max_order_item_id"),
-    countDistinct("product_id").alias("num_unique_products_per_id"))
-
-# Join the calculated values back to the original DataFrame
-items = items.join(items_nv, "order_id")
-test_items = test_items.join(test_items_nv, "order_id")
-
-# Drop unneccessary columns 
-items = items.drop("order_item_id","price","shipping_cost")
-test_items = test_items.drop("order_item_id","price","shipping_cost")
-
-items = items.select(col("order_id"), col("product_id"), col("total_price").cast("double"), col("total_shipping_cost").cast("double"), col("total_cost").cast("double"), col("shipping_cost%").cast("double"), col("max_order_item_id").cast("double"), col("num_unique_products_per_id").cast("double"))
-test_items = test_items.select(col("order_id"), col("product_id"), col("total_price").cast("double"), col("total_shipping_cost").cast("double"), col("total_cost").cast("double"), col("shipping_cost%").cast("double"), col("max_order_item_id").cast("double"), col("num_unique_products_per_id").cast("double"))
+#Read and profile table: order_items & test_order_items
+items = sources["order_items"]
+test_items = sources["test_order_items"]
 
-items.show(5)
-test_items.show(5)
-
-# COMMAND ----------
-
-items.describe().show()
-test_items.describe().show()
+profiler.profile("order_items", items)
+profiler.profile("test_order_items", test_items)
 
 # COMMAND ----------
 
@@ -304,70 +175,12 @@ Metadata description:
 
 # COMMAND ----------
 
-#Read table: order_payments 
-
-payments =spark\
-.read\
-.format("csv")\
-.option("header","true")\
-.option("inferSchema","true")\
-.option("escape","\"")\
-.load(payments_path)
-
-payments.show(3)
-payments.printSchema()
-payments.count()
-payments.dropDuplicates()
-
-#Read table: test_order_payments 
-
-test_payments =spark\
-.read\
-.format("csv")\
-.option("header","true")\
-.option("inferSchema","true")\
-.option("escape","\"")\
-.load(test_payments_path)
-
-test_payments.show(3)
-test_payments.printSchema()
-test_payments.count()
-test_payments.dropDuplicates()
-
-# COMMAND ----------
+#Read and profile table: order_payments & test_order_payments
+payments = sources["order_payments"]
+test_payments = sources["test_order_payments"]
 
-#Count the number of nulls per column for order_payments 
-payments.select([count(when(col(c).isNull(), c)).alias(c) for c in payments.columns]).show()
-#Count the number of nulls per column for test_order_payments 
-test_payments.select([count(when(col(c).isNull(), c)).alias(c) for c in test_payments.columns]).show()
-
-# COMMAND ----------
-
-# new variables base on payment method 
-paymentsnv = payments.groupBy("order_id", "payment_type") \
-    .agg(sum(col("payment_value")).alias("total_payment_value"))
-pivoted_df = paymentsnv.groupBy("order_id").pivot("payment_type").agg(sum("total_payment_value").alias("total_payment_value"))
-pivoted_df = pivoted_df.na.fill(0)
-payments = payments.join(pivoted_df, on = "order_id")
-
-test_payments = test_payments.where(test_payments['payment_type']!= "not_defined")
-
-testpaymentnv = test_payments.groupBy("order_id", "payment_type") \
-    .agg(sum(col("payment_value")).alias("total_payment_value"))
-pivoted_tp = testpaymentnv.groupBy("order_id").pivot("payment_type").agg(sum("total_payment_value").alias("total_payment_value"))
-pivoted_tp = pivoted_tp.na.fill(0)
-test_payments = test_payments.join(pivoted_tp, on = "order_id")
-
-# If customer choose to pay with installments 
-payments = payments.withColumn("pay_with_installment", (col("payment_installments") > 1).cast("double"))
-test_payments = test_payments.withColumn("pay_with_installment", (col("payment_installments") > 1).cast("double"))
-
-# Remove duplicate or useless columns 
-payments = payments.drop("payment_sequential","payment_type","payment_installments","payment_value")
-test_payments = test_payments.drop("payment_sequential","payment_type","payment_installments","payment_value")
-
-payments.show(3)
-test_payments.show(3)
+profiler.profile("order_payments", payments)
+profiler.profile("test_order_payments", test_payments)
 
 # COMMAND ----------
 
@@ -383,217 +196,102 @@ Metadata description:
 
 # COMMAND ----------
 
-#Read table: orders_reviews
-orders_reviews = spark.read.format("csv").option("header", "true").option("multiline", "true").load(order_review_path)
-orders_reviews.show(5)
-orders_reviews.printSchema()
-orders_reviews.describe()
+#Read and profile table: orders_reviews
+orders_reviews = sources["order_reviews"]
 
-#Count the number of nulls per column
-orders_reviews.describe().show()
-from pyspark.sql.functions import isnan, when, count, col
-orders_reviews.select([count(when(col(c).isNull(), c)).alias(c) for c in orders_reviews.columns]).show()
+profiler.profile("order_reviews", orders_reviews)
 
 # COMMAND ----------
 
+# DBTITLE 1,Create basetable by tables above
+from blu.basetable import build_basetable, learn_vocabulary
+from blu.category_encoding import CategoryEncoder
+from blu.feature_store import FeatureStore, hash_sources
+from blu.incremental import feature_encoding, order_state, refresh_features, store_features
+from blu.ingest import read_manifest
+from blu.joins import JoinPlanner
+from blu.skew import SkewDetector
+
+feature_store = FeatureStore(spark, feature_store_dir)
+source_hash = hash_sources(spark, source_paths)
+planner = JoinPlanner(spark, skew_detector=SkewDetector() if detect_skew else None)
+
+# The basetables are built lazily, so the stage covers everything up to the checkpoint
+with stage_metrics.stage("basetable") as stage:
+    if incremental_refresh:
+        # Keep the vocabulary and category encoder of the latest version so the rebuilt orders get the stored columns
+        # (category_hash_width is not applied here), and only rebuild new and changed orders of the purchase months
+        # whose ingested partitions changed
+        vocabulary, category_encoder = feature_encoding(feature_store)
+        feature_version = refresh_features(feature_store, parquet_paths, read_manifest(spark, parquet_cache_dir), source_hash,
+                                           vocabulary, planner=planner, category_encoder=category_encoder)
+        TrainingSet, TestSet = feature_store.load_features(feature_version)
+    else:
+        # Learn the payment types and product categories once; they are stored with the feature version and saved with
+        # the model, so refreshes and scoring get the same columns
+        vocabulary = learn_vocabulary(sources)
+        # The item categories of each order become one sparse count vector (product_categories) instead of a column per category
+        category_encoder = CategoryEncoder(num_features=category_hash_width) if category_hash_width else CategoryEncoder.from_vocabulary(vocabulary)
+        if basetable_backend == "pandas" and category_encoder.hashed:
+            raise ValueError("The pandas backend has no feature hashing; set category_hash_width = None")
+
+        # Build TrainingSet (joined with the review labels) and TestSet from the union of the training and holdout tables
+        if basetable_backend == "pandas":
+            from blu import local_backend
+
+            local_sources = local_backend.read_sources({table: f"/dbfs{path}" for table, path in source_paths.items()})
+            local_train, local_test = local_backend.build_basetable(local_sources, labelled=True, vocabulary=vocabulary)
+            TrainingSet, TestSet = spark.createDataFrame(local_train), spark.createDataFrame(local_test)
+        else:
+            TrainingSet, TestSet = build_basetable(sources, labelled=True, vocabulary=vocabulary, planner=planner,
+                                                   category_encoder=category_encoder)
+
+    # Checkpoint the finished basetables: cuts the long lineage and keeps them for the profiling and display cells below
+    TrainingSet = persist_manager.checkpoint("TrainingSet", TrainingSet)
+    TestSet = persist_manager.checkpoint("TestSet", TestSet)
+    stage.output(TrainingSet)
+print(planner.skew_summary())
+TrainingSet.show(3)
+TestSet.show(3)
 
-# create dummy for good and bad review 
-orders_reviews = orders_reviews.withColumn("Target", when(col("review_score")>=4, 1).otherwise(0))
-
-orders_reviews = orders_reviews.select(col("review_id"), col("order_id"), col("review_score").cast("double"), col("Target").cast("double"))
+# COMMAND ----------
 
-orders_reviews.show(5)
+# Profile the basetables: TrainingSet has one row per order (48781)
+profiler.profile("TrainingSet", TrainingSet)
+profiler.profile("TestSet", TestSet)
 
 # COMMAND ----------
 
-# DBTITLE 1,Create basetable by tables above
-# Create TrainingSet with order data 
-TrainingSet = items.join(payments, on='order_id')
-TrainingSet = TrainingSet.join(product, on='product_id')
-TrainingSet = TrainingSet.join(orders, on='order_id')  
-TrainingSet = TrainingSet.join(orders_reviews, on = "order_id")   
-TrainingSet.show(3)
+# Write the data-quality report (JSON and HTML) and print the overview
+profiler.write_report(profile_report_path)
+for name in profiler.profiles:
+    print(profiler.summary(name))
 
-# Create TestSet with test data 
-TestSet = test_items.join(test_payments, on= 'order_id')
-TestSet = TestSet.join(test_product,on= 'product_id')
-TestSet = TestSet.join(test_orders, on = 'order_id')
-TestSet.show(3)
+# COMMAND ----------
+
+display(TrainingSet)
 
 # COMMAND ----------
 
-#Count the number of nulls per column for order_payments 
-TrainingSet.select([count(when(col(c).isNull(), c)).alias(c) for c in TrainingSet.columns]).show()
-#Count the number of nulls per column for test_order_payments 
-TestSet.select([count(when(col(c).isNull(), c)).alias(c) for c in TestSet.columns]).show()
-
-# COMMAND ----------
-
-# new variables in basetable 
-# shipping cost per kg
-TrainingSet = TrainingSet.withColumn("shipping_cost/kg", round(col("total_shipping_cost")/col("weight_kg"),2))
-TestSet = TestSet.withColumn("shipping_cost/kg", round(col("total_shipping_cost")/col("weight_kg"),2))
-
-# New variables related to product table for TrainingSet
-Trainnv = TrainingSet.groupBy("order_id").agg(
-    sum(col("weight_kg")).alias("ttl_weight"),
-    sum(col("product_name_lenght")).alias("ttl_name"),
-    sum(col("Prod_volume_m3")).alias("ttl_volume"),
-    sum(col("product_photos_qty")).alias("ttl_photo"),
-    sum(col("product_description_lenght")).alias("ttl_description"),
-    avg(col("product_name_lenght")).alias("mean_name"),
-    avg(col("product_photos_qty")).alias("mean_photo"),
-    avg(col("product_description_lenght")).alias("mean_description"),
-    (sum(col("weight_kg"))/ sum(col("Prod_volume_m3"))).alias("weight_volume"),
-    round(sum(col("product_length")) / sum(col("product_width")), 2).alias("aspect_ratio_length_width"),
-    round(sum(col("product_height")) / sum(col("product_width")), 2).alias("aspect_ratio_height_width"),
-    round(sum(col("product_photos_qty")) / sum(col("product_description_lenght")), 2).alias("photo_description_ratio")
-)
-
-# Join Trainnv with TrainingSet
-TrainingSet = TrainingSet.join(Trainnv, on="order_id").drop(
-    "weight_kg", "Prod_volume_m3", "product_photos_qty", "product_description_lenght",
-    "product_name_lenght", "product_length", "product_height", "product_width"
-)
-
-# New variables related to product table for TestSet
-testnv = TestSet.groupBy("order_id").agg(
-    sum(col("weight_kg")).alias("ttl_weight"),
-    sum(col("product_name_lenght")).alias("ttl_name"),
-    sum(col("Prod_volume_m3")).alias("ttl_volume"),
-    sum(col("product_photos_qty")).alias("ttl_photo"),
-    sum(col("product_description_lenght")).alias("ttl_description"),
-    avg(col("product_name_lenght")).alias("mean_name"),
-    avg(col("product_photos_qty")).alias("mean_photo"),
-    avg(col("product_description_lenght")).alias("mean_description"),
-    (sum(col("weight_kg"))/ sum(col("Prod_volume_m3"))).alias("weight_volume"),
-    round(sum(col("product_length")) / sum(col("product_width")), 2).alias("aspect_ratio_length_width"),
-    round(sum(col("product_height")) / sum(col("product_width")), 2).alias("aspect_ratio_height_width"),
-    round(sum(col("product_photos_qty")) / sum(col("product_description_lenght")), 2).alias("photo_description_ratio")
-)
-
-TestSet = TestSet.join(testnv, on = "order_id").drop("weight_kg", "Prod_volume_m3","product_photos_qty","product_description_lenght","product_name_lenght","product_length","product_height","product_width")
-                                    
-
-# COMMAND ----------
-
-# Drop duplicates in the TrainingSet and TestSet
-TrainingSet = TrainingSet.drop_duplicates(subset=['order_id'])
-TestSet = TestSet.drop_duplicates(subset=['order_id'])
-
-TrainingSet = TrainingSet.dropna()
-TestSet = TestSet.dropna()
-
-TrainingSet.select("order_id").distinct().count() # 48781
-TrainingSet.count() #48781
-TestSet.count()
-
-# COMMAND ----------
-
-# Define the number of photos for the products (small, okay, good) 
-not_enough = 5
-okay = 15
-TrainingSet = TrainingSet.withColumn(
-    "nbr_photo",
-    when(col("mean_photo") <= not_enough, "Minimal")
-    .when((col("mean_photo") >= not_enough) & (col("mean_photo") <= okay), "Moderate")
-    .otherwise("Abundant")
-)
-TestSet = TestSet.withColumn(
-   "nbr_photo",
-    when(col("mean_photo") <= not_enough, "Minimal")
-    .when((col("mean_photo") >= not_enough) & (col("mean_photo") <= okay), "Moderate")
-    .otherwise("Abundant")
-)
-
-# Name complexity: To categorizes products according to the length of the names []
-short_threshold =20
-medium_threshold = 50
-TrainingSet = TrainingSet.withColumn(
-    "name_length",
-    when(col("mean_name") <= short_threshold, "Short name")
-    .when((col("mean_name")>= short_threshold) & (col("mean_name") <= medium_threshold), "Medium name")
-    .otherwise("Long name")
-)
-
-TestSet = TestSet.withColumn(
-    "name_length",
-    when(col("mean_name") <= short_threshold, "Short name")
-    .when((col("mean_name")>= short_threshold) & (col("mean_name") <= medium_threshold), "Medium name")
-    .otherwise("Long name")
-)
-
-# Define the size of the product description (Short, Medium or long description)
-short_description = 500
-medium_description = 1500
-TrainingSet = TrainingSet.withColumn(
-    "description_length",
-    when(col("mean_description") <= short_description, "Short description")
-    .when((col("mean_description") >= short_description) & (col("mean_description") <= medium_description), "Medium description")
-    .otherwise("Long description")
-)
-TestSet = TestSet.withColumn(
-    "description_length",
-    when(col("mean_description") <= short_description, "Short description")
-    .when((col("mean_description") >= short_description) & (col("mean_description") <= medium_description), "Medium description")
-    .otherwise("Long description")
-)
-
-from pyspark.ml.feature import StringIndexer, OneHotEncoder
-from pyspark.ml import Pipeline
-# Create Dummy variables 
-TrainingSet = Pipeline(stages=[
-    StringIndexer(inputCols=[ "name_length", "description_length", "nbr_photo"], outputCols=["name_lengthInd", "prod_desInd", "nbr_photoInd"]),
-    OneHotEncoder(inputCols=[ "name_lengthInd", "prod_desInd", "nbr_photoInd"], outputCols=["name_length_dum", "prod_desc_dum", "nbr_photo_dum"])
-]).fit(TrainingSet).transform(TrainingSet)
-
-TestSet = Pipeline(stages=[
-    StringIndexer(inputCols=[ "name_length", "description_length", "nbr_photo"], outputCols=["name_lengthInd", "prod_desInd", "nbr_photoInd"]),
-    OneHotEncoder(inputCols=["name_lengthInd", "prod_desInd", "nbr_photoInd"], outputCols=["name_length_dum", "prod_desc_dum", "nbr_photo_dum"])
-]).fit(TestSet).transform(TestSet)
-
-
-# COMMAND ----------
-
-# Create dummy variables for training set
-category_name_train = TrainingSet.groupBy("order_id", "product_category_name")
-pivoted_train = category_name_train.pivot("product_category_name").agg(count("product_category_name"))
-pivoted_train = pivoted_train.na.fill(0)
-TrainingSet = TrainingSet.join(pivoted_train, on="order_id")
-
-# Create dummy variables for test set
-category_name_test = TestSet.groupBy("order_id", "product_category_name")
-pivoted_test = category_name_test.pivot("product_category_name").agg(count("product_category_name"))
-pivoted_test = pivoted_test.na.fill(0)
-TestSet = TestSet.join(pivoted_test, on="order_id")
-
-# COMMAND ----------
-
-TrainingSet = TrainingSet.withColumn("ttl_name", col("ttl_name").cast("double"))
-TrainingSet = TrainingSet.withColumn("ttl_description",col('ttl_description').cast("double"))
-TrainingSet = TrainingSet.withColumn("ttl_photo",col('ttl_photo').cast("double"))
-TestSet = TestSet.withColumn("ttl_name", col("ttl_name").cast("double"))
-TestSet = TestSet.withColumn("ttl_description",col('ttl_description').cast("double"))
-TestSet = TestSet.withColumn("ttl_photo",col('ttl_photo').cast("double"))
-
-# COMMAND ----------
-
-# Drop unnecessary columns
-TrainingSet = TrainingSet.drop("product_category_name","name_lengthInd", "prod_desInd", "nbr_photoInd","name_length", "description_length", "nbr_photo")
-TestSet = TestSet.drop("product_category_name","name_lengthInd", "prod_desInd", "nbr_photoInd","name_length", "description_length", "nbr_photo")
-
-#Count the number of nulls per column for order_payments 
-TrainingSet.select([count(when(col(c).isNull(), c)).alias(c) for c in TrainingSet.columns]).show()
-#Count the number of nulls per column for test_order_payments 
-TestSet.select([count(when(col(c).isNull(), c)).alias(c) for c in TestSet.columns]).show()
+display(TestSet)
 
 # COMMAND ----------
 
-display(TrainingSet)
+# Check the pandas basetables against the Spark build of the same sources (pandas backend only)
+if basetable_backend == "pandas" and not incremental_refresh:
+    spark_train, spark_test = build_basetable(sources, labelled=True, vocabulary=vocabulary)
+    print("TrainingSet:", local_backend.check_parity(local_train, spark_train))
+    print("TestSet:", local_backend.check_parity(local_test, spark_test))
 
 # COMMAND ----------
 
-display(TestSet)
+# Store the basetables as a new feature version (Parquet segmented by purchase month, keyed by build time and a hash of
+# the source files), with the per-order fingerprints and the ingest manifest the next incremental refresh compares against,
+# and the vocabulary and category encoder the basetables were built with
+if not incremental_refresh:
+    feature_version = store_features(feature_store, source_hash, order_state(sources), read_manifest(spark, parquet_cache_dir),
+                                     vocabulary, category_encoder, TrainingSet=TrainingSet, TestSet=TestSet)
+print("Feature version:", feature_version)
 
 # COMMAND ----------
 
@@ -602,226 +300,167 @@ display(TestSet)
 
 # COMMAND ----------
 
-TrainingSet = spark.read.format("csv").option("header", "True").option("inferSchema", "True").option("escape", "\"").load("/FileStore/TrainingSet.csv")
-TestSet = spark.read.format("csv").option("header", "True").option("inferSchema", "True").option("escape", "\"").load("/FileStore/TestSet.csv")
+from blu.feature_store import FeatureStore
+from blu.incremental import feature_encoding
+
+# Load the basetables from the feature store (None = latest version; set a version string to reproduce an older run)
+feature_version = None
+feature_store = FeatureStore(spark, feature_store_dir)
+TrainingSet, TestSet = feature_store.load_features(feature_version)
+# The vocabulary and the positions of the categories in the product_categories vector this version was built with
+vocabulary, category_encoder = feature_encoding(feature_store, feature_version)
 
 # COMMAND ----------
 
-from scipy.stats import pearsonr
+from blu.feature_selection import numeric_columns, screen_features, selected_features
 
-# Columns to exclude (also exclude dummies, seems can't know the p-value)
-columns_to_exclude = ["order_id", "product_id", "review_id", "customer_id", "name_length_dum", "prod_desc_dum", "nbr_photo_dum","scaledNumericalFeatures"]
-target_column = 'Target'
-columns_selected = [column for column in TrainingSet.columns if column != target_column and column not in columns_to_exclude]
+# Columns to exclude (ids, the dummy vectors and the two targets)
+columns_to_exclude = ["order_id", "product_id", "review_id", "customer_id", "name_length_dum", "prod_desc_dum", "nbr_photo_dum", "scaledNumericalFeatures", "Target", "review_score"]
+columns_selected = numeric_columns(TrainingSet, exclude=columns_to_exclude)
+# The category counts are screened as columns expanded from the product_categories vector, only for this one job
+# (hashed positions have no category names, so with feature hashing the categories are not screened)
+screened_categories = [] if category_encoder.hashed else category_encoder.categories
+screening_set = TrainingSet.select(*columns_selected, *category_encoder.category_columns(screened_categories), "Target", "review_score")
 
 # Define the significance threshold
 significance_threshold = 0.001
 
-# Initialize a list to store selected features
-selected_features = []
-
-# Calculate Pearson correlation and p-value for each feature
-for column in columns_selected:
-    if column != target_column:
-        pearson_corr = TrainingSet.stat.corr(column, target_column)
-        feature_column = TrainingSet.select(column).rdd.flatMap(lambda x: [float(i) for i in x]).collect()
-        label_column = TrainingSet.select(target_column).rdd.flatMap(lambda x: [float(i) for i in x]).collect()
-        _, p_value = pearsonr(feature_column, label_column)
-        print(f"{column} - p-value = {p_value} - selected: {1 if p_value < significance_threshold else 0}")
-        if p_value < significance_threshold:
-            selected_features.append(column)
+# Pearson correlation and p-value of every feature with both targets, computed in one Spark job
+with stage_metrics.stage("feature_selection"):
+    feature_ranking = screen_features(screening_set, columns_selected + screened_categories, ["Target", "review_score"], significance=significance_threshold)
+display(feature_ranking[feature_ranking["target"] == "Target"])
 
 # Print the selected features
-print("\nSelected Features:", selected_features)
+print("\nSelected Features:", selected_features(feature_ranking, "Target"))
 
 # COMMAND ----------
 
-Selected_Features = ['total_price', 'total_shipping_cost', 'total_cost', 'shipping_cost%', 'max_order_item_id', 'num_unique_products_per_id', 'credit_card', 'mobile', 'pay_with_installment', 'approve_efficiency', 'package_efficiency', 'delivery_efficiency', 'on_time', 'total_delivery_time', 'shipping_cost/kg', 'ttl_weight', 'ttl_name', 'ttl_volume', 'ttl_photo', 'ttl_description', 'mean_name', 'mean_description', 'audio', 'bed_bath_table', 'books_general_interest', 'cool_stuff', 'furniture_decor', 'luggage_accessories', 'office_furniture', 'sports_leisure', 'stationery', 'toys']
-Features_and_label = Selected_Features + ["review_score","Target"]
-Features_and_label_Test = Selected_Features + ["order_id"]
+from blu.preprocessing import input_columns
+
+Selected_Features = ['total_price', 'total_shipping_cost', 'total_cost', 'shipping_cost%', 'max_order_item_id', 'num_unique_products_per_id', 'credit_card', 'mobile', 'pay_with_installment', 'approve_efficiency', 'package_efficiency', 'delivery_efficiency', 'on_time', 'total_delivery_time', 'shipping_cost/kg', 'ttl_weight', 'ttl_name', 'ttl_volume', 'ttl_photo', 'ttl_description', 'mean_name', 'mean_description']
+# Product categories whose counts are sliced out of the product_categories vector
+Selected_Categories = ['audio', 'bed_bath_table', 'books_general_interest', 'cool_stuff', 'furniture_decor', 'luggage_accessories', 'office_furniture', 'sports_leisure', 'stationery', 'toys']
+Features_and_label = input_columns(Selected_Features, categories=Selected_Categories) + ["review_score","Target"]
+Features_and_label_Test = input_columns(Selected_Features, categories=Selected_Categories) + ["order_id"]
 dTrain = TrainingSet.select(*Features_and_label)
 dTest = TestSet.select(*Features_and_label_Test)
 
 
 # COMMAND ----------
 
-from pyspark.ml.feature import RFormula
-train = RFormula(formula="Target ~ . -review_score - order_id").fit(dTrain).transform(dTrain)
-test = RFormula(formula="Target ~ . - review_score - order_id").fit(dTest).transform(dTest)
-
-# COMMAND ----------
-
-from pyspark.ml.feature import VectorAssembler
-from pyspark.ml.feature import StandardScaler
-
-# VectorAssembler to combine numerical variables into a single vector column
-assembler = VectorAssembler(inputCols=Selected_Features, outputCol="numericalFeatures")
-assembled_Train = assembler.transform(train)
-assembled_Test = assembler.transform(test)
-# StandardScaler to scale the numerical features
-scaler = StandardScaler(inputCol="numericalFeatures", outputCol="scaleFeatures", withStd=True, withMean=False)
-scaler_model = scaler.fit(assembled_Train)
-scaler_model_test = scaler.fit(assembled_Test)
-train = scaler_model.transform(assembled_Train).drop("numericalFeatures")
-test = scaler_model_test.transform(assembled_Test).drop("numericalFeatures")
+from blu.preprocessing import build_preprocessing
 
+# Binned description sizes (fixed thresholds; learn_thresholds=True learns them as quantiles), the selected category
+# counts, VectorAssembler and StandardScaler, fitted once on the training data only
+# (Target is used as the label directly); the holdout is scored with this same fitted model at the end
+preprocessing_model = build_preprocessing(Selected_Features, categories=Selected_Categories,
+                                          category_encoder=category_encoder).fit(dTrain)
+train = preprocessing_model.transform(dTrain).drop("numericalFeatures")
 
 # COMMAND ----------
 
 
 rTrain, rValidation= train.randomSplit([0.7,0.3], seed=123)
 
+# Every model below fits on rTrain and is evaluated on rValidation
+binary_models = ["gbt", "lr", "rf", "svm", "dt"]
+rTrain = persist_manager.persist("rTrain", rTrain, consumers=binary_models)
+rValidation = persist_manager.persist("rValidation", rValidation, consumers=binary_models)
+
 
 # COMMAND ----------
 
 from pyspark.ml.classification import GBTClassifier
-from pyspark.ml.evaluation import BinaryClassificationEvaluator, MulticlassClassificationEvaluator
+from blu.evaluation import evaluate_predictions, format_metrics
 
 gbt_model = GBTClassifier(featuresCol="scaleFeatures", labelCol="Target").fit(rTrain)
 
 gbt_pred = gbt_model.transform(rValidation)
 
-AUC_gbt = BinaryClassificationEvaluator(metricName="areaUnderROC").evaluate(gbt_pred)
-Precision_gbt = MulticlassClassificationEvaluator(metricName='weightedPrecision').evaluate(gbt_pred)
-Recall_gbt = MulticlassClassificationEvaluator(metricName="weightedRecall").evaluate(gbt_pred)
-f1_gbt = MulticlassClassificationEvaluator(metricName="f1").evaluate(gbt_pred)
+# AUC, precision, recall and F1 from one pass over the predictions
+gbt_metrics = evaluate_predictions(gbt_pred, label_col="Target", binary=True)
+print(format_metrics(gbt_metrics, ["areaUnderROC", "areaUnderPR", "weightedPrecision", "weightedRecall", "f1"]))
+print("Confusion matrix:", gbt_metrics["confusion_matrix"])
 
-print("AUC:", AUC_gbt)
-print("Precision:", Precision_gbt)
-print("Recall:", Recall_gbt)
-print("F1 Score:", f1_gbt)
+persist_manager.done("gbt")
 
 
 # COMMAND ----------
 
-from pyspark.ml import Pipeline
-from pyspark.ml.tuning import CrossValidator, ParamGridBuilder
+from pyspark.ml.tuning import ParamGridBuilder
 from pyspark.ml.evaluation import BinaryClassificationEvaluator
-from pyspark.ml.classification import LogisticRegression
+from pyspark.ml.classification import LogisticRegression, RandomForestClassifier, LinearSVC, DecisionTreeClassifier
+from blu.model_search import ModelSearch
 
 lr = LogisticRegression(featuresCol="scaleFeatures", labelCol="Target")
+rf = RandomForestClassifier(featuresCol="scaleFeatures", labelCol="Target")
+svm = LinearSVC(featuresCol="scaleFeatures", labelCol="Target", standardization=False, maxIter=10)
+dt = DecisionTreeClassifier(featuresCol="scaleFeatures", labelCol="Target", maxDepth=5)
 
-cvlr = CrossValidator()\
-  .setEstimator(lr)\
-  .setEstimatorParamMaps(ParamGridBuilder().addGrid(lr.regParam, [0.1, 0.01]).addGrid(lr.maxIter, [50, 100, 150]).build())\
-  .setEvaluator(BinaryClassificationEvaluator())\
-  .setNumFolds(5)
+# 5-fold cross validation of all four grids at once: the folds are split and cached once and the fits run concurrently
+search = ModelSearch({
+    "lr": (lr, ParamGridBuilder().addGrid(lr.regParam, [0.1, 0.01]).addGrid(lr.maxIter, [50, 100, 150]).build()),
+    "rf": (rf, ParamGridBuilder().addGrid(rf.maxDepth, [5, 10]).addGrid(rf.numTrees, [20, 50, 100]).build()),
+    "svm": (svm, ParamGridBuilder().addGrid(svm.regParam, [0.1, 0.01]).addGrid(svm.maxIter, [50, 100, 150]).build()),
+    "dt": (dt, ParamGridBuilder().addGrid(dt.maxDepth, [5, 10, 15]).build()),
+}, evaluator=BinaryClassificationEvaluator(labelCol="Target"), num_folds=5, seed=123)
+
+with stage_metrics.stage("model_search", inputs={"rTrain": rTrain}):
+    search_result = search.fit(rTrain)
+display(search_result.leaderboard)
 
-cvlrModel = cvlr.fit(rTrain)
+# Best model of each estimator, refitted on the full rTrain
+cvlrModel = search_result.best_models["lr"]
+cv_rf_model = search_result.best_models["rf"]
+cvsvmModel = search_result.best_models["svm"]
+cvdtModel = search_result.best_models["dt"]
 
 # Get parameters that had the best performance
-print("Best LR model:")  
-print("** regParam: " + str(cvlrModel.bestModel.getRegParam()))
-print("** maxIter: " + str(cvlrModel.bestModel.getMaxIter()))
+print("Best LR model:", search_result.best_params["lr"])
 
 # COMMAND ----------
 
 lr_preds = cvlrModel.transform(rValidation)
 
-AUC_lr = BinaryClassificationEvaluator(metricName="areaUnderROC").evaluate(lr_preds)
-Precision_lr = MulticlassClassificationEvaluator(metricName='weightedPrecision').evaluate(lr_preds)
-Recall_lr = MulticlassClassificationEvaluator(metricName="weightedRecall").evaluate(lr_preds)
-f1_lr = MulticlassClassificationEvaluator(metricName="f1").evaluate(lr_preds)
+# AUC, precision, recall and F1 from one pass over the predictions
+lr_metrics = evaluate_predictions(lr_preds, label_col="Target", binary=True)
+print(format_metrics(lr_metrics, ["areaUnderROC", "areaUnderPR", "weightedPrecision", "weightedRecall", "f1"]))
+print("Confusion matrix:", lr_metrics["confusion_matrix"])
 
-print("AUC :", AUC_lr)
-print("Precision :", Precision_lr)
-print("Recall :", Recall_lr)
-print("F1_score :", f1_lr)
-
-# COMMAND ----------
-
-from pyspark.ml.classification import RandomForestClassifier
-from pyspark.ml.tuning import CrossValidator, ParamGridBuilder
-from pyspark.ml.evaluation import BinaryClassificationEvaluator
-
-# Assuming you have a RandomForestClassifier
-rf = RandomForestClassifier(featuresCol="scaleFeatures", labelCol="Target")
-
-cv_rf = CrossValidator()\
-  .setEstimator(rf)\
-  .setEstimatorParamMaps(ParamGridBuilder().addGrid(rf.maxDepth, [5, 10]).addGrid(rf.numTrees, [20, 50, 100]).build())\
-  .setEvaluator(BinaryClassificationEvaluator())\
-  .setNumFolds(5)
-
-cv_rf_model = cv_rf.fit(rTrain)
+persist_manager.done("lr")
 
 # COMMAND ----------
 
 rf_pred = cv_rf_model.transform(rValidation)
 
-AUC_rf = BinaryClassificationEvaluator(metricName="areaUnderROC").evaluate(rf_pred)
-Precision_rf = MulticlassClassificationEvaluator(metricName='weightedPrecision').evaluate(rf_pred)
-Recall_rf = MulticlassClassificationEvaluator(metricName="weightedRecall").evaluate(rf_pred)
-f1_rf = MulticlassClassificationEvaluator(metricName="f1").evaluate(rf_pred)
+# AUC, precision, recall and F1 from one pass over the predictions
+rf_metrics = evaluate_predictions(rf_pred, label_col="Target", binary=True)
+print(format_metrics(rf_metrics, ["areaUnderROC", "areaUnderPR", "weightedPrecision", "weightedRecall", "f1"]))
+print("Confusion matrix:", rf_metrics["confusion_matrix"])
 
-print("AUC :", AUC_rf)
-print("Precision :", Precision_rf)
-print("Recall :", Recall_rf)
-print("F1_score :", f1_rf)
-
-# COMMAND ----------
-
-from pyspark.ml.classification import LinearSVC
-from pyspark.ml.evaluation import BinaryClassificationEvaluator
-from pyspark.ml.tuning import CrossValidator, ParamGridBuilder
-
-# Assuming you have a LinearSVC model
-svm = LinearSVC(featuresCol="scaleFeatures", labelCol="Target", standardization=False, maxIter=10)
-
-cvsvm = CrossValidator()\
-  .setEstimator(svm)\
-  .setEstimatorParamMaps(ParamGridBuilder().addGrid(svm.regParam, [0.1, 0.01]).addGrid(svm.maxIter, [50, 100, 150]).build())\
-  .setEvaluator(BinaryClassificationEvaluator())\
-  .setNumFolds(5)
-
-cvsvmModel = cvsvm.fit(rTrain)
+persist_manager.done("rf")
 
 # COMMAND ----------
 
 svm_pred = cvsvmModel.transform(rValidation)
 
-AUC_svm = BinaryClassificationEvaluator(metricName="areaUnderROC").evaluate(svm_pred)
-Precision_svm = MulticlassClassificationEvaluator(metricName='weightedPrecision').evaluate(svm_pred)
-Recall_svm = MulticlassClassificationEvaluator(metricName="weightedRecall").evaluate(svm_pred)
-f1_svm = MulticlassClassificationEvaluator(metricName="f1").evaluate(svm_pred)
+# AUC, precision, recall and F1 from one pass over the predictions
+svm_metrics = evaluate_predictions(svm_pred, label_col="Target", binary=True)
+print(format_metrics(svm_metrics, ["areaUnderROC", "areaUnderPR", "weightedPrecision", "weightedRecall", "f1"]))
+print("Confusion matrix:", svm_metrics["confusion_matrix"])
 
-print("AUC :", AUC_svm)
-print("Precision :", Precision_svm)
-print("Recall :", Recall_svm)
-print("F1_score :", f1_svm)
-
-# COMMAND ----------
-
-from pyspark.ml.classification import DecisionTreeClassifier
-from pyspark.ml.evaluation import BinaryClassificationEvaluator
-from pyspark.ml.tuning import CrossValidator, ParamGridBuilder
-
-# Assuming you have already prepared your training data in 'rTrain'
-dt = DecisionTreeClassifier(featuresCol="scaleFeatures", labelCol="Target", maxDepth=5)
-
-# Create a CrossValidator
-cvdt = CrossValidator() \
-    .setEstimator(dt) \
-    .setEstimatorParamMaps(ParamGridBuilder().addGrid(dt.maxDepth, [5, 10, 15]).build()) \
-    .setEvaluator(BinaryClassificationEvaluator()) \
-    .setNumFolds(5)
-
-# Fit the model
-cvdtModel = cvdt.fit(rTrain)
+persist_manager.done("svm")
 
 # COMMAND ----------
 
 dt_pred = cvdtModel.transform(rValidation)
 
-AUC_dt = BinaryClassificationEvaluator(metricName="areaUnderROC").evaluate(dt_pred)
-Precision_dt = MulticlassClassificationEvaluator(metricName='weightedPrecision').evaluate(dt_pred)
-Recall_dt = MulticlassClassificationEvaluator(metricName="weightedRecall").evaluate(dt_pred)
-f1_dt = MulticlassClassificationEvaluator(metricName="f1").evaluate(dt_pred)
+# AUC, precision, recall and F1 from one pass over the predictions
+dt_metrics = evaluate_predictions(dt_pred, label_col="Target", binary=True)
+print(format_metrics(dt_metrics, ["areaUnderROC", "areaUnderPR", "weightedPrecision", "weightedRecall", "f1"]))
+print("Confusion matrix:", dt_metrics["confusion_matrix"])
 
-print("AUC :", AUC_dt)
-print("Precision :", Precision_dt)
-print("Recall :", Recall_dt)
-print("F1_score :", f1_dt)
+persist_manager.done("dt")
 
 # COMMAND ----------
 
@@ -831,86 +470,50 @@ print("F1_score :", f1_dt)
 # COMMAND ----------
 
 # DBTITLE 1,multi-class classification
-from scipy.stats import pearsonr
-
-# Columns to exclude (also exclude dummies)
-columns_to_exclude = ["order_id", "product_id", "review_id", "customer_id", "name_length_dum", "prod_desc_dum", "nbr_photo_dum", "Target", "scaledNumericalFeatures"]
-target_column = 'review_score'
-columns_selected = [column for column in TrainingSet.columns if column != target_column and column not in columns_to_exclude]
-
-# Define the significance threshold
-significance_threshold = 0.001
-
-# Initialize a list to store selected features
-selected_features = []
-
-# Calculate Pearson correlation and p-value for each feature
-for column in columns_selected:
-    if column != target_column:
-        feature_column = TrainingSet.select(column).rdd.flatMap(lambda x: [float(i) for i in x]).collect()
-        label_column = TrainingSet.select(target_column).rdd.flatMap(lambda x: [float(i) for i in x]).collect()
-
-        # Handle NaN in correlation
-        try:
-            pearson_corr = TrainingSet.stat.corr(column, target_column)
-        except:
-            pearson_corr = 0.0  # Set to 0 if correlation is NaN
-
-        _, p_value = pearsonr(feature_column, label_column)
-        print(f"{column} - Correlation = {pearson_corr:.4f}, p-value = {p_value:.4f} - selected: {1 if p_value < significance_threshold else 0}")
-        
-        if p_value < significance_threshold:
-            selected_features.append(column)
+# The review_score correlations were computed together with the Target ones above
+display(feature_ranking[feature_ranking["target"] == "review_score"])
 
 # Print the selected features
-print("\nSelected Features:", selected_features)
-
+print("\nSelected Features:", selected_features(feature_ranking, "review_score"))
 
 # COMMAND ----------
 
-Features = ['total_price', 'total_shipping_cost', 'total_cost', 'shipping_cost%', 'max_order_item_id', 'num_unique_products_per_id', 'credit_card', 'mobile', 'pay_with_installment', 'approve_efficiency', 'package_efficiency', 'delivery_efficiency', 'on_time', 'total_delivery_time', 'shipping_cost/kg', 'ttl_weight', 'ttl_name', 'ttl_volume', 'ttl_photo', 'ttl_description', 'mean_name', 'aspect_ratio_length_width', 'bed_bath_table', 'books_general_interest', 'computers_accessories', 'cool_stuff', 'fashion_male_clothing', 'furniture_decor', 'health_beauty', 'luggage_accessories', 'office_furniture', 'perfumery', 'sports_leisure', 'toys']
-Features_label = Features + ["review_score","order_id"]
-Features_label_test = Features + ["order_id"]
+Features = ['total_price', 'total_shipping_cost', 'total_cost', 'shipping_cost%', 'max_order_item_id', 'num_unique_products_per_id', 'credit_card', 'mobile', 'pay_with_installment', 'approve_efficiency', 'package_efficiency', 'delivery_efficiency', 'on_time', 'total_delivery_time', 'shipping_cost/kg', 'ttl_weight', 'ttl_name', 'ttl_volume', 'ttl_photo', 'ttl_description', 'mean_name', 'aspect_ratio_length_width']
+Categories = ['bed_bath_table', 'books_general_interest', 'computers_accessories', 'cool_stuff', 'fashion_male_clothing', 'furniture_decor', 'health_beauty', 'luggage_accessories', 'office_furniture', 'perfumery', 'sports_leisure', 'toys']
+Features_label = input_columns(Features, categories=Categories) + ["review_score","order_id"]
+Features_label_test = input_columns(Features, categories=Categories) + ["order_id"]
 mcTrain = TrainingSet.select(*Features_label)
 mcTest = TestSet.select(*Features_label_test)
 
 # COMMAND ----------
 
-from pyspark.ml.feature import RFormula
-mtrain = RFormula(formula="review_score ~ . - order_id").fit(mcTrain).transform(mcTrain)
-mtest = RFormula(formula="review_score ~ . -order_id").fit(mcTest).transform(mcTest)
-
-# COMMAND ----------
-
-from pyspark.ml.feature import VectorAssembler
-from pyspark.ml.feature import StandardScaler
-
-# VectorAssembler to combine numerical variables into a single vector column
-assembler = VectorAssembler(inputCols=Selected_Features, outputCol="numericalFeatures")
-assembled_Train = assembler.transform(mtrain)
-
-# StandardScaler to scale the numerical features
-scaler = StandardScaler(inputCol="numericalFeatures", outputCol="scaleFeatures", withStd=True, withMean=False)
-scaler_model = scaler.fit(assembled_Train)
-mtrain = scaler_model.transform(assembled_Train).drop("numericalFeatures")
+# Same preprocessing chain for the multi-class features, fitted on the training data
+mc_preprocessing_model = build_preprocessing(Features, categories=Categories, category_encoder=category_encoder).fit(mcTrain)
+mtrain = mc_preprocessing_model.transform(mcTrain).drop("numericalFeatures")
 
 # COMMAND ----------
 
 
 mTrain, mValidation = mtrain.randomSplit([0.7, 0.3],seed=123)
 
+multiclass_models = ["mlr", "mrf"]
+mTrain = persist_manager.persist("mTrain", mTrain, consumers=multiclass_models)
+mValidation = persist_manager.persist("mValidation", mValidation, consumers=multiclass_models)
+
 # COMMAND ----------
 
 from pyspark.ml.classification import LogisticRegression
 from pyspark.ml.evaluation import MulticlassClassificationEvaluator
-from pyspark.ml.tuning import CrossValidator, ParamGridBuilder
+from pyspark.ml.tuning import ParamGridBuilder
+from blu.tuning import SuccessiveHalvingCV
 
 mlr = LogisticRegression(featuresCol="scaleFeatures", labelCol="review_score", family="multinomial")
 
-cvmlr = CrossValidator()\
+# Successive halving: all grid points start on 10% of one fold, only the best third moves on to 3x more data
+cvmlr = SuccessiveHalvingCV(eta=3.0, minFraction=0.1)\
   .setEstimator(mlr)\
   .setEstimatorParamMaps(ParamGridBuilder().addGrid(mlr.regParam, [0.1, 0.01]).addGrid(mlr.maxIter, [50, 100, 150]).build())\
-  .setEvaluator(MulticlassClassificationEvaluator())\
+  .setEvaluator(MulticlassClassificationEvaluator(labelCol="review_score"))\
   .setNumFolds(5)
 
 cvmlrModel = cvmlr.fit(mTrain)
@@ -919,30 +522,28 @@ cvmlrModel = cvmlr.fit(mTrain)
 
 mlr_pred = cvmlrModel.transform(mValidation)
 
-accuracy_mlr = MulticlassClassificationEvaluator(metricName='accuracy').evaluate(mlogreg_pred)
-weightedPrecision_mlr = MulticlassClassificationEvaluator(metricName='weightedPrecision').evaluate(mlogreg_pred)
-weightedRecall_mlr = MulticlassClassificationEvaluator(metricName='weightedRecall').evaluate(mlogreg_pred)
-f1_mlr = MulticlassClassificationEvaluator(metricName='f1').evaluate(mlogreg_pred)
+# Accuracy, weighted precision/recall/F1 and the 5x5 confusion matrix from one pass over the predictions
+mlr_metrics = evaluate_predictions(mlr_pred, label_col="review_score", binary=False)
+print(format_metrics(mlr_metrics, ["accuracy", "weightedPrecision", "weightedRecall", "f1"]))
+print("Confusion matrix:", mlr_metrics["confusion_matrix"])
 
-print("Accuracy:", accuracy_mlr)
-print("Weighted Precision:", weightedPrecision_mlr)
-print("Weighted Recall:", weightedRecall_mlr)
-print("F1 Score:", f1_mlr)
+persist_manager.done("mlr")
 
 
 # COMMAND ----------
 
 from pyspark.ml.classification import RandomForestClassifier
-from pyspark.ml.tuning import CrossValidator, ParamGridBuilder
+from pyspark.ml.tuning import ParamGridBuilder
 from pyspark.ml.evaluation import MulticlassClassificationEvaluator
+from blu.tuning import SuccessiveHalvingCV
 
 # Assuming 'review_score' is your label column
 mrf = RandomForestClassifier(featuresCol="scaleFeatures", labelCol="review_score")
 
-cv_mrf = CrossValidator()\
+cv_mrf = SuccessiveHalvingCV(eta=3.0, minFraction=0.1)\
   .setEstimator(mrf)\
   .setEstimatorParamMaps(ParamGridBuilder().addGrid(mrf.maxDepth, [5, 10]).addGrid(mrf.numTrees, [20, 50, 100]).build())\
-  .setEvaluator(MulticlassClassificationEvaluator())\
+  .setEvaluator(MulticlassClassificationEvaluator(labelCol="review_score"))\
   .setNumFolds(5)
 
 cv_mrf_model = cv_mrf.fit(mTrain)
@@ -952,15 +553,12 @@ cv_mrf_model = cv_mrf.fit(mTrain)
 
 mrf_pred = cv_mrf_model.transform(mValidation)
 
-accuracy_mrf = MulticlassClassificationEvaluator(metricName='accuracy').evaluate(mrf_pred)
-weightedPrecision_mrf = MulticlassClassificationEvaluator(metricName='weightedPrecision').evaluate(mrf_pred)
-weightedRecall_mrf = MulticlassClassificationEvaluator(metricName='weightedRecall').evaluate(mrf_pred)
-f1_mrf = MulticlassClassificationEvaluator(metricName='f1').evaluate(mrf_pred)
+# Accuracy, weighted precision/recall/F1 and the 5x5 confusion matrix from one pass over the predictions
+mrf_metrics = evaluate_predictions(mrf_pred, label_col="review_score", binary=False)
+print(format_metrics(mrf_metrics, ["accuracy", "weightedPrecision", "weightedRecall", "f1"]))
+print("Confusion matrix:", mrf_metrics["confusion_matrix"])
 
-print("Accuracy:", accuracy_mrf)
-print("Weighted Precision:", weightedPrecision_mrf)
-print("Weighted Recall:", weightedRecall_mrf)
-print("F1 Score:", f1_mrf)
+persist_manager.done("mrf")
 
 # COMMAND ----------
 
@@ -969,11 +567,20 @@ print("F1 Score:", f1_mrf)
 
 # COMMAND ----------
 
-output_pred = cv_rf_model.transform(test)
-output_pred = output_pred.withColumnRenamed("prediction","pred_review_score")
-display(output_pred.select("order_id", "pred_review_score"))
+from blu.preprocessing import save_model, scoring_model
 
+# Package the fitted preprocessing and the selected classifier as one PipelineModel and save it for batch scoring,
+# next to the vocabulary and category encoder of the feature version it was trained on
+rf_scoring_model = scoring_model(preprocessing_model, cv_rf_model)
+save_model(rf_scoring_model, f"{model_dir}/pipeline")
+vocabulary.save(spark, vocabulary_path)
+category_encoder.save(spark, category_encoder_path)
 
+# Scoring is a single transform, nothing is fitted on the holdout
+with stage_metrics.stage("scoring") as stage:
+    output_pred = rf_scoring_model.transform(dTest)
+    output_pred = stage.output(output_pred.withColumnRenamed("prediction","pred_review_score"))
+    display(output_pred.select("order_id", "pred_review_score"))
 
 # COMMAND ----------
 
@@ -981,5 +588,25 @@ output_pred.groupBy("pred_review_score").count().show()
 
 # COMMAND ----------
 
+# Export the random forest and its preprocessing for Spark-free scoring of single orders (NumPy only),
+# and check that it gives the same predictions as the Spark model on the holdout set
+from blu.local_scorer import LocalScorer, check_parity, export_model
+
+local_model_path = "/dbfs/FileStore/models/blu/local_rf.npz"
+export_model(spark, rf_scoring_model, local_model_path, work_dir=f"{model_dir}/export")
+local_scorer = LocalScorer.load(local_model_path)
+print(check_parity(local_scorer, output_pred, prediction_col="pred_review_score"))
+
+# COMMAND ----------
+
+print(persist_manager.report())
+persist_manager.release_all()
+
+# Per-stage time, rows, Spark jobs/stages, shuffle and spill of this run
+print(stage_metrics.summary_table())
+stage_metrics.write_json(stage_metrics_path)
+
+# COMMAND ----------
+
 # MAGIC %md
 # MAGIC ---- Thank you for your reading ----
@@ -0,0 +1,5 @@
+"""Reusable building blocks for the BLU review-sentiment pipeline.
+
+The Databricks notebook ``BDT_2024_XIAO_ONUOHA_RAAVI.py`` imports from this
+package so that the same code can run outside the notebook.
+"""
@@ -0,0 +1,79 @@
+"""Order-level aggregation engine.
+
+All per-order features of a detail table (item rows, payment rows) are
+computed by one ``groupBy(order keys).agg(...)``: plain aggregates, ratios of
+sums and pivot-style per-value sums. That is one shuffle and one row per
+order, so nothing has to be joined back onto the detail rows or deduplicated
+afterwards.
+"""
+
+from collections import namedtuple
+
+from pyspark.sql.functions import avg, col, countDistinct, first, lit, round, sum, when
+from pyspark.sql.functions import max as max_
+
+# Pivot-style aggregate: one column per value of ``column`` holding
+# ``sum(value)`` over the rows with that value (``value=None`` counts rows).
+# ``values`` normally comes from a saved ``blu.vocabulary.Vocabulary``.
+PivotSpec = namedtuple("PivotSpec", ["column", "values", "value"])
+
+
+def order_item_aggregates():
+    """Per-order aggregates of the item rows joined with their product."""
+    price, shipping = sum("price"), sum("shipping_cost")
+    weight, volume = sum("weight_kg"), sum("Prod_volume_m3")
+    photos, description = sum("product_photos_qty"), sum("product_description_lenght")
+    return [
+        first("product_id").alias("product_id"),
+        round(price, 2).alias("total_price"),
+        round(shipping, 2).alias("total_shipping_cost"),
+        round(price + shipping, 2).alias("total_cost"),
+        round(shipping / (price + shipping), 2).alias("shipping_cost%"),
+        max_("order_item_id").cast("double").alias("max_order_item_id"),
+        countDistinct("product_id").cast("double").alias("num_unique_products_per_id"),
+        round(shipping / weight, 2).alias("shipping_cost/kg"),
+        weight.alias("ttl_weight"),
+        sum("product_name_lenght").cast("double").alias("ttl_name"),
+        volume.alias("ttl_volume"),
+        photos.cast("double").alias("ttl_photo"),
+        description.cast("double").alias("ttl_description"),
+        avg("product_name_lenght").alias("mean_name"),
+        avg("product_photos_qty").alias("mean_photo"),
+        avg("product_description_lenght").alias("mean_description"),
+        (weight / volume).alias("weight_volume"),
+        round(sum("product_length") / sum("product_width"), 2).alias("aspect_ratio_length_width"),
+        round(sum("product_height") / sum("product_width"), 2).alias("aspect_ratio_height_width"),
+        round(photos / description, 2).alias("photo_description_ratio"),
+    ]
+
+
+def payment_aggregates():
+    """Per-order aggregates of the payment rows (the amounts per type are a pivot)."""
+    return [max_((col("payment_installments") > 1).cast("double")).alias("pay_with_installment")]
+
+
+def distinct_values(df, column):
+    """Sorted non-null values of ``column`` (the job Spark runs for an open pivot)."""
+    return sorted(row[0] for row in df.select(column).where(col(column).isNotNull()).distinct().collect())
+
+
+def _pivot_columns(pivot):
+    value = lit(1) if pivot.value is None else col(pivot.value)
+    return [
+        sum(when(col(pivot.column) == v, value).otherwise(0)).alias(str(v))
+        for v in pivot.values
+    ]
+
+
+def aggregate_orders(df, keys, aggregates, pivots=()):
+    """Aggregate ``df`` to one row per ``keys`` in a single ``groupBy``.
+
+    ``pivots`` is a list of ``PivotSpec``; a spec whose ``values`` is ``None``
+    takes the distinct values of its column from ``df`` first.
+    """
+    exprs = list(aggregates)
+    for pivot in pivots:
+        if pivot.values is None:
+            pivot = pivot._replace(values=distinct_values(df, pivot.column))
+        exprs.extend(_pivot_columns(pivot))
+    return df.groupBy(*keys).agg(*exprs)
@@ -0,0 +1,175 @@
+"""Basetable construction shared by the training and the holdout data.
+
+The training tables (``products``, ``orders``, ``order_items``,
+``order_payments``, ``order_reviews``) and the holdout tables (the same names
+with a ``test_`` prefix) are unioned and tagged with a ``split`` column, so
+every aggregate, pivot and join below runs once for both sets instead of
+once per set.
+"""
+
+from pyspark.sql.functions import col, lit, round, when
+
+from blu.aggregates import PivotSpec, aggregate_orders, order_item_aggregates, payment_aggregates
+from blu.category_encoding import CategoryEncoder
+from blu.joins import JoinPlanner
+from blu.time_features import DEFAULT_COUNTRY, add_time_features
+from blu.vocabulary import Vocabulary
+
+SPLIT_COLUMN = "split"
+TRAIN = "train"
+TEST = "test"
+ORDER_KEYS = [SPLIT_COLUMN, "order_id"]
+
+
+def _union_splits(sources, table):
+    """Union ``table`` and ``test_<table>`` from ``sources`` with a split column."""
+    parts = []
+    if table in sources:
+        parts.append(sources[table].withColumn(SPLIT_COLUMN, lit(TRAIN)))
+    if f"test_{table}" in sources:
+        parts.append(sources[f"test_{table}"].withColumn(SPLIT_COLUMN, lit(TEST)))
+    if not parts:
+        raise ValueError(f"No '{table}' or 'test_{table}' source was given")
+    df = parts[0]
+    for part in parts[1:]:
+        df = df.unionByName(part)
+    return df
+
+
+def prepare_products(products):
+    """Convert the product dimensions to metres, volume in m3 and weight in kg."""
+    return (
+        products
+        .withColumn("product_length", col("product_length_cm") / 100)
+        .withColumn("product_height", col("product_height_cm") / 100)
+        .withColumn("product_width", col("product_width_cm") / 100)
+        .withColumn("Prod_volume_m3", round(col("product_length") * col("product_height") * col("product_width"), 2))
+        .withColumn("weight_kg", round(col("product_weight_g") / 1000, 2))
+        .drop("product_length_cm", "product_height_cm", "product_width_cm", "product_weight_g")
+    )
+
+
+def prepare_orders(orders, holidays=(), country=DEFAULT_COUNTRY):
+    """Delivery, efficiency and calendar features of each order, time gaps in hours.
+
+    See ``blu.time_features``; the holiday flags use the national holidays of
+    ``country`` plus the extra ``holidays`` dates.
+    """
+    return add_time_features(
+        orders.where(col("order_id").isNotNull()),
+        keep=[SPLIT_COLUMN, "order_id", "customer_id"],
+        holidays=holidays,
+        country=country,
+    )
+
+
+def aggregate_items(items, product, vocabulary, planner=None, category_encoder=None):
+    """One row per order with the price, shipping and product features of its items.
+
+    The item rows are joined with their product and reduced in a single
+    ``groupBy``, which also collects the order's product categories; they
+    become the ``product_categories`` count vector of ``category_encoder``
+    (by default over the vocabulary's categories). With a ``planner`` the
+    join salts best-selling products when ``product`` is not broadcast.
+    """
+    on = [SPLIT_COLUMN, "product_id"]
+    if planner is None:
+        item_rows = items.join(product, on)
+    else:
+        item_rows = planner.join_dimension("products", items, product, on, skew_key="product_id")
+    if category_encoder is None:
+        category_encoder = CategoryEncoder.from_vocabulary(vocabulary)
+    aggregates = order_item_aggregates() + [category_encoder.collect()]
+    return category_encoder.encode(aggregate_orders(item_rows, ORDER_KEYS, aggregates))
+
+
+def aggregate_payments(payments, vocabulary):
+    """One row per order with the amount paid per payment type and installment use."""
+    payments = payments.where(col("payment_type") != "not_defined")
+    payment_types = vocabulary.values("payment_type")
+    return aggregate_orders(
+        payments, ORDER_KEYS, payment_aggregates(),
+        pivots=[PivotSpec("payment_type", payment_types, "payment_value")],
+    )
+
+
+def learn_vocabulary(sources):
+    """Learn the payment types and product categories from the training tables."""
+    if "order_payments" not in sources or "products" not in sources:
+        raise ValueError("The vocabulary is learned from 'order_payments' and 'products'")
+    payments = sources["order_payments"].where(col("payment_type") != "not_defined")
+    return (
+        Vocabulary.learn(payments, ["payment_type"])
+        .merge(Vocabulary.learn(sources["products"], ["product_category_name"]))
+    )
+
+
+def prepare_reviews(reviews):
+    """Review score and the binary Target (1 for a score of 4 or 5), one review per order.
+
+    A ``split`` column of ``reviews`` is kept and deduplicated on with the
+    order id, so a table partitioned by ``ORDER_KEYS`` is not shuffled again.
+    """
+    keys = [c for c in ORDER_KEYS if c in reviews.columns]
+    return (
+        reviews
+        .withColumn("Target", when(col("review_score") >= 4, 1.0).otherwise(0.0))
+        .select(*keys[:-1], "review_id", "order_id", "review_score", "Target")
+        .dropDuplicates(keys)
+    )
+
+
+def build_basetable(sources, labelled=True, vocabulary=None, planner=None, category_encoder=None,
+                    holiday_country=DEFAULT_COUNTRY):
+    """Build the modeling basetable from the ``{table: DataFrame}`` sources.
+
+    ``sources`` may hold the training tables, the ``test_`` holdout tables or
+    both. With ``labelled`` the training rows are joined with
+    ``order_reviews`` to get ``review_score`` and ``Target``. Returns
+    ``(TrainingSet, TestSet)`` with one row per order; a set is ``None`` when
+    its tables were not given.
+
+    ``vocabulary`` fixes the pivoted payment types and the product categories;
+    without it they are learned from the training tables. ``planner`` (a
+    ``JoinPlanner``) decides which tables are broadcast and how the
+    order-keyed tables are partitioned. ``category_encoder`` (a
+    ``blu.category_encoding.CategoryEncoder``) sets the positions of the
+    ``product_categories`` vector, e.g. feature hashing; scoring must use
+    the same one as training. ``holiday_country`` selects the holiday
+    calendar of the time features.
+    """
+    has_train = "order_items" in sources
+    has_test = "test_order_items" in sources
+
+    if vocabulary is None:
+        vocabulary = learn_vocabulary(sources)
+    if planner is None:
+        planner = JoinPlanner(next(iter(sources.values())).sparkSession)
+
+    # products is a small dimension; the other tables are partitioned by ORDER_KEYS once so that
+    # the per-order aggregations and all joins below (all on ORDER_KEYS) run without another shuffle
+    product = planner.dimension("products", prepare_products(_union_splits(sources, "products")))
+    orders = prepare_orders(planner.fact("orders", _union_splits(sources, "orders")), country=holiday_country)
+    items = aggregate_items(planner.fact("order_items", _union_splits(sources, "order_items")), product, vocabulary,
+                            planner, category_encoder)
+    payments = aggregate_payments(planner.fact("order_payments", _union_splits(sources, "order_payments")), vocabulary)
+
+    # All three are one row per order, so no deduplication is needed after the joins
+    basetable = (
+        items
+        .join(payments, ORDER_KEYS)
+        .join(orders, ORDER_KEYS)
+        .dropna()
+    )
+
+    TrainingSet = TestSet = None
+    if has_train:
+        TrainingSet = basetable.where(col(SPLIT_COLUMN) == TRAIN)
+        if labelled:
+            # tagged with the split so that the reviews are partitioned and joined like the other tables
+            reviews = planner.fact("order_reviews", sources["order_reviews"].withColumn(SPLIT_COLUMN, lit(TRAIN)))
+            TrainingSet = TrainingSet.join(prepare_reviews(reviews), ORDER_KEYS).dropna()
+        TrainingSet = planner.log_plan("TrainingSet", TrainingSet.drop(SPLIT_COLUMN))
+    if has_test:
+        TestSet = planner.log_plan("TestSet", basetable.where(col(SPLIT_COLUMN) == TEST).drop(SPLIT_COLUMN))
+    return TrainingSet, TestSet
@@ -0,0 +1,208 @@
+"""Scaling benchmark of the pipeline stages on synthetic data.
+
+For every requested scale the source tables are generated with
+``blu.synthetic`` and each pipeline stage is timed on them: ingest, order
+features, item/payment pivots, basetable joins, feature selection,
+cross-validated fit and scoring. Every stage ends in an action (a Parquet
+write or the ``noop`` sink), so the time covers the full computation and not
+only planning; jobs, shuffle bytes and spill per stage come from
+``blu.instrumentation``. The results are written as one JSON file per scale,
+tagged with the git commit, and ``compare_results`` lists the stages that
+got slower between two such files.
+
+Usage::
+
+    python -m blu.benchmark --orders 100000 1000000 --work-dir /tmp/blu-bench \\
+        --output-dir benchmarks --baseline benchmarks/<earlier run>.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import subprocess
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from pyspark.ml.classification import LogisticRegression
+from pyspark.ml.evaluation import BinaryClassificationEvaluator
+from pyspark.ml.tuning import ParamGridBuilder
+from pyspark.sql import SparkSession
+
+from blu.basetable import (
+    _union_splits, aggregate_items, aggregate_payments, build_basetable, learn_vocabulary, prepare_orders,
+    prepare_products,
+)
+from blu.feature_selection import numeric_columns, screen_features, selected_features
+from blu.ingest import ingest, load_sources
+from blu.instrumentation import StageMetrics
+from blu.model_search import ModelSearch
+from blu.preprocessing import FEATURES_COL, build_preprocessing, input_columns, scoring_model
+from blu.synthetic import generate
+
+logger = logging.getLogger(__name__)
+
+STAGES = ("generate", "ingest", "order_features", "pivots", "basetable", "feature_selection", "cv_fit", "scoring")
+NOT_FEATURES = ("order_id", "product_id", "review_id", "customer_id", "Target", "review_score")
+
+
+def git_commit():
+    """Short hash of the checked-out commit, ``None`` outside a git checkout."""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _run_all(df):
+    """Compute all of ``df`` without keeping the result."""
+    df.write.format("noop").mode("overwrite").save()
+
+
+class BenchmarkRun:
+    """Wall times and Spark metrics of the stages of one run at one scale."""
+
+    def __init__(self, spark, num_orders):
+        self.spark = spark
+        self.num_orders = num_orders
+        self.metrics = StageMetrics(spark, count_rows=False, enabled=True)
+
+    @property
+    def stages(self):
+        return [dict(record) for record in self.metrics.records]
+
+    @contextmanager
+    def stage(self, name):
+        """Run the block as stage ``name``; the yielded record takes extra fields such as ``rows``."""
+        with self.metrics.stage(name) as record:
+            yield record
+        logger.info("%d orders, %s: %.1f s", self.num_orders, name, record["seconds"])
+
+    def to_dict(self):
+        return {
+            "commit": git_commit(),
+            "timestamp": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "num_orders": self.num_orders,
+            "spark_version": self.spark.version,
+            "default_parallelism": self.spark.sparkContext.defaultParallelism,
+            "stages": self.stages,
+        }
+
+    def write(self, output_dir):
+        """Write the results as JSON into the local ``output_dir``; returns the file path."""
+        result = self.to_dict()
+        os.makedirs(output_dir, exist_ok=True)
+        name = f"{result['timestamp'].replace(':', '')}-{result['commit'] or 'nocommit'}-{self.num_orders}.json"
+        path = os.path.join(output_dir, name)
+        with open(path, "w") as f:
+            json.dump(result, f, indent=2)
+        return path
+
+
+def run_benchmark(spark, num_orders, work_dir, seed=42, num_folds=3):
+    """Generate ``num_orders`` orders under ``work_dir`` and time every stage on them."""
+    work_dir = f"{work_dir.rstrip('/')}/{num_orders}"
+    run = BenchmarkRun(spark, num_orders)
+
+    with run.stage("generate"):
+        paths = generate(spark, f"{work_dir}/csv", num_orders, seed=seed)
+
+    with run.stage("ingest"):
+        parquet_paths = ingest(spark, paths, f"{work_dir}/parquet", force=True)
+    sources = load_sources(spark, parquet_paths)
+
+    with run.stage("order_features"):
+        _run_all(prepare_orders(_union_splits(sources, "orders")))
+
+    with run.stage("pivots") as record:
+        vocabulary = learn_vocabulary(sources)
+        product = prepare_products(_union_splits(sources, "products"))
+        _run_all(aggregate_items(_union_splits(sources, "order_items"), product, vocabulary))
+        _run_all(aggregate_payments(_union_splits(sources, "order_payments"), vocabulary))
+        record["categories"] = len(vocabulary.values("product_category_name"))
+
+    with run.stage("basetable") as record:
+        TrainingSet, TestSet = build_basetable(sources, labelled=True, vocabulary=vocabulary)
+        TrainingSet.write.mode("overwrite").parquet(f"{work_dir}/TrainingSet")
+        TestSet.write.mode("overwrite").parquet(f"{work_dir}/TestSet")
+    TrainingSet = spark.read.parquet(f"{work_dir}/TrainingSet")
+    TestSet = spark.read.parquet(f"{work_dir}/TestSet")
+    # counted outside the timed block
+    test_rows = TestSet.count()
+    record["rows"] = {"TrainingSet": TrainingSet.count(), "TestSet": test_rows}
+
+    with run.stage("feature_selection") as record:
+        candidates = numeric_columns(TrainingSet, exclude=NOT_FEATURES)
+        ranking = screen_features(TrainingSet, candidates, ["Target", "review_score"])
+        features = selected_features(ranking, "Target") or candidates
+        record["features"] = len(features)
+
+    with run.stage("cv_fit") as record:
+        train = TrainingSet.select(*input_columns(features), "Target")
+        preprocessing_model = build_preprocessing(features).fit(train)
+        lr = LogisticRegression(featuresCol=FEATURES_COL, labelCol="Target")
+        search = ModelSearch(
+            {"lr": (lr, ParamGridBuilder().addGrid(lr.regParam, [0.0, 0.1]).build())},
+            BinaryClassificationEvaluator(labelCol="Target"), num_folds=num_folds, seed=seed,
+        )
+        result = search.fit(preprocessing_model.transform(train))
+        record["best_metric"] = float(result.leaderboard["metric"].iloc[0])
+
+    with run.stage("scoring") as record:
+        model = scoring_model(preprocessing_model, result.best_models["lr"])
+        _run_all(model.transform(TestSet.select(*input_columns(features), "order_id")))
+        record["rows"] = test_rows
+    return run
+
+
+def compare_results(baseline, current, threshold=1.2):
+    """Per stage timings of two result dicts (or JSON paths) and whether ``current`` regressed.
+
+    A stage regressed when it took more than ``threshold`` times its baseline.
+    """
+    results = []
+    for result in (baseline, current):
+        if isinstance(result, str):
+            with open(result) as f:
+                result = json.load(f)
+        results.append({stage["stage"]: stage["seconds"] for stage in result["stages"]})
+    before, after = results
+    rows = []
+    for stage in STAGES:
+        if stage not in before or stage not in after:
+            continue
+        ratio = after[stage] / before[stage] if before[stage] else float("inf")
+        rows.append({"stage": stage, "baseline": before[stage], "current": after[stage],
+                     "ratio": round(ratio, 2), "regressed": ratio > threshold})
+    return rows
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Time the BLU pipeline stages on synthetic data.")
+    parser.add_argument("--orders", type=int, nargs="+", default=[100_000], help="scales to run, in orders")
+    parser.add_argument("--work-dir", required=True, help="Spark-writable directory for the generated data")
+    parser.add_argument("--output-dir", default="benchmarks", help="local directory of the JSON results")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--baseline", default=None, help="earlier JSON result to compare the last scale with")
+    parser.add_argument("--threshold", type=float, default=1.2, help="slowdown ratio reported as a regression")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    spark = SparkSession.builder.appName("blu-benchmark").getOrCreate()
+    path = None
+    for num_orders in args.orders:
+        path = run_benchmark(spark, num_orders, args.work_dir, seed=args.seed).write(args.output_dir)
+        logger.info("Results written to %s", path)
+    if args.baseline and path:
+        for row in compare_results(args.baseline, path, args.threshold):
+            logger.info("%-18s %8.1f s -> %8.1f s  x%.2f%s", row["stage"], row["baseline"], row["current"],
+                        row["ratio"], "  REGRESSION" if row["regressed"] else "")
+    return path
+
+
+if __name__ == "__main__":
+    main()
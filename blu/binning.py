@@ -0,0 +1,123 @@
+"""Threshold binning of numeric columns into bucket indices and dummy vectors.
+
+``Binner`` replaces the ``when`` chains of the description categories and
+the StringIndexer/OneHotEncoder pair that re-learned their labels on every
+fit. Its thresholds are either given (no pass over the data) or learned as
+quantiles of all input columns in one ``approxQuantile`` pass. The fitted
+``BinnerModel`` emits, in a single projection, the bucket index of every
+input column and its sparse one-hot dummy vector, and is saved with its
+thresholds as part of the scoring ``PipelineModel``. The bucket indices
+carry their number of buckets as nominal attributes, so the
+``OneHotEncoder`` making the dummies is set up from the schema alone,
+without a pass over the data.
+
+Bucket ``i`` holds the values in ``(thresholds[i - 1], thresholds[i]]``, so
+the fixed description thresholds keep their original categories.
+"""
+
+from functools import reduce
+
+from pyspark.ml import Estimator, Model
+from pyspark.ml.feature import OneHotEncoder
+from pyspark.ml.param import Param, Params, TypeConverters
+from pyspark.ml.param.shared import HasInputCols, HasOutputCols
+from pyspark.ml.util import DefaultParamsReadable, DefaultParamsWritable
+from pyspark.sql.functions import col, lit
+
+
+class _BinningParams(HasInputCols, HasOutputCols):
+    """Params shared by ``Binner`` and ``BinnerModel``; ``outputCols`` are the bucket indices."""
+
+    dummyCols = Param(Params._dummy(), "dummyCols", "output columns of the one-hot dummy vectors",
+                      typeConverter=TypeConverters.toListString)
+    thresholds = Param(Params._dummy(), "thresholds", "ascending upper bounds of the buckets, one list per input",
+                       typeConverter=TypeConverters.toListListFloat)
+    dropLast = Param(Params._dummy(), "dropLast", "leave the last bucket out of the dummy vectors",
+                     typeConverter=TypeConverters.toBoolean)
+
+    def __init__(self):
+        super().__init__()
+        self._setDefault(dropLast=True)
+
+    def getDummyCols(self):
+        return self.getOrDefault(self.dummyCols)
+
+    def getThresholds(self):
+        return self.getOrDefault(self.thresholds)
+
+    def getDropLast(self):
+        return self.getOrDefault(self.dropLast)
+
+
+class Binner(Estimator, _BinningParams, DefaultParamsReadable, DefaultParamsWritable):
+    """Learns (or takes) the bucket thresholds of ``inputCols``.
+
+    Without ``thresholds`` the ``1/numBuckets`` quantiles of every input are
+    learned with ``approxQuantile``; repeated quantiles of skewed columns are
+    merged, so such a column gets fewer buckets.
+    """
+
+    numBuckets = Param(Params._dummy(), "numBuckets", "number of buckets learned per input (>= 2)",
+                       typeConverter=TypeConverters.toInt)
+    relativeError = Param(Params._dummy(), "relativeError", "relative error of approxQuantile",
+                          typeConverter=TypeConverters.toFloat)
+
+    def __init__(self, *, inputCols=None, outputCols=None, dummyCols=None, thresholds=None, dropLast=True,
+                 numBuckets=3, relativeError=0.001):
+        super().__init__()
+        self._setDefault(numBuckets=3, relativeError=0.001)
+        kwargs = {"inputCols": inputCols, "outputCols": outputCols, "dummyCols": dummyCols,
+                  "thresholds": thresholds, "dropLast": dropLast, "numBuckets": numBuckets,
+                  "relativeError": relativeError}
+        self._set(**{name: value for name, value in kwargs.items() if value is not None})
+
+    def getNumBuckets(self):
+        return self.getOrDefault(self.numBuckets)
+
+    def getRelativeError(self):
+        return self.getOrDefault(self.relativeError)
+
+    def _fit(self, dataset):
+        inputs = self.getInputCols()
+        if self.isSet(self.thresholds):
+            thresholds = self.getThresholds()
+        else:
+            num_buckets = self.getNumBuckets()
+            if num_buckets < 2:
+                raise ValueError("numBuckets must be at least 2")
+            probabilities = [i / num_buckets for i in range(1, num_buckets)]
+            quantiles = dataset.approxQuantile(inputs, probabilities, self.getRelativeError())
+            thresholds = [sorted(set(values)) for values in quantiles]
+        if not len(inputs) == len(self.getOutputCols()) == len(self.getDummyCols()) == len(thresholds):
+            raise ValueError("inputCols, outputCols, dummyCols and thresholds must have the same length")
+        return BinnerModel(
+            inputCols=inputs, outputCols=self.getOutputCols(), dummyCols=self.getDummyCols(),
+            thresholds=thresholds, dropLast=self.getDropLast(),
+        )
+
+
+class BinnerModel(Model, _BinningParams, DefaultParamsReadable, DefaultParamsWritable):
+    """Adds the bucket index and the dummy vector of every input column."""
+
+    def __init__(self, *, inputCols=None, outputCols=None, dummyCols=None, thresholds=None, dropLast=True):
+        super().__init__()
+        kwargs = {"inputCols": inputCols, "outputCols": outputCols, "dummyCols": dummyCols,
+                  "thresholds": thresholds, "dropLast": dropLast}
+        self._set(**{name: value for name, value in kwargs.items() if value is not None})
+
+    def bucket_columns(self):
+        """Column expressions of all bucket indices, with their number of buckets as nominal attributes."""
+        columns = []
+        for column, output, thresholds in zip(self.getInputCols(), self.getOutputCols(), self.getThresholds()):
+            index = reduce(lambda total, t: total + (col(column) > t).cast("double"), thresholds, lit(0.0))
+            attribute = {"type": "nominal", "name": output, "num_vals": len(thresholds) + 1}
+            columns.append(index.alias(output, metadata={"ml_attr": attribute}))
+        return columns
+
+    def _transform(self, dataset):
+        outputs = set(self.getOutputCols()) | set(self.getDummyCols())
+        binned = dataset.select(*[dataset[c] for c in dataset.columns if c not in outputs], *self.bucket_columns())
+        # All bucket sizes are in the metadata, so this fit runs no job
+        encoder = OneHotEncoder(inputCols=self.getOutputCols(), outputCols=self.getDummyCols(),
+                                dropLast=self.getDropLast()).fit(binned)
+        return encoder.transform(binned)
@@ -0,0 +1,116 @@
+"""Per-order product category counts as one sparse vector.
+
+The item rows of an order are reduced by one ``groupBy`` (see
+``blu.aggregates``). Instead of one dense count column per category of the
+catalogue, that ``groupBy`` collects the categories of the order's items
+and ``CategoryEncoder.encode`` turns the list into a single
+``SparseVector`` column, ``product_categories``, holding only the
+categories the order has. The vector is as wide as the category vocabulary,
+or ``num_features`` wide with feature hashing, so a growing catalogue adds
+no columns to the basetable.
+
+``selector`` slices the chosen categories out of the vector for the model,
+and ``category_columns`` expands them into plain count columns where one
+scalar per category is needed (feature screening). The positions must be
+the same at training and scoring time, so the encoder is saved with every
+feature version and next to the model (``save``/``load``).
+"""
+
+import json
+
+from pyspark.ml.feature import CountVectorizerModel, HashingTF, VectorSlicer
+from pyspark.ml.functions import vector_to_array
+from pyspark.sql.functions import col, collect_list
+
+from blu import fs
+
+CATEGORY_COLUMN = "product_categories"
+CATEGORY_LIST_COLUMN = "_product_categories"
+CATEGORY_FEATURES_COL = "categoryCounts"
+
+
+class CategoryEncoder:
+    """Positions of the product categories in the count vector.
+
+    With ``categories`` (normally the vocabulary of
+    ``product_category_name``) position ``i`` counts the ``i``-th category
+    and categories outside the list are not counted. With ``num_features``
+    every category is hashed into one of ``num_features`` positions instead;
+    categories that collide share a count.
+    """
+
+    def __init__(self, categories=None, num_features=None):
+        if (categories is None) == (num_features is None):
+            raise ValueError("Give either the categories or num_features for feature hashing")
+        self.categories = None if categories is None else list(categories)
+        self.num_features = num_features
+        self._index = None if categories is None else {c: i for i, c in enumerate(self.categories)}
+
+    @classmethod
+    def from_vocabulary(cls, vocabulary, column="product_category_name"):
+        return cls(categories=vocabulary.values(column))
+
+    @property
+    def hashed(self):
+        return self.categories is None
+
+    @property
+    def size(self):
+        return self.num_features if self.hashed else len(self.categories)
+
+    def collect(self, column="product_category_name"):
+        """Aggregate expression collecting the (non-null) categories of an order's rows."""
+        return collect_list(col(column)).alias(CATEGORY_LIST_COLUMN)
+
+    def encode(self, df, input_col=CATEGORY_LIST_COLUMN, output_col=CATEGORY_COLUMN):
+        """Replace the category list ``input_col`` of ``df`` by the count vector ``output_col``."""
+        if self.hashed:
+            transformer = HashingTF(inputCol=input_col, outputCol=output_col, numFeatures=self.num_features)
+        else:
+            transformer = CountVectorizerModel.from_vocabulary(self.categories, inputCol=input_col,
+                                                               outputCol=output_col)
+        return transformer.transform(df).select(*[output_col if c == input_col else c for c in df.columns])
+
+    def index(self, category):
+        """Position of ``category`` in the count vector."""
+        if self.hashed:
+            return HashingTF(numFeatures=self.num_features).indexOf(category)
+        try:
+            return self._index[category]
+        except KeyError:
+            raise KeyError(f"'{category}' is not in the category vocabulary") from None
+
+    def selector(self, categories, input_col=CATEGORY_COLUMN, output_col=CATEGORY_FEATURES_COL):
+        """``VectorSlicer`` keeping the counts of ``categories``, in that order."""
+        indices = [self.index(c) for c in categories]
+        if len(set(indices)) < len(indices):
+            raise ValueError(f"Some of the selected categories share a position of the {self.size} hashed features")
+        return VectorSlicer(inputCol=input_col, outputCol=output_col, indices=indices)
+
+    def category_columns(self, categories=None, column=CATEGORY_COLUMN):
+        """One double column per category (all of the vocabulary by default) with its count."""
+        if categories is None:
+            if self.hashed:
+                raise ValueError("Name the categories to expand from hashed features")
+            categories = self.categories
+        counts = vector_to_array(col(column))
+        return [counts[self.index(c)].alias(c) for c in categories]
+
+    def to_dict(self):
+        return {"categories": self.categories, "num_features": self.num_features}
+
+    @classmethod
+    def from_dict(cls, config):
+        return cls(categories=config.get("categories"), num_features=config.get("num_features"))
+
+    def save(self, spark, path):
+        fs.write_text(spark, path, json.dumps(self.to_dict(), indent=2))
+
+    @classmethod
+    def load(cls, spark, path):
+        return cls.from_dict(json.loads(fs.read_text(spark, path)))
+
+    def __repr__(self):
+        if self.hashed:
+            return f"CategoryEncoder(num_features={self.num_features})"
+        return f"CategoryEncoder(categories: {len(self.categories)})"
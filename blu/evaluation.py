@@ -0,0 +1,138 @@
+"""Classification metrics of a prediction DataFrame from a single aggregation.
+
+The predictions are grouped once by (label, prediction) and, for binary
+tasks, the rounded positive score; that small table is collected and every
+metric is derived from it on the driver: the confusion matrix, accuracy,
+weighted precision, recall and F1 (weighted by label frequency, like
+``MulticlassClassificationEvaluator``) and, for 0/1 labels, the areas under
+the ROC and precision-recall curves. The score is the positive-class
+probability, or the raw margin squashed into (0, 1) by a sigmoid (same
+ranking) for models without probabilities such as ``LinearSVC``. Rounding it
+to ``score_precision`` decimals bins the curves into at most
+``10 ** score_precision + 1`` thresholds, so the collected table stays small.
+"""
+
+from collections import defaultdict
+
+from pyspark.ml.functions import vector_to_array
+from pyspark.sql.functions import col, count, exp, lit, round
+
+METRICS = ["accuracy", "weightedPrecision", "weightedRecall", "f1", "areaUnderROC", "areaUnderPR"]
+
+
+def _score_column(predictions, probability_col, raw_prediction_col):
+    if probability_col in predictions.columns:
+        return vector_to_array(col(probability_col))[1]
+    if raw_prediction_col in predictions.columns:
+        return 1 / (1 + exp(-vector_to_array(col(raw_prediction_col))[1]))
+    return None
+
+
+def _num_classes(predictions, *columns):
+    """Size of the first present probability or raw prediction vector, from the column metadata."""
+    for name in columns:
+        if name in predictions.columns:
+            size = predictions.schema[name].metadata.get("ml_attr", {}).get("num_attrs")
+            if size:
+                return size
+    return None
+
+
+def _weighted_metrics(cells, total):
+    labels = sorted({label for label, _ in cells} | {prediction for _, prediction in cells})
+    support = defaultdict(int)
+    predicted = defaultdict(int)
+    for (label, prediction), n in cells.items():
+        support[label] += n
+        predicted[prediction] += n
+    precision = recall = f1 = 0.0
+    for label in labels:
+        tp = cells.get((label, label), 0)
+        p = tp / predicted[label] if predicted[label] else 0.0
+        r = tp / support[label] if support[label] else 0.0
+        weight = support[label] / total
+        precision += weight * p
+        recall += weight * r
+        f1 += weight * (2 * p * r / (p + r) if p + r else 0.0)
+    accuracy = sum(n for (label, prediction), n in cells.items() if label == prediction) / total
+    matrix = [[cells.get((label, prediction), 0) for prediction in labels] for label in labels]
+    return {
+        "accuracy": accuracy,
+        "weightedPrecision": precision,
+        "weightedRecall": recall,
+        "f1": f1,
+        "confusion_matrix": {"labels": labels, "matrix": matrix},
+    }
+
+
+def _curve_areas(scores):
+    """ROC and PR areas from ``{score: [negatives, positives]}`` (trapezoidal rule)."""
+    positives = sum(n[1] for n in scores.values())
+    negatives = sum(n[0] for n in scores.values())
+    if not positives or not negatives:
+        return float("nan"), float("nan")
+    tp = fp = 0
+    roc_area = pr_area = 0.0
+    previous_tpr = previous_fpr = 0.0
+    previous_recall, previous_precision = 0.0, None
+    for score in sorted(scores, reverse=True):
+        fp += scores[score][0]
+        tp += scores[score][1]
+        tpr, fpr = tp / positives, fp / negatives
+        precision = tp / (tp + fp)
+        if previous_precision is None:
+            previous_precision = precision
+        roc_area += (fpr - previous_fpr) * (tpr + previous_tpr) / 2
+        pr_area += (tpr - previous_recall) * (precision + previous_precision) / 2
+        previous_tpr, previous_fpr = tpr, fpr
+        previous_recall, previous_precision = tpr, precision
+    return roc_area, pr_area
+
+
+def evaluate_predictions(predictions, label_col="label", prediction_col="prediction",
+                         probability_col="probability", raw_prediction_col="rawPrediction", score_precision=3,
+                         binary=None):
+    """Compute all metrics of ``predictions`` with one Spark job and return them as a dict.
+
+    The keys are the ``METRICS`` names plus ``confusion_matrix``
+    (``{"labels": [...], "matrix": rows of true label, columns of prediction}``).
+    ``binary`` says whether the task has two classes (default: whether the
+    probability or raw prediction vector has two entries); only then are the
+    scores grouped. The curve areas are ``nan`` unless the task is binary, the
+    labels are 0/1 and a probability or raw prediction column is present.
+    """
+    if binary is None:
+        binary = _num_classes(predictions, probability_col, raw_prediction_col) == 2
+    score = _score_column(predictions, probability_col, raw_prediction_col) if binary else None
+    score = lit(None).cast("double") if score is None else round(score, score_precision)
+    rows = (
+        predictions
+        .groupBy(col(label_col).cast("double").alias("label"),
+                 col(prediction_col).cast("double").alias("prediction"),
+                 score.alias("score"))
+        .agg(count(lit(1)).alias("n"))
+        .collect()
+    )
+    if not rows:
+        raise ValueError("Cannot evaluate an empty prediction DataFrame")
+
+    cells = defaultdict(int)
+    scores = defaultdict(lambda: [0, 0])
+    binary = True
+    for row in rows:
+        cells[(row["label"], row["prediction"])] += row["n"]
+        if row["label"] not in (0.0, 1.0) or row["score"] is None:
+            binary = False
+        else:
+            scores[row["score"]][int(row["label"])] += row["n"]
+
+    metrics = _weighted_metrics(cells, sum(cells.values()))
+    roc_area, pr_area = _curve_areas(scores) if binary else (float("nan"), float("nan"))
+    metrics["areaUnderROC"] = roc_area
+    metrics["areaUnderPR"] = pr_area
+    return metrics
+
+
+def format_metrics(metrics, names=METRICS):
+    """Printable ``name: value`` lines of the scalar metrics."""
+    return "\n".join(f"{name}: {metrics[name]:.4f}" for name in names)
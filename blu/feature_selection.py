@@ -0,0 +1,72 @@
+"""Distributed Pearson screening of candidate features.
+
+The correlation of every candidate column with every target is computed in a
+single aggregation over the DataFrame (Spark's ``corr`` aggregate keeps the
+running sums, sums of squares and cross-products per pair). The t-statistic
+and two-sided p-value are then derived on the driver from ``r`` and ``n``,
+so no feature or label column is ever collected.
+"""
+
+import math
+
+import pandas as pd
+from pyspark.sql.functions import col, corr, count, when
+from pyspark.sql.types import NumericType
+from scipy import stats
+
+DEFAULT_SIGNIFICANCE = 0.001
+
+
+def numeric_columns(df, exclude=()):
+    """Names of the numeric columns of ``df`` that are not in ``exclude``."""
+    return [f.name for f in df.schema.fields if isinstance(f.dataType, NumericType) and f.name not in exclude]
+
+
+def pearson_p_value(r, n):
+    """Two-sided p-value of a Pearson correlation ``r`` over ``n`` pairs."""
+    if r is None or n is None or n < 3 or math.isnan(r):
+        return float("nan")
+    if abs(r) >= 1.0:
+        return 0.0
+    t = r * math.sqrt((n - 2) / (1.0 - r * r))
+    return float(2 * stats.t.sf(abs(t), n - 2))
+
+
+def screen_features(df, features, targets, significance=DEFAULT_SIGNIFICANCE):
+    """Rank ``features`` by the significance of their correlation with each target.
+
+    Returns a pandas DataFrame with one row per (target, feature) and the
+    columns ``target``, ``feature``, ``n``, ``correlation``, ``p_value`` and
+    ``selected`` (``p_value < significance``), sorted by target and p-value.
+    """
+    if isinstance(targets, str):
+        targets = [targets]
+    pairs = [(t, f) for t in targets for f in features if f != t]
+    exprs = []
+    for i, (target, feature) in enumerate(pairs):
+        x, y = col(f"`{feature}`"), col(f"`{target}`")
+        exprs.append(corr(x, y).alias(f"r{i}"))
+        exprs.append(count(when(x.isNotNull() & y.isNotNull(), 1)).alias(f"n{i}"))
+    row = df.agg(*exprs).first()
+
+    records = []
+    for i, (target, feature) in enumerate(pairs):
+        r, n = row[f"r{i}"], row[f"n{i}"]
+        p_value = pearson_p_value(r, n)
+        records.append({
+            "target": target,
+            "feature": feature,
+            "n": n,
+            "correlation": float("nan") if r is None else r,
+            "p_value": p_value,
+            "selected": p_value < significance,
+        })
+    ranking = pd.DataFrame.from_records(
+        records, columns=["target", "feature", "n", "correlation", "p_value", "selected"])
+    return ranking.sort_values(["target", "p_value"], na_position="last").reset_index(drop=True)
+
+
+def selected_features(ranking, target):
+    """Features selected for ``target`` in a ``screen_features`` ranking, best first."""
+    rows = ranking[(ranking["target"] == target) & ranking["selected"]]
+    return rows["feature"].tolist()
@@ -0,0 +1,159 @@
+"""Versioned Parquet feature store for the basetables.
+
+Every build of TrainingSet/TestSet is written as Parquet under its own
+version directory, named after the build timestamp and a hash of the source
+files, together with the schema it was written with. Part 2 loads a version
+back with its vector columns and types intact, without CSV parsing or
+schema inference.
+
+A table written with a ``SEGMENT_COLUMN`` is stored as one directory per
+segment value (the purchase month, see ``blu.incremental``). A later version
+can replace some segments of it and point to the older version's files for
+all the others, so an update only rewrites the segments it touches.
+"""
+
+import hashlib
+import json
+from datetime import datetime, timezone
+
+from pyspark.sql.types import StructType
+
+from blu import fs
+
+METADATA_NAME = "_metadata.json"
+LATEST_NAME = "_LATEST"
+TABLES = ("TrainingSet", "TestSet")
+# Bookkeeping tables stored next to the basetables, see ``blu.incremental``
+AUXILIARY_TABLES = ("OrderState",)
+SEGMENT_COLUMN = "feature_segment"
+
+
+def hash_sources(spark, paths):
+    """Short hash of the ``{table: path}`` sources, their sizes and modification times."""
+    fingerprint = {table: {"path": path, **fs.file_status(spark, path)} for table, path in sorted(paths.items())}
+    return hashlib.sha1(json.dumps(fingerprint, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+
+
+class FeatureStore:
+    """Writes and loads versioned basetables under ``root``."""
+
+    def __init__(self, spark, root):
+        self.spark = spark
+        self.root = root.rstrip("/")
+
+    def _path(self, version, name):
+        return f"{self.root}/{version}/{name}"
+
+    def _table_path(self, metadata, name):
+        return metadata.get("paths", {}).get(name, self._path(metadata["version"], name))
+
+    def _write_segments(self, df, path):
+        """Write ``df`` partitioned by ``SEGMENT_COLUMN``; returns ``{segment: path}``."""
+        df.write.mode("error").partitionBy(SEGMENT_COLUMN).parquet(path)
+        prefix = f"{SEGMENT_COLUMN}="
+        names = [name for name in fs.list_dir(self.spark, path) if name.startswith(prefix)]
+        return {name[len(prefix):]: f"{path}/{name}" for name in names}
+
+    def write_features(self, source_hash, reuse=None, replace_segments=None, properties=None, **tables):
+        """Write the given basetables (``TrainingSet=..., TestSet=...``) as a new version.
+
+        ``reuse`` maps table names to an older version whose files the new
+        version points to instead of rewriting an unchanged table. A table
+        given with a ``SEGMENT_COLUMN`` is written segmented; when it is
+        also in ``reuse``, it replaces the segments listed for it in
+        ``replace_segments`` and the other segments of the old version are
+        kept. ``properties`` is stored with the version (see
+        ``properties``). Returns the version name,
+        ``<UTC build timestamp>-<source_hash>``.
+        """
+        reuse = reuse or {}
+        replace_segments = replace_segments or {}
+        unknown = (set(tables) | set(reuse)) - set(TABLES) - set(AUXILIARY_TABLES)
+        if unknown:
+            raise ValueError(f"Unknown feature tables {sorted(unknown)}, expected {TABLES + AUXILIARY_TABLES}")
+        version = f"{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')}-{source_hash}"
+        metadata = {"version": version, "source_hash": source_hash, "tables": {}, "paths": {}, "segments": {},
+                    "properties": properties or {}}
+        for name, old_version in reuse.items():
+            old_metadata = self.metadata(old_version)
+            if name not in old_metadata["tables"]:
+                raise ValueError(f"Version {old_version} has no {name} to reuse")
+            metadata["tables"][name] = old_metadata["tables"][name]
+            if name in old_metadata.get("segments", {}):
+                replaced = set(replace_segments.get(name, ()))
+                metadata["segments"][name] = {segment: path for segment, path in old_metadata["segments"][name].items()
+                                              if segment not in replaced}
+            else:
+                metadata["paths"][name] = self._table_path(old_metadata, name)
+        for name, df in tables.items():
+            if df is None:
+                continue
+            if SEGMENT_COLUMN in df.columns:
+                if name in reuse and name not in metadata["segments"]:
+                    raise ValueError(f"{name} of version {reuse[name]} is not segmented, cannot replace segments")
+                segments = self._write_segments(df, self._path(version, name))
+                metadata["segments"].setdefault(name, {}).update(segments)
+                df = df.drop(SEGMENT_COLUMN)
+            else:
+                df.write.mode("error").parquet(self._path(version, name))
+            metadata["tables"][name] = json.loads(df.schema.json())
+        fs.write_text(self.spark, self._path(version, METADATA_NAME), json.dumps(metadata, indent=2))
+        fs.write_text(self.spark, f"{self.root}/{LATEST_NAME}", version)
+        return version
+
+    def versions(self):
+        """All stored versions, oldest first."""
+        return [name for name in fs.list_dir(self.spark, self.root) if not name.startswith("_")]
+
+    def latest_version(self):
+        path = f"{self.root}/{LATEST_NAME}"
+        if not fs.exists(self.spark, path):
+            raise FileNotFoundError(f"No features were written to {self.root} yet")
+        return fs.read_text(self.spark, path).strip()
+
+    def metadata(self, version=None):
+        version = version or self.latest_version()
+        return json.loads(fs.read_text(self.spark, self._path(version, METADATA_NAME)))
+
+    def properties(self, version=None):
+        """The ``properties`` stored with ``version``."""
+        return self.metadata(version).get("properties", {})
+
+    def segments(self, name, version=None):
+        """Segment values of table ``name`` in ``version``, ``None`` if it is not segmented."""
+        segments = self.metadata(version).get("segments", {}).get(name)
+        return None if segments is None else sorted(segments)
+
+    def schema(self, name, version=None):
+        """The StructType ``name`` was written with in ``version``."""
+        return StructType.fromJson(self.metadata(version)["tables"][name])
+
+    def load_table(self, name, version=None, segments=None):
+        """Load table ``name`` of ``version``, ``None`` when that version has no such table.
+
+        Of a segmented table only the ``segments`` given are read (default:
+        all). The stored schema is checked against the Parquet files.
+        """
+        metadata = self.metadata(version)
+        if name not in metadata["tables"]:
+            return None
+        expected = StructType.fromJson(metadata["tables"][name])
+        if name in metadata.get("segments", {}):
+            stored = metadata["segments"][name]
+            paths = [stored[s] for s in sorted(stored) if segments is None or s in set(segments)]
+            if not paths:
+                return self.spark.createDataFrame([], expected)
+        else:
+            paths = [self._table_path(metadata, name)]
+        actual = self.spark.read.parquet(*paths).schema
+        if [f.name for f in actual.fields] != [f.name for f in expected.fields]:
+            raise ValueError(f"{name} of version {metadata['version']} does not match its recorded schema")
+        return self.spark.read.schema(expected).parquet(*paths)
+
+    def load_features(self, version=None):
+        """Load ``(TrainingSet, TestSet)`` of ``version`` (default: the latest one).
+
+        A table that was not written in that version is returned as ``None``.
+        """
+        version = version or self.latest_version()
+        return tuple(self.load_table(name, version) for name in TABLES)
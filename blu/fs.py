@@ -0,0 +1,60 @@
+"""Small helpers for files on any Hadoop-compatible file system (DBFS, local, S3).
+
+They go through the JVM of the Spark session, so the same path strings the
+DataFrame readers and writers use (``/FileStore/...``, ``dbfs:/...``) work
+here as well.
+"""
+
+
+def hadoop_path(spark, path):
+    """Return the Hadoop ``Path`` of ``path`` and the FileSystem it lives on."""
+    jvm = spark.sparkContext._jvm
+    hpath = jvm.org.apache.hadoop.fs.Path(path)
+    return hpath, hpath.getFileSystem(spark.sparkContext._jsc.hadoopConfiguration())
+
+
+def exists(spark, path):
+    hpath, fs = hadoop_path(spark, path)
+    return fs.exists(hpath)
+
+
+def file_status(spark, path):
+    """Return ``{"size": ..., "mtime": ...}`` for a file, directory or glob."""
+    hpath, fs = hadoop_path(spark, path)
+    statuses = fs.globStatus(hpath) or []
+    if not statuses:
+        raise FileNotFoundError(path)
+    size, mtime = 0, 0
+    for status in statuses:
+        children = fs.listStatus(status.getPath()) if status.isDirectory() else [status]
+        for child in children:
+            size += child.getLen()
+            mtime = max(mtime, child.getModificationTime())
+    return {"size": size, "mtime": mtime}
+
+
+def read_text(spark, path):
+    hpath, fs = hadoop_path(spark, path)
+    stream = fs.open(hpath)
+    try:
+        return spark.sparkContext._jvm.org.apache.commons.io.IOUtils.toString(stream, "UTF-8")
+    finally:
+        stream.close()
+
+
+def write_text(spark, path, text):
+    """Write ``text`` to ``path``, replacing an existing file."""
+    hpath, fs = hadoop_path(spark, path)
+    stream = fs.create(hpath, True)
+    try:
+        stream.write(bytearray(text, "utf-8"))
+    finally:
+        stream.close()
+
+
+def list_dir(spark, path):
+    """Names of the entries directly under ``path`` (empty if it does not exist)."""
+    hpath, fs = hadoop_path(spark, path)
+    if not fs.exists(hpath):
+        return []
+    return sorted(status.getPath().getName() for status in fs.listStatus(hpath))
@@ -0,0 +1,269 @@
+"""Incremental refresh of the stored basetables.
+
+Next to TrainingSet and TestSet every feature version stores an
+``OrderState`` table: one row per split and order with its purchase month, a
+fingerprint of the order's rows in each source table and the time its
+basetable row was last built. All three are stored segmented by purchase
+month (see ``blu.feature_store``), together with the ingest manifest of the
+sources they were built from and the vocabulary and category encoder that
+laid out their columns (``feature_encoding`` reads them back).
+
+A refresh first compares the per-month partition hashes of the current
+ingest manifest with the stored one (see ``blu.ingest``), so only the
+purchase months whose source partitions changed are read at all. Within
+those months it fingerprints the orders, compares them with the stored state
+and rebuilds the basetable rows of new and changed orders only; the stored
+rows of the other orders of those months are carried over and removed
+orders are dropped. The new version rewrites only the segments of those
+months and points to the previous version's files for all others, so the
+cost of a refresh follows the changed months, not the history. A change of
+the (unpartitioned) products table can touch orders of any month and
+refreshes all of them.
+"""
+
+import logging
+from datetime import datetime, timezone
+
+from pyspark.sql.functions import coalesce, col, count, date_format, first, hash, lit, sum, xxhash64
+
+from blu.basetable import ORDER_KEYS, SPLIT_COLUMN, TEST, TRAIN, _union_splits, build_basetable
+from blu.category_encoding import CategoryEncoder
+from blu.feature_store import SEGMENT_COLUMN, TABLES
+from blu.ingest import PARTITION_COLUMN, PARTITIONS_KEY, load_sources
+from blu.vocabulary import Vocabulary
+
+logger = logging.getLogger(__name__)
+
+STATE_TABLE = "OrderState"
+FINGERPRINT_COLUMNS = ["orders_hash", "items_hash", "products_hash", "payments_hash", "reviews_hash"]
+SPLIT_TABLES = {"TrainingSet": TRAIN, "TestSet": TEST}
+
+
+def _row_hash(df):
+    """32-bit hash of all source columns of a row, widened so sums do not overflow."""
+    return hash(*[df[c] for c in df.columns if c != SPLIT_COLUMN]).cast("long")
+
+
+def _splits(sources):
+    return [split for split, table in ((TRAIN, "orders"), (TEST, "test_orders")) if table in sources]
+
+
+def order_state(sources, refreshed_at=None):
+    """Fingerprint of every order of the ``{table: DataFrame}`` sources.
+
+    Each fingerprint column combines the sum and count of the row hashes of
+    the order's rows in one source table; ``products_hash`` covers the
+    attributes of the products of its items, so a changed product marks its
+    orders as changed too. ``fingerprint`` combines them all. The purchase
+    month is labelled like the ingest partitions.
+    """
+    refreshed_at = refreshed_at or datetime.now(timezone.utc)
+    orders = _union_splits(sources, "orders")
+    items = _union_splits(sources, "order_items")
+    payments = _union_splits(sources, "order_payments")
+    products = _union_splits(sources, "products")
+
+    product_hashes = products.select(SPLIT_COLUMN, "product_id", _row_hash(products).alias("product_hash"))
+    state = (
+        orders.groupBy(*ORDER_KEYS).agg(
+            first(date_format("order_purchase_timestamp", "yyyy-MM")).alias(PARTITION_COLUMN),
+            xxhash64(sum(_row_hash(orders)), count(lit(1))).alias("orders_hash"),
+        )
+        .join(
+            items.join(product_hashes, [SPLIT_COLUMN, "product_id"], "left")
+            .groupBy(*ORDER_KEYS)
+            .agg(
+                xxhash64(sum(_row_hash(items)), count(lit(1))).alias("items_hash"),
+                sum("product_hash").alias("products_hash"),
+            ),
+            ORDER_KEYS, "left",
+        )
+        .join(
+            payments.groupBy(*ORDER_KEYS).agg(xxhash64(sum(_row_hash(payments)), count(lit(1))).alias("payments_hash")),
+            ORDER_KEYS, "left",
+        )
+    )
+    if "order_reviews" in sources:
+        reviews = sources["order_reviews"]
+        state = state.join(
+            reviews.groupBy("order_id")
+            .agg(xxhash64(sum(_row_hash(reviews)), count(lit(1))).alias("reviews_hash"))
+            .withColumn(SPLIT_COLUMN, lit(TRAIN)),
+            ORDER_KEYS, "left",
+        )
+    else:
+        state = state.withColumn("reviews_hash", lit(None).cast("long"))
+    return (
+        state
+        .select(*ORDER_KEYS, PARTITION_COLUMN,
+                *[coalesce(col(c), lit(0)).cast("long").alias(c) for c in FINGERPRINT_COLUMNS])
+        .withColumn("fingerprint", xxhash64(*FINGERPRINT_COLUMNS))
+        .withColumn("refreshed_at", lit(refreshed_at).cast("timestamp"))
+    )
+
+
+def restrict_sources(sources, orders):
+    """The order-keyed ``sources`` restricted to ``orders`` (``split, order_id`` rows).
+
+    The product tables are dimensions and are kept whole.
+    """
+    restricted = {}
+    for table, df in sources.items():
+        split = TEST if table.startswith("test_") else TRAIN
+        if table.endswith("products"):
+            restricted[table] = df
+        else:
+            keys = orders.where(col(SPLIT_COLUMN) == split).select("order_id")
+            restricted[table] = df.join(keys, "order_id", "left_semi")
+    return restricted
+
+
+def changed_months(manifest, previous):
+    """Purchase months whose source partitions differ between two ingest manifests.
+
+    ``None`` means all months: there is no previous manifest, a table was
+    added or removed, or an unpartitioned table (products) changed.
+    """
+    if not previous or set(manifest) != set(previous):
+        return None
+    months = set()
+    for table, entry in manifest.items():
+        if PARTITIONS_KEY not in entry:
+            if entry != previous[table]:
+                return None
+            continue
+        old, new = previous[table].get(PARTITIONS_KEY, {}), entry[PARTITIONS_KEY]
+        months.update(month for month in set(old) | set(new) if old.get(month) != new.get(month))
+    return sorted(months)
+
+
+def store_features(feature_store, source_hash, state, manifest, vocabulary, category_encoder=None, reuse=None,
+                   replace_segments=None, **tables):
+    """Write the basetables and their ``state`` segmented by purchase month.
+
+    Each basetable row gets the purchase month of its order from ``state``;
+    ``manifest`` is the ingest manifest of the sources, kept for the next
+    refresh. ``vocabulary`` and ``category_encoder`` (default: the categories
+    of ``vocabulary``) are the ones the basetables were built with; they are
+    stored with the version. See ``FeatureStore.write_features`` for
+    ``reuse`` and ``replace_segments``.
+    """
+    if category_encoder is None:
+        category_encoder = CategoryEncoder.from_vocabulary(vocabulary)
+    properties = {
+        "ingest_manifest": manifest,
+        "vocabulary": vocabulary.to_dict(),
+        "category_encoder": category_encoder.to_dict(),
+    }
+    segmented = {STATE_TABLE: state.withColumn(SEGMENT_COLUMN, col(PARTITION_COLUMN))}
+    for name, df in tables.items():
+        if df is not None:
+            months = state.where(col(SPLIT_COLUMN) == SPLIT_TABLES[name]).select(
+                "order_id", col(PARTITION_COLUMN).alias(SEGMENT_COLUMN))
+            segmented[name] = df.join(months, "order_id", "left").select(*df.columns, SEGMENT_COLUMN)
+    return feature_store.write_features(source_hash, reuse=reuse, replace_segments=replace_segments,
+                                        properties=properties, **segmented)
+
+
+def feature_encoding(feature_store, version=None):
+    """The ``(vocabulary, category_encoder)`` a feature version (default: the latest) was built with."""
+    properties = feature_store.properties(version)
+    if "vocabulary" not in properties:
+        raise ValueError("The feature version has no stored vocabulary; build the basetables from scratch")
+    return Vocabulary(properties["vocabulary"]), CategoryEncoder.from_dict(properties["category_encoder"])
+
+
+def _merge(name, old, new, stale):
+    """``old`` without the ``stale`` orders plus the rebuilt ``new`` rows."""
+    if sorted(old.columns) != sorted(new.columns):
+        raise ValueError(
+            f"The rebuilt {name} rows do not have the stored columns (did the vocabulary change?); "
+            "build the basetables from scratch instead"
+        )
+    return old.join(stale, "order_id", "left_anti").unionByName(new.select(*old.columns))
+
+
+def refresh_features(feature_store, parquet_paths, manifest, source_hash, vocabulary, labelled=True, planner=None,
+                     category_encoder=None):
+    """Bring the latest version of ``feature_store`` up to date with the ingested sources.
+
+    ``parquet_paths`` and ``manifest`` come from ``blu.ingest`` (``ingest``
+    and ``read_manifest``). Only the purchase months whose partitions changed
+    are read, and only new and changed orders of those months go through
+    ``build_basetable``; ``vocabulary`` and ``category_encoder`` must be the
+    ones the stored version was built with, so the rebuilt rows have the
+    same pivot columns and category vector positions. Without a stored,
+    segmented ``OrderState`` all orders are built. Returns the written
+    version, or the latest one when nothing changed.
+    """
+    spark = feature_store.spark
+    now = datetime.now(timezone.utc)
+    try:
+        previous_version = feature_store.latest_version()
+    except FileNotFoundError:
+        previous_version = None
+    months = None
+    if previous_version and feature_store.segments(STATE_TABLE, previous_version) is not None:
+        months = changed_months(manifest, feature_store.properties(previous_version).get("ingest_manifest"))
+
+    if months is None:
+        logger.info("No comparable stored state, building all orders")
+        sources = load_sources(spark, parquet_paths)
+        TrainingSet, TestSet = build_basetable(sources, labelled=labelled, vocabulary=vocabulary, planner=planner,
+                                               category_encoder=category_encoder)
+        return store_features(feature_store, source_hash, order_state(sources, now), manifest, vocabulary,
+                              category_encoder, TrainingSet=TrainingSet, TestSet=TestSet)
+    if not months:
+        logger.info("No source partition changed since version %s", previous_version)
+        return previous_version
+
+    logger.info("Refreshing the orders of purchase months %s", ", ".join(months))
+    sources = load_sources(spark, parquet_paths, months)
+    current = order_state(sources, now).persist()
+    previous_state = feature_store.load_table(STATE_TABLE, previous_version, segments=months)
+
+    # Splits without sources in this run keep their stored rows and state
+    splits = _splits(sources)
+    kept_state = previous_state.where(~col(SPLIT_COLUMN).isin(splits))
+    previous_state = previous_state.where(col(SPLIT_COLUMN).isin(splits))
+
+    # Unchanged orders match the stored fingerprint and keep their refresh time
+    state = (
+        current.drop("refreshed_at")
+        .join(previous_state.select(*ORDER_KEYS, "fingerprint", "refreshed_at"), ORDER_KEYS + ["fingerprint"], "left")
+        .withColumn("changed", col("refreshed_at").isNull())
+        .withColumn("refreshed_at", coalesce(col("refreshed_at"), lit(now).cast("timestamp")))
+        .persist()
+    )
+    try:
+        changed = state.where(col("changed")).select(*ORDER_KEYS)
+        removed = previous_state.select(*ORDER_KEYS).join(current.select(*ORDER_KEYS), ORDER_KEYS, "left_anti")
+        stale = changed.unionByName(removed)
+        stale_counts = {row[SPLIT_COLUMN]: row["count"] for row in stale.groupBy(SPLIT_COLUMN).count().collect()}
+        logger.info("Orders to refresh per split: %s", stale_counts)
+
+        rebuilt = dict(zip(TABLES, build_basetable(
+            restrict_sources(sources, changed), labelled=labelled, vocabulary=vocabulary, planner=planner,
+            category_encoder=category_encoder,
+        )))
+        tables = {}
+        reuse = {STATE_TABLE: previous_version}
+        replace_segments = {STATE_TABLE: months}
+        for name in TABLES:
+            split = SPLIT_TABLES[name]
+            old = feature_store.load_table(name, previous_version, segments=months)
+            if old is None:
+                tables[name] = rebuilt[name]
+                continue
+            reuse[name] = previous_version
+            if stale_counts.get(split):
+                stale_orders = stale.where(col(SPLIT_COLUMN) == split).select("order_id")
+                tables[name] = _merge(name, old, rebuilt[name], stale_orders)
+                replace_segments[name] = months
+
+        new_state = state.drop("changed").unionByName(kept_state)
+        return store_features(feature_store, source_hash, new_state, manifest, vocabulary, category_encoder,
+                              reuse=reuse, replace_segments=replace_segments, **tables)
+    finally:
+        state.unpersist()
+        current.unpersist()
@@ -0,0 +1,141 @@
+"""Columnar ingest cache for the BLU source tables.
+
+Each source CSV is converted once to Parquet (order-keyed tables partitioned
+by purchase month) and later runs read the Parquet copy, which gives column
+pruning and predicate pushdown instead of (multiline) CSV parsing. A small
+manifest records the size and modification time of every CSV so a table is
+only converted again when its source changed. For the order-keyed tables it
+also records a content hash of every purchase month partition, taken once
+right after the conversion; ``blu.incremental`` compares those hashes to
+find the months whose orders have to be refreshed.
+"""
+
+import json
+import logging
+
+from pyspark.sql.functions import col, count, date_format, hash, lit, sum, xxhash64
+
+from blu import fs
+from blu.schemas import read_csv
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = "_manifest.json"
+PARTITION_COLUMN = "purchase_month"
+# Manifest key of the per-month content hashes
+PARTITIONS_KEY = "partitions"
+
+# Order-keyed tables take their purchase month from the matching orders table.
+ORDERS_TABLE = {
+    "orders": "orders",
+    "order_items": "orders",
+    "order_payments": "orders",
+    "order_reviews": "orders",
+    "test_orders": "test_orders",
+    "test_order_items": "test_orders",
+    "test_order_payments": "test_orders",
+}
+
+
+def read_manifest(spark, cache_dir):
+    """The manifest of ``cache_dir``: ``{table: source fingerprint}``, ``{}`` before the first ingest."""
+    path = f"{cache_dir}/{MANIFEST_NAME}"
+    if not fs.exists(spark, path):
+        return {}
+    return json.loads(fs.read_text(spark, path))
+
+
+def _write_manifest(spark, cache_dir, manifest):
+    fs.write_text(spark, f"{cache_dir}/{MANIFEST_NAME}", json.dumps(manifest, indent=2, sort_keys=True))
+
+
+def _fingerprint(spark, table, paths):
+    fingerprint = {"source": paths[table], **fs.file_status(spark, paths[table])}
+    orders_table = ORDERS_TABLE.get(table)
+    if orders_table and orders_table != table:
+        # The partition labels come from the orders table, so it is part of the key.
+        fingerprint["orders"] = fs.file_status(spark, paths[orders_table])
+    return fingerprint
+
+
+def _partition_hashes(spark, target):
+    """``{purchase month: content hash}`` of a converted order-keyed table.
+
+    Rows without a month (items of unknown orders) never reach the basetable
+    and are left out.
+    """
+    df = spark.read.parquet(target)
+    columns = [col(f"`{c}`") for c in df.columns if c != PARTITION_COLUMN]
+    rows = (
+        df.where(col(PARTITION_COLUMN).isNotNull())
+        .groupBy(PARTITION_COLUMN)
+        .agg(xxhash64(sum(hash(*columns).cast("long")), count(lit(1))).alias("hash"))
+        .collect()
+    )
+    return {row[PARTITION_COLUMN]: row["hash"] for row in rows}
+
+
+def _convert(spark, table, paths, target):
+    df = read_csv(spark, table, paths[table])
+    orders_table = ORDERS_TABLE.get(table)
+    if orders_table is None:
+        df.write.mode("overwrite").parquet(target)
+        return
+    if orders_table == table:
+        df = df.withColumn(PARTITION_COLUMN, date_format("order_purchase_timestamp", "yyyy-MM"))
+    else:
+        months = (
+            read_csv(spark, orders_table, paths[orders_table])
+            .select("order_id", date_format("order_purchase_timestamp", "yyyy-MM").alias(PARTITION_COLUMN))
+            .dropDuplicates(["order_id"])
+        )
+        df = df.join(months, on="order_id", how="left")
+    df.write.mode("overwrite").partitionBy(PARTITION_COLUMN).parquet(target)
+
+
+def ingest(spark, paths, cache_dir, force=False):
+    """Convert the ``{table: csv_path}`` sources to Parquet under ``cache_dir``.
+
+    Tables whose CSV (and, for order-keyed tables, whose orders CSV) has the
+    same size and modification time as at the last conversion are skipped.
+    Returns ``{table: parquet_path}``.
+    """
+    for table, orders_table in ORDERS_TABLE.items():
+        if table in paths and orders_table not in paths:
+            raise ValueError(f"'{table}' is partitioned by purchase month and needs '{orders_table}' as well")
+
+    manifest = read_manifest(spark, cache_dir)
+    parquet_paths = {}
+    for table in paths:
+        target = f"{cache_dir}/{table}"
+        fingerprint = _fingerprint(spark, table, paths)
+        recorded = {key: value for key, value in manifest.get(table, {}).items() if key != PARTITIONS_KEY}
+        if force or recorded != fingerprint:
+            logger.info("Converting %s to Parquet", table)
+            _convert(spark, table, paths, target)
+            if table in ORDERS_TABLE:
+                fingerprint[PARTITIONS_KEY] = _partition_hashes(spark, target)
+            manifest[table] = fingerprint
+            _write_manifest(spark, cache_dir, manifest)
+        parquet_paths[table] = target
+    return parquet_paths
+
+
+def load_table(spark, table, parquet_paths, months=None):
+    """Read ``table`` from the Parquet cache, optionally only some purchase months.
+
+    ``months`` is a list of ``"yyyy-MM"`` strings; the filter is applied on the
+    partition column so only the matching directories are scanned. The
+    partition column itself is dropped so the result has the CSV layout.
+    """
+    df = spark.read.parquet(parquet_paths[table])
+    if PARTITION_COLUMN not in df.columns:
+        return df
+    if months is not None:
+        df = df.where(col(PARTITION_COLUMN).isin(list(months)))
+    return df.drop(PARTITION_COLUMN)
+
+
+def load_sources(spark, parquet_paths, months=None):
+    """Read every cached table into a ``{table: DataFrame}`` dict."""
+    return {table: load_table(spark, table, parquet_paths, months) for table in parquet_paths}
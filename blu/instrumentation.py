@@ -0,0 +1,206 @@
+"""Per-stage metrics of the pipeline: time, rows, Spark jobs, shuffle and spill.
+
+``StageMetrics.stage(name)`` (or the ``instrument`` decorator) runs a block
+under its own Spark job group. When the block ends, the jobs of that group
+and their stages are looked up with the ``StatusTracker``, and the shuffle
+read/write bytes and spilled bytes of those stages are read from the
+application's monitoring REST API (the metrics the status listener
+collected). Row counts are taken outside the timed block, only for the
+DataFrames passed as ``inputs`` or registered with ``record.output(df)``.
+
+Job groups are thread-local properties: work a stage hands to other threads
+is only counted when those threads inherit them, as ``blu.model_search``
+and ``blu.tuning`` do with ``pyspark.inheritable_thread_target``.
+
+Every finished stage is logged as one JSON line; ``summary_table`` prints
+all of them at the end of a run and ``write_json`` keeps them.
+"""
+
+import functools
+import itertools
+import json
+import logging
+import os
+import time
+import urllib.request
+from contextlib import contextmanager
+
+from pyspark.sql import DataFrame
+
+logger = logging.getLogger(__name__)
+
+# REST API field -> record field, summed over the stage attempts
+STAGE_FIELDS = {
+    "shuffleReadBytes": "shuffle_read_bytes",
+    "shuffleWriteBytes": "shuffle_write_bytes",
+    "memoryBytesSpilled": "memory_spilled_bytes",
+    "diskBytesSpilled": "disk_spilled_bytes",
+}
+SUMMARY_COLUMNS = ["stage", "seconds", "jobs", "stages", "tasks", "input_rows", "output_rows",
+                   "shuffle_read_bytes", "shuffle_write_bytes", "memory_spilled_bytes", "disk_spilled_bytes"]
+
+
+def instrumentation_enabled():
+    """Instrumentation is on unless the ``BLU_INSTRUMENTATION`` environment variable is ``0``."""
+    return os.environ.get("BLU_INSTRUMENTATION", "1") != "0"
+
+
+class StageRecord(dict):
+    """Metrics of one stage; ``output(df)`` registers the DataFrame whose rows are counted."""
+
+    def __init__(self, name):
+        super().__init__(stage=name)
+        self._output = None
+
+    def output(self, df):
+        self._output = df
+        return df
+
+
+def _format_bytes(value):
+    if value is None:
+        return "-"
+    for unit in ("B", "KB", "MB", "GB"):
+        if abs(value) < 1024 or unit == "GB":
+            return f"{value:.0f} {unit}" if unit == "B" else f"{value:.1f} {unit}"
+        value /= 1024
+
+
+class StageMetrics:
+    """Collects a ``StageRecord`` per named pipeline stage.
+
+    With ``count_rows=False`` no rows are counted, which keeps the
+    instrumentation free of extra Spark jobs. When disabled (see
+    ``instrumentation_enabled``) blocks run without a job group or records.
+    """
+
+    def __init__(self, spark, count_rows=True, enabled=None):
+        self.spark = spark
+        self.sc = spark.sparkContext
+        self.count_rows = count_rows
+        self.enabled = instrumentation_enabled() if enabled is None else enabled
+        self.records = []
+        self._groups = itertools.count()
+        self._rest_available = True
+
+    def _stage_data(self, stage_id):
+        """Attempts of ``stage_id`` from the monitoring REST API, ``[]`` if it cannot be reached."""
+        if not self._rest_available or not self.sc.uiWebUrl:
+            return []
+        url = f"{self.sc.uiWebUrl}/api/v1/applications/{self.sc.applicationId}/stages/{stage_id}?details=false"
+        try:
+            with urllib.request.urlopen(url, timeout=5) as response:
+                return json.load(response)
+        except OSError as error:
+            logger.warning("Stage metrics are not available from %s (%s); recording jobs and tasks only", url, error)
+            self._rest_available = False
+            return []
+
+    def _spark_metrics(self, group):
+        tracker = self.sc.statusTracker()
+        job_ids = tracker.getJobIdsForGroup(group)
+        stage_ids = set()
+        for job_id in job_ids:
+            info = tracker.getJobInfo(job_id)
+            if info is not None:
+                stage_ids.update(info.stageIds)
+        # stages whose shuffle output was reused are listed by the job but never ran
+        infos = [tracker.getStageInfo(stage_id) for stage_id in sorted(stage_ids)]
+        ran = [info for info in infos if info is not None and info.numCompletedTasks + info.numFailedTasks]
+        metrics = {
+            "jobs": len(job_ids),
+            "stages": len(ran),
+            "tasks": sum(info.numCompletedTasks for info in ran),
+            "failed_tasks": sum(info.numFailedTasks for info in ran),
+        }
+        totals = dict.fromkeys(STAGE_FIELDS.values())
+        for info in ran:
+            for attempt in self._stage_data(info.stageId):
+                for field, name in STAGE_FIELDS.items():
+                    totals[name] = (totals[name] or 0) + attempt.get(field, 0)
+        metrics.update(totals)
+        return metrics
+
+    def _restore_group(self, previous):
+        for key, value in previous.items():
+            self.sc.setLocalProperty(key, value)
+
+    @contextmanager
+    def stage(self, name, inputs=None):
+        """Run the block as stage ``name``; yields its ``StageRecord``.
+
+        ``inputs`` is an optional ``{name: DataFrame}`` whose rows are counted
+        before the block starts.
+        """
+        record = StageRecord(name)
+        if not self.enabled:
+            yield record
+            return
+        if self.count_rows and inputs:
+            record["input_rows"] = sum(df.count() for df in inputs.values())
+        group = f"blu-{next(self._groups)}-{name}"
+        keys = ("spark.jobGroup.id", "spark.job.description", "spark.job.interruptOnCancel")
+        previous = {key: self.sc.getLocalProperty(key) for key in keys}
+        self.sc.setJobGroup(group, name)
+        start = time.perf_counter()
+        try:
+            yield record
+        except BaseException:
+            record["failed"] = True
+            raise
+        finally:
+            record["seconds"] = round(time.perf_counter() - start, 3)
+            self._restore_group(previous)
+            self._finish(record, group)
+
+    def _finish(self, record, group):
+        try:
+            record.update(self._spark_metrics(group))
+            if self.count_rows and record._output is not None and not record.get("failed"):
+                record["output_rows"] = record._output.count()
+        except Exception as error:  # the metrics must never fail the pipeline
+            logger.warning("Could not collect the metrics of stage %s: %s", record["stage"], error)
+        self.records.append(record)
+        logger.info(json.dumps(dict(record), default=str))
+
+    def instrument(self, name=None):
+        """Decorator running the function as a stage; a returned DataFrame is its output."""
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.stage(name or function.__name__) as record:
+                    result = function(*args, **kwargs)
+                    if isinstance(result, DataFrame):
+                        record.output(result)
+                    return result
+            return wrapper
+        return decorator
+
+    def summary_table(self):
+        """Printable table of all recorded stages, in run order."""
+        rows = [SUMMARY_COLUMNS]
+        for record in self.records:
+            row = []
+            for column in SUMMARY_COLUMNS:
+                value = record.get(column)
+                if column.endswith("_bytes"):
+                    row.append(_format_bytes(value))
+                elif column == "seconds":
+                    row.append(f"{value:.1f}")
+                else:
+                    row.append("-" if value is None else str(value))
+            rows.append(row)
+        total = sum(record.get("seconds", 0) for record in self.records)
+        widths = [max(len(row[i]) for row in rows) for i in range(len(SUMMARY_COLUMNS))]
+        lines = ["  ".join(cell.rjust(width) if i else cell.ljust(width)
+                           for i, (cell, width) in enumerate(zip(row, widths))) for row in rows]
+        lines.append(f"total: {total:.1f} s in {len(self.records)} stages")
+        return "\n".join(lines)
+
+    def write_json(self, path):
+        """Write all records to the local file ``path``."""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "w") as f:
+            json.dump([dict(record) for record in self.records], f, indent=2, default=str)
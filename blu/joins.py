@@ -0,0 +1,111 @@
+"""Join planning for the basetable assembly.
+
+Small dimension tables (``products``) are broadcast when their estimated
+size is under a threshold, and the order-keyed fact tables are hash
+partitioned once by the full order key (``split``, ``order_id``) into the
+same number of partitions. The per-order aggregations and the joins between
+them group and join on exactly those keys, so they reuse that partitioning
+instead of shuffling again (Spark only skips the exchange before a join when
+the partitioning covers all of its keys).
+With a ``blu.skew.SkewDetector`` the heavy keys of those tables are found
+from a sample (see ``blu.skew``): a table with hot order keys is left
+unpartitioned so its per-order aggregation is reduced map-side first, a
+non-broadcast dimension join salts the hot keys, and the skew reports are
+kept on the planner. The chosen physical plan and its number of shuffle exchanges
+are logged so they can be checked as volumes grow.
+"""
+
+import logging
+
+from pyspark.sql.functions import broadcast
+
+from blu.skew import salted_join
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BROADCAST_THRESHOLD = 64 * 1024 * 1024
+# blu.basetable.ORDER_KEYS, the keys of every per-order groupBy and join
+ORDER_KEYS = ("split", "order_id")
+
+
+def estimated_size(df):
+    """Optimizer estimate of the size of ``df`` in bytes (``None`` if unknown)."""
+    try:
+        return int(df._jdf.queryExecution().optimizedPlan().stats().sizeInBytes().toString())
+    except Exception:  # the estimate is only a hint, never fail the build on it
+        return None
+
+
+def physical_plan(df):
+    return df._jdf.queryExecution().executedPlan().toString()
+
+
+def count_exchanges(plan):
+    """Number of shuffle exchanges in a physical plan string (broadcasts not counted)."""
+    return sum(1 for line in plan.splitlines() if "Exchange " in line and "BroadcastExchange" not in line)
+
+
+class JoinPlanner:
+    """Decides how the basetable tables are distributed before they are joined."""
+
+    def __init__(self, spark, broadcast_threshold=DEFAULT_BROADCAST_THRESHOLD, num_partitions=None, keys=ORDER_KEYS,
+                 skew_key="order_id", skew_detector=None):
+        self.broadcast_threshold = broadcast_threshold
+        self.num_partitions = num_partitions or int(spark.conf.get("spark.sql.shuffle.partitions"))
+        self.keys = list(keys)
+        self.skew_key = skew_key
+        self.skew_detector = skew_detector
+        self.skew_reports = []
+        self._broadcast = {}
+
+    def dimension(self, name, df):
+        """Mark ``df`` for broadcast if it is estimated to be under the threshold."""
+        size = estimated_size(df)
+        self._broadcast[name] = size is not None and size <= self.broadcast_threshold
+        if self._broadcast[name]:
+            logger.info("Broadcasting %s (~%d bytes)", name, size)
+            return broadcast(df)
+        logger.info("Not broadcasting %s (estimated size: %s bytes)", name, size)
+        return df
+
+    def _skew_report(self, name, df, key):
+        report = self.skew_detector.detect(name, df, key, self.num_partitions)
+        self.skew_reports.append(report)
+        return report
+
+    def fact(self, name, df):
+        """Hash partition ``df`` by the order keys so later groupBys and joins need no shuffle.
+
+        With a skew detector, a table with skewed order keys is returned as it
+        is: its ``groupBy`` then reduces every hot order within the input
+        partitions before the only shuffle, and the aggregated tables are
+        joined on the ``groupBy`` output partitioning.
+        """
+        if self.skew_detector is not None and self._skew_report(name, df, self.skew_key).keys:
+            logger.info("Not partitioning %s up front: it has skewed %s values", name, self.skew_key)
+            return df
+        logger.info("Partitioning %s by %s into %d partitions", name, ", ".join(self.keys), self.num_partitions)
+        return df.repartition(self.num_partitions, *self.keys)
+
+    def join_dimension(self, name, fact, dimension, on, skew_key):
+        """Join ``fact`` with the dimension ``name`` (as returned by ``dimension``) on ``on``.
+
+        A dimension that is not broadcast is joined with the skewed
+        ``skew_key`` values of ``fact`` salted, when there is a skew detector.
+        """
+        if self._broadcast.get(name) or self.skew_detector is None:
+            return fact.join(dimension, on)
+        return salted_join(fact, dimension, on, self._skew_report(f"{name} join", fact, skew_key))
+
+    def skew_summary(self):
+        """One line per table that had skewed keys."""
+        return "\n".join(
+            f"{report.name}: {len(report.keys)} skewed {report.key} values over {report.threshold} rows, "
+            f"{report.buckets} salt buckets; heaviest: {list(report.keys.items())[:3]}"
+            for report in self.skew_reports if report.keys
+        ) or "No skewed keys"
+
+    def log_plan(self, name, df):
+        plan = physical_plan(df)
+        logger.info("Physical plan of %s (%d shuffle exchanges):\n%s", name, count_exchanges(plan), plan)
+        return df
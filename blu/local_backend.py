@@ -0,0 +1,334 @@
+"""Single-node pandas backend of the basetable build.
+
+At the current size (about 50k orders) the basetable fits in memory many
+times over, and starting a JVM and shuffling cost more than the work itself.
+This module builds the same TrainingSet/TestSet as ``blu.basetable`` with
+vectorized pandas: the same per-order aggregates, pivots, time features,
+joins and ``dropna``, with the same column names and order. It needs
+neither a Spark session nor a JVM; ``check_parity`` compares its output
+with the Spark build.
+
+Usage::
+
+    python -m blu.local_backend --data-dir data --holdout-dir "Holdout data" \\
+        --vocabulary vocabulary.json --output basetable
+
+``product_id`` (Spark's ``first``) and ``review_id`` (the review kept by
+``dropDuplicates``) are arbitrary picks in both backends and may differ.
+The ``product_categories`` vectors are ``pyspark.ml.linalg.SparseVector``
+objects over the vocabulary's categories (feature hashing needs Spark); in
+the Parquet output they are stored in the struct layout of Spark's vectors.
+"""
+
+import argparse
+import json
+import logging
+import os
+import time
+
+import numpy as np
+import pandas as pd
+from pyspark.ml.linalg import SparseVector
+
+from blu.basetable import ORDER_KEYS, SPLIT_COLUMN, TEST, TRAIN
+from blu.category_encoding import CATEGORY_COLUMN
+from blu.schemas import SCHEMAS
+from blu.time_features import (
+    DEFAULT_COUNTRY, DELIVERY_INTERVALS, HOLIDAY_FEATURES, HOUR_FEATURES, holiday_calendar,
+)
+from blu.vocabulary import Vocabulary
+
+logger = logging.getLogger(__name__)
+
+IGNORED_IN_PARITY = ("product_id", "review_id")
+
+# blu.schemas.TIMESTAMP_FORMAT in strftime notation
+PANDAS_TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def read_csv(table, path):
+    """Read the source CSV of ``table`` with the column types of its Spark schema.
+
+    Integer columns are read as floats so that missing values stay ``NaN``.
+    """
+    schema = SCHEMAS[table]
+    dtypes, dates = {}, []
+    for field in schema.fields:
+        kind = field.dataType.typeName()
+        if kind == "timestamp":
+            dates.append(field.name)
+        elif kind == "string":
+            dtypes[field.name] = "object"
+        else:
+            dtypes[field.name] = "float64"
+    df = pd.read_csv(path, dtype=dtypes, keep_default_na=False, na_values=["NA", ""], usecols=schema.fieldNames())
+    for column in dates:
+        df[column] = pd.to_datetime(df[column], format=PANDAS_TIMESTAMP_FORMAT, errors="coerce")
+    return df[schema.fieldNames()]
+
+
+def read_sources(paths):
+    """Read every ``{table: path}`` entry of ``paths`` into a pandas DataFrame."""
+    return {table: read_csv(table, path) for table, path in paths.items()}
+
+
+def _round(values, digits=2):
+    """Round half away from zero, like Spark's ``round``."""
+    factor = 10.0 ** digits
+    return np.sign(values) * np.floor(np.abs(values) * factor + 0.5) / factor
+
+
+def _divide(numerator, denominator):
+    """Division that gives ``NaN`` (Spark: null) for a zero denominator."""
+    return numerator / denominator.where(denominator != 0)
+
+
+def _union_splits(sources, table):
+    parts = []
+    if table in sources:
+        parts.append(sources[table].assign(**{SPLIT_COLUMN: TRAIN}))
+    if f"test_{table}" in sources:
+        parts.append(sources[f"test_{table}"].assign(**{SPLIT_COLUMN: TEST}))
+    if not parts:
+        raise ValueError(f"No '{table}' or 'test_{table}' source was given")
+    return pd.concat(parts, ignore_index=True)
+
+
+def prepare_products(products):
+    """Same as ``blu.basetable.prepare_products``."""
+    products = products.assign(
+        product_length=products["product_length_cm"] / 100,
+        product_height=products["product_height_cm"] / 100,
+        product_width=products["product_width_cm"] / 100,
+    )
+    return products.assign(
+        Prod_volume_m3=_round(products["product_length"] * products["product_height"] * products["product_width"]),
+        weight_kg=_round(products["product_weight_g"] / 1000),
+    ).drop(columns=["product_length_cm", "product_height_cm", "product_width_cm", "product_weight_g"])
+
+
+def _hours_between(end, start):
+    return _round((end - start).dt.total_seconds() / 3600)
+
+
+def _is_holiday(timestamps, holidays, country):
+    fixed, movable = holiday_calendar(country)
+    flag = timestamps.dt.strftime("%m-%d").isin(fixed)
+    flag |= timestamps.dt.strftime("%Y-%m-%d").isin(movable + [str(day) for day in holidays])
+    return flag.astype(float).where(timestamps.notna())
+
+
+def prepare_orders(orders, holidays=(), country=DEFAULT_COUNTRY):
+    """Same as ``blu.basetable.prepare_orders`` (see ``blu.time_features``)."""
+    orders = orders[orders["order_id"].notna()]
+    delivered = orders["order_delivered_customer_date"]
+    # Spark's dayofweek 6 and 7 are Friday and Saturday
+    features = {"weekend_delivered": delivered.dt.dayofweek.isin([4, 5]).astype(float)}
+    for name, (end, start) in DELIVERY_INTERVALS.items():
+        features[name] = _hours_between(orders[end], orders[start])
+    for name, column in HOUR_FEATURES.items():
+        features[name] = orders[column].dt.hour
+    for name, column in HOLIDAY_FEATURES.items():
+        features[name] = _is_holiday(orders[column], holidays, country)
+    return pd.concat([orders[[SPLIT_COLUMN, "order_id", "customer_id"]], pd.DataFrame(features)], axis=1)
+
+
+def _sum_pivot(df, column, values, value):
+    sums = df.pivot_table(index=ORDER_KEYS, columns=column, values=value, aggfunc="sum", fill_value=0)
+    return sums.reindex(columns=values, fill_value=0)
+
+
+def _category_vectors(rows, categories, orders):
+    """``product_categories`` count vector of each of ``orders`` (an index of order keys)."""
+    size = len(categories)
+    positions = rows["product_category_name"].map({c: i for i, c in enumerate(categories)})
+    counts = rows[ORDER_KEYS].assign(position=positions).dropna().groupby(ORDER_KEYS + ["position"]).size()
+    vectors = counts.groupby(level=ORDER_KEYS).apply(
+        lambda c: SparseVector(size, c.index.get_level_values("position").astype(int), c.to_numpy(dtype=float))
+    )
+    empty = SparseVector(size, [], [])
+    return vectors.reindex(orders).map(lambda v: v if isinstance(v, SparseVector) else empty)
+
+
+def _vector_record(vector):
+    """A sparse vector in the struct layout Spark stores ``VectorUDT`` values in."""
+    return {"type": 0, "size": vector.size, "indices": vector.indices.tolist(), "values": vector.values.tolist()}
+
+
+def aggregate_items(items, product, vocabulary):
+    """Same as ``blu.basetable.aggregate_items``."""
+    rows = items.merge(product, on=[SPLIT_COLUMN, "product_id"])
+    grouped = rows.groupby(ORDER_KEYS)
+    sums = grouped[["price", "shipping_cost", "weight_kg", "Prod_volume_m3", "product_photos_qty",
+                    "product_description_lenght", "product_name_lenght", "product_length", "product_width",
+                    "product_height"]].sum(min_count=1)
+    means = grouped[["product_name_lenght", "product_photos_qty", "product_description_lenght"]].mean()
+    price, shipping = sums["price"], sums["shipping_cost"]
+    weight, volume = sums["weight_kg"], sums["Prod_volume_m3"]
+    photos, description = sums["product_photos_qty"], sums["product_description_lenght"]
+    aggregates = pd.DataFrame({
+        "product_id": grouped["product_id"].first(),
+        "total_price": _round(price),
+        "total_shipping_cost": _round(shipping),
+        "total_cost": _round(price + shipping),
+        "shipping_cost%": _round(_divide(shipping, price + shipping)),
+        "max_order_item_id": grouped["order_item_id"].max(),
+        "num_unique_products_per_id": grouped["product_id"].nunique().astype(float),
+        "shipping_cost/kg": _round(_divide(shipping, weight)),
+        "ttl_weight": weight,
+        "ttl_name": sums["product_name_lenght"],
+        "ttl_volume": volume,
+        "ttl_photo": photos,
+        "ttl_description": description,
+        "mean_name": means["product_name_lenght"],
+        "mean_photo": means["product_photos_qty"],
+        "mean_description": means["product_description_lenght"],
+        "weight_volume": _divide(weight, volume),
+        "aspect_ratio_length_width": _round(_divide(sums["product_length"], sums["product_width"])),
+        "aspect_ratio_height_width": _round(_divide(sums["product_height"], sums["product_width"])),
+        "photo_description_ratio": _round(_divide(photos, description)),
+    })
+    categories = vocabulary.values("product_category_name")
+    aggregates[CATEGORY_COLUMN] = _category_vectors(rows, categories, aggregates.index)
+    return aggregates.reset_index()
+
+
+def aggregate_payments(payments, vocabulary):
+    """Same as ``blu.basetable.aggregate_payments``."""
+    payments = payments[payments["payment_type"].notna() & (payments["payment_type"] != "not_defined")]
+    installments = (payments["payment_installments"] > 1).astype(float).where(payments["payment_installments"].notna())
+    aggregates = installments.groupby([payments[k] for k in ORDER_KEYS]).max().rename("pay_with_installment")
+    payment_types = vocabulary.values("payment_type")
+    pivot = _sum_pivot(payments, "payment_type", payment_types, "payment_value")
+    return aggregates.to_frame().join(pivot).fillna({c: 0 for c in payment_types}).reset_index()
+
+
+def learn_vocabulary(sources):
+    """Same as ``blu.basetable.learn_vocabulary``."""
+    payments = sources["order_payments"]
+    payment_types = payments.loc[payments["payment_type"] != "not_defined", "payment_type"].dropna().unique()
+    categories = sources["products"]["product_category_name"].dropna().unique()
+    return Vocabulary({"payment_type": list(payment_types), "product_category_name": list(categories)})
+
+
+def prepare_reviews(reviews):
+    """Same as ``blu.basetable.prepare_reviews``."""
+    target = (reviews["review_score"] >= 4).astype(float)
+    return (
+        reviews.assign(Target=target)[["review_id", "order_id", "review_score", "Target"]]
+        .drop_duplicates("order_id")
+    )
+
+
+def build_basetable(sources, labelled=True, vocabulary=None, holidays=(), holiday_country=DEFAULT_COUNTRY):
+    """pandas version of ``blu.basetable.build_basetable``; returns ``(TrainingSet, TestSet)``."""
+    has_train = "order_items" in sources
+    has_test = "test_order_items" in sources
+    if vocabulary is None:
+        vocabulary = learn_vocabulary(sources)
+
+    product = prepare_products(_union_splits(sources, "products"))
+    orders = prepare_orders(_union_splits(sources, "orders"), holidays, holiday_country)
+    items = aggregate_items(_union_splits(sources, "order_items"), product, vocabulary)
+    payments = aggregate_payments(_union_splits(sources, "order_payments"), vocabulary)
+
+    basetable = (
+        items
+        .merge(payments, on=ORDER_KEYS)
+        .merge(orders, on=ORDER_KEYS)
+        .dropna()
+    )
+    basetable = basetable.astype({name: "int32" for name in HOUR_FEATURES})
+
+    TrainingSet = TestSet = None
+    if has_train:
+        TrainingSet = basetable[basetable[SPLIT_COLUMN] == TRAIN].drop(columns=SPLIT_COLUMN)
+        if labelled:
+            reviews = prepare_reviews(sources["order_reviews"])
+            TrainingSet = TrainingSet.merge(reviews, on="order_id").dropna()
+        TrainingSet = TrainingSet.reset_index(drop=True)
+    if has_test:
+        TestSet = basetable[basetable[SPLIT_COLUMN] == TEST].drop(columns=SPLIT_COLUMN).reset_index(drop=True)
+    return TrainingSet, TestSet
+
+
+def check_parity(local, spark_df, key="order_id", tolerance=1e-6, ignore=IGNORED_IN_PARITY):
+    """Compare a pandas basetable with the Spark basetable of the same sources.
+
+    Returns the column layout check, the orders only one side has, the
+    numeric columns differing by more than ``tolerance`` (with the largest
+    difference) and the other columns with mismatching values.
+    """
+    expected = spark_df.toPandas()
+    result = {
+        "same_columns": list(local.columns) == list(expected.columns),
+        "local_rows": len(local),
+        "spark_rows": len(expected),
+        "only_local": sorted(set(local[key]) - set(expected[key])),
+        "only_spark": sorted(set(expected[key]) - set(local[key])),
+        "numeric_differences": {},
+        "mismatching_columns": [],
+    }
+    merged = local.merge(expected, on=key, suffixes=("_local", "_spark"))
+    for column in local.columns:
+        if column == key or column in ignore or column not in expected.columns:
+            continue
+        left, right = merged[f"{column}_local"], merged[f"{column}_spark"]
+        if pd.api.types.is_numeric_dtype(left) and pd.api.types.is_numeric_dtype(right):
+            difference = float((left.astype(float) - right.astype(float)).abs().max()) if len(merged) else 0.0
+            if difference > tolerance:
+                result["numeric_differences"][column] = difference
+        elif not left.astype(str).equals(right.astype(str)):
+            result["mismatching_columns"].append(column)
+    result["within_tolerance"] = (
+        result["same_columns"] and not result["only_local"] and not result["only_spark"]
+        and not result["numeric_differences"] and not result["mismatching_columns"]
+    )
+    return result
+
+
+def source_paths(data_dir=None, holdout_dir=None):
+    """``{table: path}`` of the CSVs in the ``data/`` and ``Holdout data/`` layouts."""
+    paths = {}
+    if data_dir:
+        for table in ("products", "orders", "order_items", "order_payments", "order_reviews"):
+            paths[table] = os.path.join(data_dir, f"{table}.csv")
+    if holdout_dir:
+        for table in ("test_products", "test_orders", "test_order_items", "test_order_payments"):
+            paths[table] = os.path.join(holdout_dir, f"{table}.csv")
+    return paths
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Build the BLU basetables with pandas, without Spark.")
+    parser.add_argument("--data-dir", default=None, help="directory with the training CSVs")
+    parser.add_argument("--holdout-dir", default=None, help="directory with the test_*.csv files")
+    parser.add_argument("--vocabulary", default=None, help="vocabulary JSON saved with the model (default: learn it)")
+    parser.add_argument("--unlabelled", action="store_true", help="do not join the training rows with the reviews")
+    parser.add_argument("--output", required=True, help="output directory of TrainingSet.parquet and TestSet.parquet")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    start = time.perf_counter()
+    sources = read_sources(source_paths(args.data_dir, args.holdout_dir))
+    vocabulary = None
+    if args.vocabulary:
+        with open(args.vocabulary) as f:
+            vocabulary = Vocabulary(json.load(f))
+    tables = dict(zip(("TrainingSet", "TestSet"),
+                      build_basetable(sources, labelled=not args.unlabelled, vocabulary=vocabulary)))
+    os.makedirs(args.output, exist_ok=True)
+    for name, df in tables.items():
+        if df is not None:
+            df = df.assign(**{CATEGORY_COLUMN: df[CATEGORY_COLUMN].map(_vector_record)})
+            df.to_parquet(os.path.join(args.output, f"{name}.parquet"), index=False)
+            logger.info("%s: %d rows, %d columns", name, len(df), len(df.columns))
+    logger.info("Built the basetables in %.1f s", time.perf_counter() - start)
+    return tables
+
+
+if __name__ == "__main__":
+    main()
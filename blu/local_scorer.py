@@ -0,0 +1,263 @@
+"""Spark-free scoring of single orders with an exported tree ensemble.
+
+``export_model`` turns a saved scoring ``PipelineModel`` (description
+binning, category slice, or indexers and encoders, assembler, standard scaler and a RandomForest or GBT
+classifier) into one ``.npz`` file: the encodings and scaler as small
+arrays and all trees flattened into node arrays (feature, threshold,
+children, leaf values). ``LocalScorer`` loads that file and scores a dict
+or a batch of dicts with the basetable feature columns using NumPy only,
+walking all trees of all rows at once.
+"""
+
+import json
+import time
+
+import numpy as np
+
+FORMAT_VERSION = 1
+
+
+def _stage_kind(stage):
+    return type(stage).__name__
+
+
+def _read_tree_nodes(spark, classifier, work_dir):
+    """Node rows of all trees, read from the classifier's saved Parquet data."""
+    path = f"{work_dir.rstrip('/')}/classifier"
+    classifier.write().overwrite().save(path)
+    rows = spark.read.parquet(f"{path}/data").select("treeID", "nodeData").collect()
+    trees = {}
+    for row in rows:
+        trees.setdefault(row["treeID"], []).append(row["nodeData"])
+    return [sorted(trees[tree_id], key=lambda node: node["id"]) for tree_id in sorted(trees)]
+
+
+def _flatten_trees(trees, kind, num_classes):
+    """Concatenate the trees into flat node arrays with global child indices."""
+    sizes = [len(nodes) for nodes in trees]
+    offsets = np.concatenate([[0], np.cumsum(sizes)[:-1]]).astype(np.int64)
+    total = int(sum(sizes))
+    max_categories = max([n["split"]["numCategories"] for nodes in trees for n in nodes] + [1])
+
+    feature = np.full(total, -1, dtype=np.int64)
+    threshold = np.zeros(total)
+    left = np.full(total, -1, dtype=np.int64)
+    right = np.full(total, -1, dtype=np.int64)
+    is_categorical = np.zeros(total, dtype=bool)
+    category_mask = np.zeros((total, max_categories), dtype=bool)
+    value = np.zeros((total, num_classes if kind == "RandomForestClassificationModel" else 1))
+    depth = np.zeros(total, dtype=np.int64)
+
+    for offset, nodes in zip(offsets, trees):
+        for node in nodes:
+            i = offset + node["id"]
+            if node["leftChild"] < 0:
+                if value.shape[1] == 1:
+                    value[i, 0] = node["prediction"]
+                else:
+                    stats = np.asarray(node["impurityStats"], dtype=float)
+                    value[i] = stats / stats.sum() if stats.sum() > 0 else stats
+                continue
+            split = node["split"]
+            feature[i] = split["featureIndex"]
+            left[i] = offset + node["leftChild"]
+            right[i] = offset + node["rightChild"]
+            depth[left[i]] = depth[right[i]] = depth[i] + 1
+            if split["numCategories"] < 0:
+                threshold[i] = split["leftCategoriesOrThreshold"][0]
+            else:
+                is_categorical[i] = True
+                category_mask[i, [int(c) for c in split["leftCategoriesOrThreshold"]]] = True
+    return {
+        "roots": offsets, "feature": feature, "threshold": threshold, "left": left, "right": right,
+        "is_categorical": is_categorical, "category_mask": category_mask, "value": value,
+        "max_depth": np.array(int(depth.max()) if total else 0),
+    }
+
+
+def export_model(spark, pipeline_model, path, work_dir):
+    """Export a fitted scoring ``PipelineModel`` to the ``.npz`` file ``path``.
+
+    ``work_dir`` is a Spark-writable directory used to save the classifier
+    once, from which its tree nodes are read back in bulk.
+    """
+    meta = {"format_version": FORMAT_VERSION, "categorical": {}}
+    arrays = {}
+    classifier = None
+    for stage in pipeline_model.stages:
+        kind = _stage_kind(stage)
+        if kind == "StringIndexerModel":
+            for column, labels in zip(stage.getInputCols(), stage.labelsArray):
+                meta["categorical"].setdefault(column, {})["labels"] = list(labels)
+        elif kind == "BinnerModel":
+            for column, dummy, thresholds in zip(stage.getInputCols(), stage.getDummyCols(), stage.getThresholds()):
+                meta.setdefault("binned", {})[dummy] = {
+                    "column": column, "thresholds": list(thresholds), "drop_last": stage.getDropLast(),
+                }
+        elif kind == "VectorSlicer":
+            meta.setdefault("sliced", {})[stage.getOutputCol()] = {
+                "column": stage.getInputCol(), "indices": [int(i) for i in stage.getIndices()],
+            }
+        elif kind == "OneHotEncoderModel":
+            for column, output in zip(stage.getInputCols(), stage.getOutputCols()):
+                meta.setdefault("dummies", {})[output] = {"indexed": column, "drop_last": stage.getDropLast()}
+        elif kind == "VectorAssembler":
+            meta["inputs"] = stage.getInputCols()
+        elif kind == "StandardScalerModel":
+            arrays["scale_std"] = stage.std.toArray()
+            arrays["scale_mean"] = stage.mean.toArray()
+            meta["with_std"], meta["with_mean"] = stage.getWithStd(), stage.getWithMean()
+        elif kind in ("RandomForestClassificationModel", "GBTClassificationModel"):
+            classifier = stage
+        else:
+            raise ValueError(f"Cannot export pipeline stage {kind}")
+    if classifier is None or "inputs" not in meta:
+        raise ValueError("The pipeline needs a VectorAssembler and a RandomForest or GBT classifier")
+
+    # The one-hot inputs are indexed columns; map them back to the string columns of the basetable
+    indexed_to_column = {f"{column}Ind": column for column in meta["categorical"]}
+    for output, dummy in meta.get("dummies", {}).items():
+        dummy["column"] = indexed_to_column[dummy.pop("indexed")]
+
+    kind = _stage_kind(classifier)
+    meta["classifier"] = kind
+    meta["num_classes"] = classifier.numClasses
+    arrays.update(_flatten_trees(_read_tree_nodes(spark, classifier, work_dir), kind, classifier.numClasses))
+    if kind == "GBTClassificationModel":
+        arrays["tree_weights"] = np.asarray(classifier.treeWeights, dtype=float)
+    np.savez_compressed(path, meta=np.array(json.dumps(meta)), **arrays)
+    return path
+
+
+class LocalScorer:
+    """NumPy predictor of an exported model; needs no Spark session."""
+
+    def __init__(self, meta, arrays):
+        self.meta = meta
+        self.inputs = meta["inputs"]
+        self.num_classes = meta["num_classes"]
+        self.is_gbt = meta["classifier"] == "GBTClassificationModel"
+        for name, array in arrays.items():
+            setattr(self, name, array)
+        self.max_depth = int(self.max_depth)
+        self._label_index = {column: {label: i for i, label in enumerate(spec["labels"])}
+                             for column, spec in meta["categorical"].items()}
+        self._dummies = meta.get("dummies", {})
+        self._binned = meta.get("binned", {})
+        self._sliced = meta.get("sliced", {})
+        scale = np.ones(len(self.scale_std))
+        if meta["with_std"]:
+            scale = np.divide(1.0, self.scale_std, out=np.zeros_like(self.scale_std), where=self.scale_std != 0)
+        self._scale = scale
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            meta = json.loads(str(data["meta"]))
+            arrays = {name: data[name] for name in data.files if name != "meta"}
+        if meta["format_version"] != FORMAT_VERSION:
+            raise ValueError(f"Unsupported export format {meta['format_version']}")
+        return cls(meta, arrays)
+
+    def _row_vector(self, order):
+        values = []
+        for name in self.inputs:
+            binned = self._binned.get(name)
+            if binned is not None:
+                size = len(binned["thresholds"]) + (0 if binned["drop_last"] else 1)
+                encoded = [0.0] * size
+                index = int(np.searchsorted(binned["thresholds"], float(order[binned["column"]]), side="left"))
+                if index < size:
+                    encoded[index] = 1.0
+                values.extend(encoded)
+                continue
+            sliced = self._sliced.get(name)
+            if sliced is not None:
+                # a Spark ML vector (e.g. product_categories) or any sequence indexed by position
+                vector = order[sliced["column"]]
+                values.extend(float(vector[i]) for i in sliced["indices"])
+                continue
+            dummy = self._dummies.get(name)
+            if dummy is None:
+                values.append(float(order[name]))
+                continue
+            labels = self._label_index[dummy["column"]]
+            size = len(labels) + 1 - (1 if dummy["drop_last"] else 0)
+            encoded = [0.0] * size
+            index = labels.get(order.get(dummy["column"]), len(labels))
+            if index < size:
+                encoded[index] = 1.0
+            values.extend(encoded)
+        return values
+
+    def features(self, orders):
+        """Scaled feature matrix of one order (dict) or a list of orders."""
+        if isinstance(orders, dict):
+            orders = [orders]
+        X = np.asarray([self._row_vector(order) for order in orders], dtype=float)
+        if self.meta["with_mean"]:
+            X = X - self.scale_mean
+        return X * self._scale
+
+    def _leaves(self, X):
+        rows = np.arange(X.shape[0])[:, None]
+        nodes = np.broadcast_to(self.roots, (X.shape[0], len(self.roots))).copy()
+        last_category = self.category_mask.shape[1] - 1
+        for _ in range(self.max_depth):
+            feature = self.feature[nodes]
+            internal = feature >= 0
+            if not internal.any():
+                break
+            values = X[rows, np.where(internal, feature, 0)]
+            category = np.clip(values.astype(np.int64), 0, last_category)
+            go_left = np.where(self.is_categorical[nodes], self.category_mask[nodes, category],
+                               values <= self.threshold[nodes])
+            nodes = np.where(internal, np.where(go_left, self.left[nodes], self.right[nodes]), nodes)
+        return nodes
+
+    def predict_proba(self, orders):
+        """Class probabilities, shape ``(n_orders, num_classes)``."""
+        leaves = self._leaves(self.features(orders))
+        if self.is_gbt:
+            margin = (self.value[leaves, 0] * self.tree_weights).sum(axis=1)
+            positive = 1.0 / (1.0 + np.exp(-2.0 * margin))
+            return np.column_stack([1.0 - positive, positive])
+        raw = self.value[leaves].sum(axis=1)
+        return raw / raw.sum(axis=1, keepdims=True)
+
+    def predict(self, orders):
+        return self.predict_proba(orders).argmax(axis=1).astype(float)
+
+
+def check_parity(scorer, spark_predictions, prediction_col="prediction", probability_col="probability",
+                 tolerance=1e-6, timing_sample=1000):
+    """Compare ``scorer`` with the Spark predictions of the same orders.
+
+    ``spark_predictions`` must hold the basetable columns the model uses plus
+    the Spark prediction and probability. Returns the number of rows
+    compared, prediction mismatches, the largest probability difference and
+    the mean latency of scoring one order at a time.
+    """
+    encoded = {**scorer._dummies, **scorer._binned, **scorer._sliced}
+    columns = sorted({c for c in scorer.inputs if c not in encoded} | {d["column"] for d in encoded.values()})
+    rows = spark_predictions.select(*columns, prediction_col, probability_col).collect()
+    orders = [{c: row[c] for c in columns} for row in rows]
+    expected_prediction = np.array([row[prediction_col] for row in rows])
+    expected_probability = np.array([row[probability_col].toArray() for row in rows])
+
+    probability = scorer.predict_proba(orders)
+    prediction = probability.argmax(axis=1).astype(float)
+    sample = orders[:timing_sample]
+    start = time.perf_counter()
+    for order in sample:
+        scorer.predict_proba(order)
+    latency = (time.perf_counter() - start) / max(len(sample), 1)
+
+    max_difference = float(np.abs(probability - expected_probability).max()) if rows else 0.0
+    return {
+        "rows": len(rows),
+        "prediction_mismatches": int((prediction != expected_prediction).sum()),
+        "max_probability_difference": max_difference,
+        "within_tolerance": max_difference <= tolerance,
+        "seconds_per_order": latency,
+    }
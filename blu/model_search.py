@@ -0,0 +1,123 @@
+"""Parallel cross-validated search over several estimators and their grids.
+
+The folds are split once and each fold's training and validation part is
+persisted, then every (estimator, param map, fold) fit runs on a bounded
+thread pool so independent fits overlap on the cluster instead of running
+one after another as in separate ``CrossValidator`` runs with
+``parallelism=1``. The result is a single leaderboard plus, per estimator,
+its best configuration refitted on all data (as ``CrossValidator`` does).
+"""
+
+import logging
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+from pyspark import StorageLevel, inheritable_thread_target
+from pyspark.sql.functions import col, rand
+
+logger = logging.getLogger(__name__)
+
+SearchResult = namedtuple("SearchResult", ["leaderboard", "best_models", "best_params"])
+
+FOLD_COLUMN = "_fold"
+
+
+def param_dict(param_map):
+    """``{param name: value}`` of a param map, for display."""
+    return {param.name: value for param, value in param_map.items()}
+
+
+def default_parallelism(spark):
+    """Number of concurrent fits: the cores available to the Spark application."""
+    return max(1, spark.sparkContext.defaultParallelism)
+
+
+def split_folds(df, num_folds, seed=None, storage_level=StorageLevel.MEMORY_AND_DISK):
+    """Split ``df`` into ``num_folds`` persisted ``(train, validation)`` pairs."""
+    with_fold = df.withColumn(FOLD_COLUMN, (rand(seed) * num_folds).cast("int"))
+    folds = []
+    for fold in range(num_folds):
+        train = with_fold.where(col(FOLD_COLUMN) != fold).drop(FOLD_COLUMN).persist(storage_level)
+        validation = with_fold.where(col(FOLD_COLUMN) == fold).drop(FOLD_COLUMN).persist(storage_level)
+        folds.append((train, validation))
+    return folds
+
+
+class ModelSearch:
+    """Cross-validates several estimators and param grids concurrently.
+
+    ``candidates`` maps a name to ``(estimator, param_maps)``, e.g. the output
+    of ``ParamGridBuilder().build()``. ``evaluator`` scores the validation
+    predictions; ``parallelism`` bounds the number of concurrent fits and
+    defaults to the application's cores.
+    """
+
+    def __init__(self, candidates, evaluator, num_folds=5, parallelism=None, seed=None):
+        if num_folds < 2:
+            raise ValueError("num_folds must be at least 2")
+        self.candidates = candidates
+        self.evaluator = evaluator
+        self.num_folds = num_folds
+        self.parallelism = parallelism
+        self.seed = seed
+
+    def _fit_and_evaluate(self, task, folds):
+        name, index, fold = task
+        estimator, param_maps = self.candidates[name]
+        train, validation = folds[fold]
+        model = estimator.fit(train, param_maps[index])
+        metric = self.evaluator.evaluate(model.transform(validation))
+        logger.info("%s %s fold %d: %.4f", name, param_dict(param_maps[index]), fold, metric)
+        return metric
+
+    def _leaderboard(self, tasks, metrics):
+        fold_metrics = {}
+        for (name, index, _), metric in zip(tasks, metrics):
+            fold_metrics.setdefault((name, index), []).append(metric)
+        rows = []
+        for (name, index), values in fold_metrics.items():
+            rows.append({
+                "estimator": name,
+                "params": param_dict(self.candidates[name][1][index]),
+                "param_index": index,
+                "metric": float(np.mean(values)),
+                "metric_std": float(np.std(values)),
+                "fold_metrics": values,
+            })
+        ascending = not self.evaluator.isLargerBetter()
+        return pd.DataFrame(rows).sort_values("metric", ascending=ascending).reset_index(drop=True)
+
+    def fit(self, df):
+        """Run the search on ``df`` and return a ``SearchResult``."""
+        parallelism = self.parallelism or default_parallelism(df.sparkSession)
+        folds = split_folds(df, self.num_folds, self.seed)
+        tasks = [
+            (name, index, fold)
+            for name, (_, param_maps) in self.candidates.items()
+            for index in range(len(param_maps))
+            for fold in range(self.num_folds)
+        ]
+        logger.info("Running %d fits on %d threads", len(tasks), parallelism)
+        # the pool threads run the fits with this thread's local properties (job group, scheduler pool)
+        fit_and_evaluate = inheritable_thread_target(lambda task: self._fit_and_evaluate(task, folds))
+        try:
+            with ThreadPoolExecutor(max_workers=parallelism) as pool:
+                metrics = list(pool.map(fit_and_evaluate, tasks))
+        finally:
+            for train, validation in folds:
+                train.unpersist()
+                validation.unpersist()
+
+        leaderboard = self._leaderboard(tasks, metrics)
+        best = leaderboard.groupby("estimator", sort=False).head(1)
+        best_params = {row.estimator: self.candidates[row.estimator][1][row.param_index] for row in best.itertuples()}
+
+        def refit(name):
+            estimator, _ = self.candidates[name]
+            return name, estimator.fit(df, best_params[name])
+
+        with ThreadPoolExecutor(max_workers=min(parallelism, len(best_params))) as pool:
+            best_models = dict(pool.map(inheritable_thread_target(refit), best_params))
+        return SearchResult(leaderboard, best_models, {name: param_dict(p) for name, p in best_params.items()})
@@ -0,0 +1,90 @@
+"""Explicit lifecycle for the DataFrames the notebook reuses.
+
+A stage is registered under a name with the consumers that still need it
+(e.g. the model fits reading ``rTrain``). It is persisted or checkpointed
+once, and unpersisted as soon as its last consumer reports that it is done.
+Checkpointing also truncates the long ``withColumn``/join lineage, so later
+actions and fits do not re-plan or recompute it.
+"""
+
+import logging
+
+from pyspark import StorageLevel
+
+logger = logging.getLogger(__name__)
+
+
+class PersistManager:
+    """Tracks the persisted stages of a run and their remaining consumers."""
+
+    def __init__(self, spark, checkpoint_dir=None):
+        self.spark = spark
+        self._stages = {}
+        self._consumers = {}
+        if checkpoint_dir is not None:
+            spark.sparkContext.setCheckpointDir(checkpoint_dir)
+
+    def persist(self, name, df, level=StorageLevel.MEMORY_AND_DISK, consumers=()):
+        """Persist ``df`` as stage ``name`` until all ``consumers`` are done with it."""
+        self.release(name)
+        df = df.persist(level)
+        self._stages[name] = df
+        self._consumers[name] = set(consumers)
+        logger.info("Persisted %s (%s) for %s", name, level, sorted(consumers) or "manual release")
+        return df
+
+    def checkpoint(self, name, df, level=StorageLevel.MEMORY_AND_DISK, consumers=()):
+        """Checkpoint ``df`` to the checkpoint directory, then persist the result.
+
+        The returned DataFrame has a lineage that starts at the checkpoint.
+        """
+        if self.spark.sparkContext.getCheckpointDir() is None:
+            raise ValueError("No checkpoint directory is set; pass checkpoint_dir to PersistManager")
+        return self.persist(name, df.checkpoint(eager=True), level, consumers)
+
+    def done(self, consumer):
+        """Mark ``consumer`` as finished and unpersist the stages nobody needs anymore."""
+        for name in list(self._consumers):
+            consumers = self._consumers[name]
+            if consumer in consumers:
+                consumers.discard(consumer)
+                if not consumers:
+                    self.release(name)
+
+    def release(self, name):
+        """Unpersist stage ``name`` if it is persisted."""
+        df = self._stages.pop(name, None)
+        self._consumers.pop(name, None)
+        if df is not None:
+            df.unpersist()
+            logger.info("Released %s", name)
+
+    def release_all(self):
+        for name in list(self._stages):
+            self.release(name)
+
+    @property
+    def stages(self):
+        return list(self._stages)
+
+    def cached_bytes(self):
+        """Memory and disk bytes held by all cached RDDs of the Spark context."""
+        infos = self.spark.sparkContext._jsc.sc().getRDDStorageInfo()
+        memory = sum(info.memSize() for info in infos)
+        disk = sum(info.diskSize() for info in infos)
+        return {"memory": memory, "disk": disk, "total": memory + disk}
+
+    def report(self):
+        """Printable overview of the managed stages and the cached bytes."""
+        lines = [f"{name}: {df.storageLevel}, waiting for {sorted(self._consumers[name]) or 'manual release'}"
+                 for name, df in self._stages.items()]
+        cached = self.cached_bytes()
+        lines.append(f"cached: {cached['memory']} bytes in memory, {cached['disk']} bytes on disk")
+        return "\n".join(lines)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release_all()
+        return False
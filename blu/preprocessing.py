@@ -0,0 +1,86 @@
+"""Fit-once feature chain for training and scoring.
+
+The optional binning of the description sizes (see ``blu.binning``), the
+slice of the selected product categories out of the ``product_categories``
+count vector (see ``blu.category_encoding``), the vector assembler and the
+standard scaler are fitted on the training data only and, together with the
+chosen classifier, saved as one ``PipelineModel``. Scoring the holdout (or
+any new orders) is then a single ``transform`` with no fitting and exactly
+the training encodings and scaling.
+"""
+
+from pyspark.ml import Pipeline, PipelineModel
+from pyspark.ml.feature import StandardScaler, VectorAssembler
+
+from blu.binning import Binner
+from blu.category_encoding import CATEGORY_COLUMN, CATEGORY_FEATURES_COL
+
+# Binned description sizes: basetable column -> (bucket index, dummy vector, fixed thresholds). Not part of the
+# model features unless passed as ``binned_features``.
+BINNED_FEATURES = {
+    "mean_name": ("name_length", "name_length_dum", (20, 50)),
+    "mean_description": ("description_length", "prod_desc_dum", (500, 1500)),
+    "mean_photo": ("nbr_photo", "nbr_photo_dum", (5, 15)),
+}
+FEATURES_COL = "scaleFeatures"
+
+
+def input_columns(numeric_features, binned_features=None, categories=None):
+    """Basetable columns the preprocessing reads, each once."""
+    columns = list(numeric_features) + list(binned_features or {}) + ([CATEGORY_COLUMN] if categories else [])
+    return list(dict.fromkeys(columns))
+
+
+def preprocessing_stages(numeric_features, binned_features=None, features_col=FEATURES_COL,
+                         learn_thresholds=False, num_buckets=3, categories=None, category_encoder=None):
+    """Unfitted stages turning the basetable columns into the scaled ``features_col`` vector.
+
+    ``binned_features`` (e.g. ``BINNED_FEATURES``) adds the dummy vectors of
+    binned columns to the features; with ``learn_thresholds`` their bucket
+    thresholds are ``num_buckets`` quantiles of the training data instead of
+    the fixed ones. ``categories`` are the product categories whose counts
+    are sliced out of the ``product_categories`` vector with
+    ``category_encoder`` (the one the basetable was built with).
+    """
+    stages = []
+    assembler_inputs = list(numeric_features)
+    if binned_features:
+        inputs = list(binned_features)
+        binner = Binner(
+            inputCols=inputs,
+            outputCols=[binned_features[c][0] for c in inputs],
+            dummyCols=[binned_features[c][1] for c in inputs],
+            thresholds=None if learn_thresholds else [list(binned_features[c][2]) for c in inputs],
+            numBuckets=num_buckets,
+        )
+        stages.append(binner)
+        assembler_inputs += [binned_features[c][1] for c in inputs]
+    if categories:
+        if category_encoder is None:
+            raise ValueError("Selecting categories needs the CategoryEncoder of the basetable")
+        stages.append(category_encoder.selector(categories))
+        assembler_inputs.append(CATEGORY_FEATURES_COL)
+    stages.append(VectorAssembler(inputCols=assembler_inputs, outputCol="numericalFeatures"))
+    stages.append(StandardScaler(inputCol="numericalFeatures", outputCol=features_col, withStd=True, withMean=False))
+    return stages
+
+
+def build_preprocessing(numeric_features, binned_features=None, features_col=FEATURES_COL,
+                        learn_thresholds=False, num_buckets=3, categories=None, category_encoder=None):
+    """Unfitted ``Pipeline`` of the preprocessing stages only."""
+    return Pipeline(stages=preprocessing_stages(numeric_features, binned_features, features_col,
+                                                learn_thresholds, num_buckets, categories, category_encoder))
+
+
+def scoring_model(preprocessing_model, classifier_model):
+    """Combine a fitted preprocessing ``PipelineModel`` and a fitted classifier into one model."""
+    return PipelineModel(stages=list(preprocessing_model.stages) + [classifier_model])
+
+
+def save_model(model, path):
+    """Save a fitted ``PipelineModel``, replacing an earlier one at ``path``."""
+    model.write().overwrite().save(path)
+
+
+def load_model(path):
+    return PipelineModel.load(path)
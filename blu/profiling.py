@@ -0,0 +1,129 @@
+"""Single-pass data-quality profiling of DataFrames.
+
+``Profiler.profile`` computes the row count, the duplicate row count (exact
+distinct count of a 64-bit row hash) and, for every column, the null, NaN and approximate distinct counts plus
+min/max/mean in one aggregation, i.e. one Spark job per DataFrame instead of
+separate ``show``/``describe``/``count``/null-count actions. Profiling can be
+switched off for production runs, in which case nothing is computed.
+"""
+
+import html
+import json
+import os
+
+from pyspark.sql.functions import approx_count_distinct, avg, col, count, countDistinct, isnan, lit, when, xxhash64
+from pyspark.sql.functions import max as max_
+from pyspark.sql.functions import min as min_
+from pyspark.sql.types import (
+    BooleanType,
+    DateType,
+    DoubleType,
+    FloatType,
+    NumericType,
+    StringType,
+    TimestampType,
+)
+
+ORDERABLE_TYPES = (NumericType, StringType, TimestampType, DateType, BooleanType)
+STATISTICS = ["type", "nulls", "nans", "approx_distinct", "min", "max", "mean"]
+
+
+def profiling_enabled():
+    """Profiling is on unless the ``BLU_PROFILING`` environment variable is ``0``."""
+    return os.environ.get("BLU_PROFILING", "1") != "0"
+
+
+def _column_expressions(index, field):
+    c = col(f"`{field.name}`")
+    exprs = {"nulls": count(when(c.isNull(), 1))}
+    if isinstance(field.dataType, (DoubleType, FloatType)):
+        exprs["nans"] = count(when(isnan(c), 1))
+    if isinstance(field.dataType, ORDERABLE_TYPES):
+        exprs["approx_distinct"] = approx_count_distinct(c)
+        exprs["min"] = min_(c)
+        exprs["max"] = max_(c)
+    if isinstance(field.dataType, NumericType):
+        exprs["mean"] = avg(c)
+    return {f"c{index}_{stat}": expr.alias(f"c{index}_{stat}") for stat, expr in exprs.items()}
+
+
+def _json_value(value):
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return str(value)
+
+
+def profile_dataframe(df):
+    """Profile ``df`` with one aggregation and return the statistics as a dict."""
+    fields = df.schema.fields
+    hashable = [col(f"`{f.name}`") for f in fields if isinstance(f.dataType, ORDERABLE_TYPES)]
+    exprs = [count(lit(1)).alias("rows")]
+    if hashable:
+        # exact: HyperLogLog's error on the row count would swamp the few real duplicates
+        exprs.append(countDistinct(xxhash64(*hashable)).alias("distinct_rows"))
+    per_column = [_column_expressions(i, f) for i, f in enumerate(fields)]
+    for column_exprs in per_column:
+        exprs.extend(column_exprs.values())
+
+    row = df.agg(*exprs).first().asDict()
+    report = {
+        "rows": row["rows"],
+        "duplicate_rows": max(row["rows"] - row["distinct_rows"], 0) if hashable else None,
+        "columns": {},
+    }
+    for i, field in enumerate(fields):
+        stats = {"type": field.dataType.simpleString()}
+        for key in per_column[i]:
+            stats[key.split("_", 1)[1]] = _json_value(row[key])
+        report["columns"][field.name] = stats
+    return report
+
+
+class Profiler:
+    """Collects the profiles of named DataFrames and writes them as a report."""
+
+    def __init__(self, enabled=None):
+        self.enabled = profiling_enabled() if enabled is None else enabled
+        self.profiles = {}
+
+    def profile(self, name, df):
+        """Profile ``df`` under ``name``; returns ``None`` when profiling is off."""
+        if not self.enabled:
+            return None
+        self.profiles[name] = profile_dataframe(df)
+        return self.profiles[name]
+
+    def summary(self, name):
+        """Printable one-line-per-column overview of the profile of ``name``."""
+        report = self.profiles[name]
+        lines = [f"{name}: {report['rows']} rows, {report['duplicate_rows']} duplicate rows"]
+        for column, stats in report["columns"].items():
+            values = ", ".join(f"{stat}={stats[stat]}" for stat in STATISTICS[1:] if stat in stats)
+            lines.append(f"  {column} ({stats['type']}): {values}")
+        return "\n".join(lines)
+
+    def to_html(self):
+        parts = ["<html><head><meta charset='utf-8'><title>BLU data profile</title></head><body>"]
+        for name, report in self.profiles.items():
+            parts.append(f"<h2>{html.escape(name)}</h2>")
+            parts.append(f"<p>{report['rows']} rows, {report['duplicate_rows']} duplicate rows</p>")
+            parts.append("<table border='1'><tr><th>column</th>"
+                         + "".join(f"<th>{stat}</th>" for stat in STATISTICS) + "</tr>")
+            for column, stats in report["columns"].items():
+                cells = "".join(f"<td>{html.escape(str(stats.get(stat, '')))}</td>" for stat in STATISTICS)
+                parts.append(f"<tr><td>{html.escape(column)}</td>{cells}</tr>")
+            parts.append("</table>")
+        parts.append("</body></html>")
+        return "\n".join(parts)
+
+    def write_report(self, path):
+        """Write ``<path>.json`` and ``<path>.html``; does nothing when profiling is off."""
+        if not self.enabled:
+            return
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(f"{path}.json", "w", encoding="utf-8") as f:
+            json.dump(self.profiles, f, indent=2)
+        with open(f"{path}.html", "w", encoding="utf-8") as f:
+            f.write(self.to_html())
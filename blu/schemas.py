@@ -0,0 +1,129 @@
+"""Typed schemas for the BLU source tables and the loader that uses them.
+
+Declaring the schema up front means Spark reads every CSV once (no
+``inferSchema`` pass) and timestamps and numbers arrive already typed, so
+the feature code does not need ``unix_timestamp`` or ``.cast`` calls.
+"""
+
+from pyspark.sql.types import (
+    DoubleType,
+    IntegerType,
+    StringType,
+    StructField,
+    StructType,
+    TimestampType,
+)
+
+TIMESTAMP_FORMAT = "yyyy-MM-dd HH:mm:ss"
+
+PRODUCTS_SCHEMA = StructType([
+    StructField("product_id", StringType()),
+    StructField("product_name_lenght", IntegerType()),
+    StructField("product_description_lenght", IntegerType()),
+    StructField("product_photos_qty", IntegerType()),
+    StructField("product_weight_g", DoubleType()),
+    StructField("product_length_cm", DoubleType()),
+    StructField("product_height_cm", DoubleType()),
+    StructField("product_width_cm", DoubleType()),
+    StructField("product_category_name", StringType()),
+])
+
+ORDERS_SCHEMA = StructType([
+    StructField("order_id", StringType()),
+    StructField("order_status", StringType()),
+    StructField("order_purchase_timestamp", TimestampType()),
+    StructField("order_approved_at", TimestampType()),
+    StructField("order_delivered_carrier_date", TimestampType()),
+    StructField("order_delivered_customer_date", TimestampType()),
+    StructField("order_estimated_delivery_date", TimestampType()),
+    StructField("customer_id", StringType()),
+])
+
+ORDER_ITEMS_SCHEMA = StructType([
+    StructField("order_id", StringType()),
+    StructField("order_item_id", IntegerType()),
+    StructField("product_id", StringType()),
+    StructField("price", DoubleType()),
+    StructField("shipping_cost", DoubleType()),
+])
+
+ORDER_PAYMENTS_SCHEMA = StructType([
+    StructField("order_id", StringType()),
+    StructField("payment_sequential", IntegerType()),
+    StructField("payment_type", StringType()),
+    StructField("payment_installments", IntegerType()),
+    StructField("payment_value", DoubleType()),
+])
+
+ORDER_REVIEWS_SCHEMA = StructType([
+    StructField("review_id", StringType()),
+    StructField("order_id", StringType()),
+    StructField("review_score", DoubleType()),
+    StructField("review_creation_date", TimestampType()),
+    StructField("review_answer_timestamp", TimestampType()),
+])
+
+# Holdout tables share the layout of their training counterpart.
+SCHEMAS = {
+    "products": PRODUCTS_SCHEMA,
+    "test_products": PRODUCTS_SCHEMA,
+    "orders": ORDERS_SCHEMA,
+    "test_orders": ORDERS_SCHEMA,
+    "order_items": ORDER_ITEMS_SCHEMA,
+    "test_order_items": ORDER_ITEMS_SCHEMA,
+    "order_payments": ORDER_PAYMENTS_SCHEMA,
+    "test_order_payments": ORDER_PAYMENTS_SCHEMA,
+    "order_reviews": ORDER_REVIEWS_SCHEMA,
+}
+
+# orders and order_reviews contain quoted fields spanning several lines.
+MULTILINE_TABLES = {"orders", "test_orders", "order_reviews"}
+
+
+def get_schema(table):
+    """Return the StructType registered for ``table``."""
+    try:
+        return SCHEMAS[table]
+    except KeyError:
+        raise ValueError(f"Unknown table '{table}', expected one of {sorted(SCHEMAS)}") from None
+
+
+def _csv_options(reader, table, extra_fields=()):
+    reader = (
+        reader.format("csv")
+        .schema(StructType(get_schema(table).fields + list(extra_fields)))
+        .option("header", "true")
+        .option("escape", "\"")
+        .option("nullValue", "NA")
+        .option("timestampFormat", TIMESTAMP_FORMAT)
+        .option("mode", "PERMISSIVE")
+    )
+    if table in MULTILINE_TABLES:
+        reader = reader.option("multiline", "true")
+    return reader
+
+
+def read_csv(spark, table, path, extra_fields=()):
+    """Read the source CSV of ``table`` from ``path`` with its declared schema.
+
+    ``extra_fields`` are appended to the schema, e.g. the partition columns
+    of a partitioned directory.
+    """
+    return _csv_options(spark.read, table, extra_fields).load(path)
+
+
+def read_csv_stream(spark, table, path, max_files_per_trigger=None, extra_fields=()):
+    """Streaming file source over the CSV files of ``table`` landing in ``path``.
+
+    A streaming source only fills the partition columns its schema lists, so
+    they must be given in ``extra_fields``.
+    """
+    reader = _csv_options(spark.readStream, table, extra_fields)
+    if max_files_per_trigger:
+        reader = reader.option("maxFilesPerTrigger", max_files_per_trigger)
+    return reader.load(path)
+
+
+def read_sources(spark, paths):
+    """Read every ``{table: path}`` entry of ``paths`` into a DataFrame."""
+    return {table: read_csv(spark, table, path) for table, path in paths.items()}
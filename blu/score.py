@@ -0,0 +1,131 @@
+"""Batch scoring of holdout order files with a saved model.
+
+Usage::
+
+    python -m blu.score --model /FileStore/models/blu/pipeline \\
+        --vocabulary /FileStore/models/blu/vocabulary.json \\
+        --category-encoder /FileStore/models/blu/category_encoder.json \\
+        --holdout-dir "Holdout data" --output /FileStore/predictions
+
+The holdout directory holds ``test_orders.csv``, ``test_order_items.csv``,
+``test_order_payments.csv`` and ``test_products.csv`` (the layout of
+``Holdout data/``). The features are built with the same code as the
+basetable, the saved ``PipelineModel`` (preprocessing and classifier) is
+applied, and ``order_id, pred_review_score, probability`` is written,
+partitioned by scoring date. Nothing is fitted. The category counts are
+laid out by the ``CategoryEncoder`` saved with the model, so a model trained
+on hashed categories is scored on hashed categories.
+"""
+
+import argparse
+import logging
+import posixpath
+import time
+from datetime import date
+
+from pyspark.ml.functions import vector_to_array
+from pyspark.sql import SparkSession
+from pyspark.sql.functions import array_max, col, lit
+
+from blu import fs
+from blu.basetable import build_basetable
+from blu.category_encoding import CategoryEncoder
+from blu.preprocessing import load_model
+from blu.schemas import read_sources
+from blu.vocabulary import Vocabulary
+
+logger = logging.getLogger(__name__)
+
+HOLDOUT_TABLES = ["test_orders", "test_order_items", "test_order_payments", "test_products"]
+PARTITION_COLUMN = "scoring_date"
+CATEGORY_ENCODER_FILE = "category_encoder.json"
+
+
+def holdout_paths(holdout_dir):
+    return {table: f"{holdout_dir.rstrip('/')}/{table}.csv" for table in HOLDOUT_TABLES}
+
+
+def load_category_encoder(spark, vocabulary_path, vocabulary, path=None):
+    """The ``CategoryEncoder`` saved with the model.
+
+    ``path`` defaults to ``category_encoder.json`` next to the vocabulary;
+    models saved without one counted the categories of the vocabulary.
+    """
+    if path is None:
+        path = posixpath.join(posixpath.dirname(vocabulary_path), CATEGORY_ENCODER_FILE)
+        if not fs.exists(spark, path):
+            logger.warning("No %s, counting the categories of the vocabulary", path)
+            return CategoryEncoder.from_vocabulary(vocabulary)
+    return CategoryEncoder.load(spark, path)
+
+
+def score_orders(model, vocabulary, sources, category_encoder=None):
+    """Predictions of ``model`` for the holdout ``sources`` (``{table: DataFrame}``).
+
+    ``category_encoder`` must be the one the model was trained with (default:
+    the categories of ``vocabulary``). Returns ``order_id``,
+    ``pred_review_score`` and ``probability``, the model's probability of the
+    predicted class.
+    """
+    _, TestSet = build_basetable(sources, labelled=False, vocabulary=vocabulary, category_encoder=category_encoder)
+    predictions = model.transform(TestSet)
+    return predictions.select(
+        "order_id",
+        col("prediction").alias("pred_review_score"),
+        array_max(vector_to_array(col("probability"))).alias("probability"),
+    )
+
+
+def write_predictions(predictions, output, output_format="parquet", scoring_date=None):
+    """Write ``predictions`` under ``output``, replacing only the partition of ``scoring_date``."""
+    scoring_date = scoring_date or date.today().isoformat()
+    (
+        predictions.withColumn(PARTITION_COLUMN, lit(scoring_date))
+        .write.mode("overwrite")
+        .option("partitionOverwriteMode", "dynamic")
+        .option("header", "true")
+        .partitionBy(PARTITION_COLUMN)
+        .format(output_format)
+        .save(output)
+    )
+    return scoring_date
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Score holdout orders with a saved BLU model.")
+    parser.add_argument("--model", required=True, help="path of the saved PipelineModel")
+    parser.add_argument("--vocabulary", required=True, help="path of the vocabulary saved with the model")
+    parser.add_argument("--category-encoder", default=None,
+                        help="path of the category encoder saved with the model (default: next to the vocabulary)")
+    parser.add_argument("--holdout-dir", required=True, help="directory with the test_*.csv files")
+    parser.add_argument("--output", required=True, help="output directory of the predictions")
+    parser.add_argument("--format", default="parquet", choices=["parquet", "csv"], help="output format")
+    parser.add_argument("--scoring-date", default=None, help="partition value (default: today, YYYY-MM-DD)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    spark = SparkSession.builder.appName("blu-batch-scoring").getOrCreate()
+
+    start = time.perf_counter()
+    model = load_model(args.model)
+    vocabulary = Vocabulary.load(spark, args.vocabulary)
+    category_encoder = load_category_encoder(spark, args.vocabulary, vocabulary, args.category_encoder)
+    sources = read_sources(spark, holdout_paths(args.holdout_dir))
+    predictions = score_orders(model, vocabulary, sources, category_encoder)
+    scoring_date = write_predictions(predictions, args.output, args.format, args.scoring_date)
+    elapsed = time.perf_counter() - start
+
+    rows = (
+        spark.read.format(args.format).option("header", "true").load(args.output)
+        .where(col(PARTITION_COLUMN) == scoring_date)
+        .count()
+    )
+    logger.info("Scored %d orders in %.1f s (%.0f rows/sec) into %s", rows, elapsed, rows / elapsed, args.output)
+    return rows
+
+
+if __name__ == "__main__":
+    main()
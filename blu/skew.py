@@ -0,0 +1,102 @@
+"""Detection and salting of heavy join and grouping keys.
+
+A bulk order or a best-selling product puts all of its rows into one
+partition when a table is hash partitioned or sort-merge joined on that key,
+and that single task then sets the duration of the stage. ``SkewDetector``
+estimates the rows per key from a small sample and flags the keys that alone
+would fill more than a partition's share of the table.
+
+What happens with the flagged keys depends on the operation:
+
+- Grouping by a hot key needs no salt: Spark's partial aggregation reduces
+  the key's rows inside every input partition before the shuffle, so the
+  reducer only merges one partial row per partition. ``blu.joins`` therefore
+  does not hash partition a table with hot order keys up front (that would
+  move all raw rows of the key to one task).
+- ``salted_join`` handles a join on a hot key: the key gets a random salt on
+  the large side and the matching rows of the other side are replicated
+  once per salt value. Joins of the aggregated per-order tables are left to
+  adaptive execution's skew-join splitting.
+"""
+
+import logging
+import math
+from collections import namedtuple
+
+from pyspark.sql.functions import array, col, desc, explode, floor, lit, rand, sequence, when
+from pyspark.sql.functions import sum as sum_
+
+logger = logging.getLogger(__name__)
+
+SALT_COLUMN = "_salt"
+
+# keys: {key value: estimated rows}, heaviest first
+SkewReport = namedtuple("SkewReport", ["name", "key", "keys", "threshold", "buckets", "sample_fraction"])
+
+
+class SkewDetector:
+    """Finds the keys of a DataFrame with more rows than a partition should hold.
+
+    A key is skewed when its estimated row count is at least ``skew_factor``
+    times the rows per partition (and it was seen ``min_sample_rows`` times
+    in the sample). At most ``max_keys`` keys are reported and salted.
+    """
+
+    def __init__(self, sample_fraction=0.01, skew_factor=1.0, min_sample_rows=5, max_keys=100, seed=17):
+        self.sample_fraction = sample_fraction
+        self.skew_factor = skew_factor
+        self.min_sample_rows = min_sample_rows
+        self.max_keys = max_keys
+        self.seed = seed
+
+    def detect(self, name, df, key, num_partitions):
+        """``SkewReport`` of ``key`` in ``df`` spread over ``num_partitions`` partitions."""
+        counts = df.sample(False, self.sample_fraction, self.seed).groupBy(key).count().persist()
+        try:
+            sampled = counts.agg(sum_("count")).first()[0] or 0
+            total = sampled / self.sample_fraction
+            threshold = max(total / num_partitions * self.skew_factor, self.min_sample_rows / self.sample_fraction)
+            heavy = (
+                counts.where(col("count") >= threshold * self.sample_fraction)
+                .orderBy(desc("count"))
+                .limit(self.max_keys)
+                .collect()
+            )
+        finally:
+            counts.unpersist()
+        keys = {row[key]: int(row["count"] / self.sample_fraction) for row in heavy}
+        buckets = 1
+        if keys:
+            rows_per_partition = max(total / num_partitions, 1.0)
+            buckets = min(num_partitions, max(2, math.ceil(max(keys.values()) / rows_per_partition)))
+        report = SkewReport(name, key, keys, int(threshold), buckets, self.sample_fraction)
+        if keys:
+            top = ", ".join(f"{value} (~{rows} rows)" for value, rows in list(keys.items())[:5])
+            logger.info("%s: %d skewed %s values over %d rows, salted into %d buckets; heaviest: %s",
+                        name, len(keys), key, report.threshold, buckets, top)
+        else:
+            logger.info("%s: no skewed %s values (threshold %d rows)", name, key, report.threshold)
+        return report
+
+
+def _salt(report, seed=None):
+    """Random salt in ``[0, buckets)`` for the skewed keys, 0 for all others."""
+    hot = col(report.key).isin(list(report.keys))
+    return when(hot, floor(rand(seed) * report.buckets)).otherwise(0).cast("int")
+
+
+def salted_join(left, right, on, report, how="inner"):
+    """Join ``left`` with ``right`` on ``on``, salting the skewed keys of ``left`` found in ``report``.
+
+    ``report.key`` must be one of the ``on`` columns. The right side's rows
+    with a skewed key are replicated ``report.buckets`` times.
+    """
+    if not report.keys:
+        return left.join(right, on, how)
+    hot = col(report.key).isin(list(report.keys))
+    salts = when(hot, sequence(lit(0), lit(report.buckets - 1))).otherwise(array(lit(0)))
+    return (
+        left.withColumn(SALT_COLUMN, _salt(report))
+        .join(right.withColumn(SALT_COLUMN, explode(salts)), list(on) + [SALT_COLUMN], how)
+        .drop(SALT_COLUMN)
+    )
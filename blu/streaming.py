@@ -0,0 +1,203 @@
+"""Streaming scoring of new orders landing as CSV drops.
+
+The landing directory has one sub-directory per table, partitioned by the
+date the files arrived::
+
+    <landing>/orders/arrival_date=2024-05-02/          new orders (this one drives the stream)
+    <landing>/order_items/arrival_date=2024-05-02/     their items
+    <landing>/order_payments/arrival_date=2024-05-02/  their payments
+    <landing>/products/arrival_date=2024-05-02/        the products of those items
+
+A Structured Streaming file source watches ``orders/``. Every micro-batch
+takes the orders that arrived, reads the items and payments landed on the
+arrival dates of those orders (and ``lookback_days`` before), keeps the
+items and payments of exactly those orders, builds the per-order features
+with the basetable code, scores them with the saved model and appends the
+predictions to a Parquet sink. Only those date partitions are read, so a
+batch does not get slower as the landing history grows. The items and
+payments of an order must be landed no later than its orders file and at
+most ``lookback_days`` before it. Products are the catalogue: all landed
+product files are read, and a product landed again replaces its earlier
+rows. Progress is checkpointed, so a restarted stream continues with the
+files it has not processed yet.
+
+Locally, any directory works as the landing zone; ``--land-holdout`` copies
+the ``Holdout data/`` files into it as today's drop and ``--once`` processes
+the files present and stops (the category encoder saved with the model is
+found next to the vocabulary, or given with ``--category-encoder``)::
+
+    python -m blu.streaming --model ... --vocabulary ... --landing /tmp/landing \\
+        --output /tmp/predictions --checkpoint /tmp/checkpoint --land-holdout "Holdout data" --once
+"""
+
+import argparse
+import logging
+import os
+import shutil
+import time
+from datetime import date, timedelta
+
+from pyspark.sql import SparkSession, Window
+from pyspark.sql.functions import col, current_timestamp, lit, row_number, to_date
+from pyspark.sql.types import DateType, StructField
+
+from blu.preprocessing import load_model
+from blu.schemas import read_csv, read_csv_stream
+from blu.score import PARTITION_COLUMN, holdout_paths, load_category_encoder, score_orders
+from blu.vocabulary import Vocabulary
+
+logger = logging.getLogger(__name__)
+
+# Source table of the basetable -> landing sub-directory
+LANDING_DIRS = {
+    "test_orders": "orders",
+    "test_order_items": "order_items",
+    "test_order_payments": "order_payments",
+    "test_products": "products",
+}
+ARRIVAL_COLUMN = "arrival_date"
+LANDING_FIELDS = [StructField(ARRIVAL_COLUMN, DateType())]
+
+
+def landing_path(landing_dir, table):
+    return f"{landing_dir.rstrip('/')}/{LANDING_DIRS[table]}"
+
+
+def land_files(paths, landing_dir, arrival_date=None):
+    """Copy the local ``{table: csv path}`` files into ``landing_dir`` as the drop of ``arrival_date`` (default: today).
+
+    A stand-in for the upstream drops when running the stream locally.
+    """
+    partition = f"{ARRIVAL_COLUMN}={arrival_date or date.today().isoformat()}"
+    for table, path in paths.items():
+        target = os.path.join(landing_path(landing_dir, table), partition)
+        os.makedirs(target, exist_ok=True)
+        shutil.copy(path, target)
+
+
+def _read_landed(spark, landing_dir, table, first, last):
+    """Rows of ``table`` landed between the arrival dates ``first`` and ``last``; only those partitions are read."""
+    landed = read_csv(spark, table, landing_path(landing_dir, table), LANDING_FIELDS)
+    return landed.where(col(ARRIVAL_COLUMN).between(lit(first), lit(last))).drop(ARRIVAL_COLUMN)
+
+
+def batch_sources(spark, landing_dir, orders, lookback_days=1):
+    """Basetable sources for the ``orders`` of one micro-batch."""
+    dates = [row[0] for row in orders.select(ARRIVAL_COLUMN).distinct().collect()]
+    first, last = min(dates) - timedelta(days=lookback_days), max(dates)
+    order_ids = orders.select("order_id").distinct()
+    items = _read_landed(spark, landing_dir, "test_order_items", first, last).join(order_ids, "order_id", "left_semi")
+    # Products of any arrival date; the latest landing of a product wins, so its items are not duplicated
+    latest = Window.partitionBy("product_id").orderBy(col(ARRIVAL_COLUMN).desc())
+    products = (
+        read_csv(spark, "test_products", landing_path(landing_dir, "test_products"), LANDING_FIELDS)
+        .join(items.select("product_id").distinct(), "product_id", "left_semi")
+        .withColumn("_landing", row_number().over(latest))
+        .where(col("_landing") == 1)
+        .drop("_landing", ARRIVAL_COLUMN)
+    )
+    return {
+        "test_orders": orders.drop(ARRIVAL_COLUMN),
+        "test_order_items": items,
+        "test_order_payments": _read_landed(spark, landing_dir, "test_order_payments", first, last)
+        .join(order_ids, "order_id", "left_semi"),
+        "test_products": products,
+    }
+
+
+class BatchScorer:
+    """``foreachBatch`` function scoring one micro-batch of new orders."""
+
+    def __init__(self, model, vocabulary, landing_dir, output, lookback_days=1, category_encoder=None):
+        self.model = model
+        self.vocabulary = vocabulary
+        self.category_encoder = category_encoder
+        self.landing_dir = landing_dir
+        self.output = output
+        self.lookback_days = lookback_days
+
+    def __call__(self, orders, batch_id):
+        start = time.perf_counter()
+        spark = orders.sparkSession
+        orders = orders.persist()
+        try:
+            if orders.isEmpty():
+                return
+            sources = batch_sources(spark, self.landing_dir, orders, self.lookback_days)
+            predictions = score_orders(self.model, self.vocabulary, sources, self.category_encoder)
+            (
+                predictions
+                .withColumn("batch_id", lit(batch_id))
+                .withColumn("scored_at", current_timestamp())
+                .withColumn(PARTITION_COLUMN, to_date(current_timestamp()).cast("string"))
+                .write.mode("append")
+                .partitionBy(PARTITION_COLUMN)
+                .parquet(self.output)
+            )
+        finally:
+            orders.unpersist()
+        logger.info("Batch %d scored in %.1f s", batch_id, time.perf_counter() - start)
+
+
+def start_stream(spark, model, vocabulary, landing_dir, output, checkpoint, trigger_seconds=30, once=False,
+                 max_files_per_trigger=None, lookback_days=1, category_encoder=None):
+    """Start the scoring stream and return its ``StreamingQuery``.
+
+    ``category_encoder`` must be the one the model was trained with (see
+    ``blu.score.score_orders``).
+
+    With ``once`` the files already landed are processed and the query stops
+    (``availableNow`` trigger); otherwise a micro-batch starts every
+    ``trigger_seconds``.
+    """
+    orders = read_csv_stream(spark, "test_orders", landing_path(landing_dir, "test_orders"), max_files_per_trigger,
+                             LANDING_FIELDS)
+    writer = (
+        orders.writeStream
+        .queryName("blu-order-scoring")
+        .foreachBatch(BatchScorer(model, vocabulary, landing_dir, output, lookback_days, category_encoder))
+        .option("checkpointLocation", checkpoint)
+    )
+    if once:
+        writer = writer.trigger(availableNow=True)
+    else:
+        writer = writer.trigger(processingTime=f"{trigger_seconds} seconds")
+    return writer.start()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Score new BLU orders as they land.")
+    parser.add_argument("--model", required=True, help="path of the saved PipelineModel")
+    parser.add_argument("--vocabulary", required=True, help="path of the vocabulary saved with the model")
+    parser.add_argument("--category-encoder", default=None,
+                        help="path of the category encoder saved with the model (default: next to the vocabulary)")
+    parser.add_argument("--landing", required=True, help="landing directory with orders/, order_items/, ...")
+    parser.add_argument("--output", required=True, help="Parquet sink of the predictions")
+    parser.add_argument("--checkpoint", required=True, help="checkpoint directory of the stream")
+    parser.add_argument("--trigger-seconds", type=int, default=30, help="micro-batch interval")
+    parser.add_argument("--max-files-per-trigger", type=int, default=None)
+    parser.add_argument("--once", action="store_true", help="process the landed files and stop")
+    parser.add_argument("--lookback-days", type=int, default=1,
+                        help="days before an orders file its items and payments may have landed")
+    parser.add_argument("--land-holdout", default=None, metavar="HOLDOUT_DIR",
+                        help="first land the local test_*.csv files of HOLDOUT_DIR as today's drop")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    spark = SparkSession.builder.appName("blu-stream-scoring").getOrCreate()
+    if args.land_holdout:
+        land_files(holdout_paths(args.land_holdout), args.landing)
+    vocabulary = Vocabulary.load(spark, args.vocabulary)
+    query = start_stream(
+        spark, load_model(args.model), vocabulary, args.landing, args.output,
+        args.checkpoint, args.trigger_seconds, args.once, args.max_files_per_trigger, args.lookback_days,
+        load_category_encoder(spark, args.vocabulary, vocabulary, args.category_encoder),
+    )
+    query.awaitTermination()
+
+
+if __name__ == "__main__":
+    main()
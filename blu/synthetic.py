@@ -0,0 +1,186 @@
+"""Synthetic BLU source data at configurable scale.
+
+``generate`` writes orders, order_items, order_payments, products and
+order_reviews (and the ``test_`` holdout tables) as CSV directories in the
+layout and format of the real sources: the same columns and types as
+``blu.schemas``, ``NA`` for nulls and the same timestamp format. Everything
+is computed by Spark from ``spark.range``, so 50M orders need no driver
+memory, and fixed seeds make a scale reproducible.
+
+The distributions are skewed like the real data. Most orders have one
+item, a small share of bulk orders has dozens, and product and category
+popularity follow power laws, so a few product_ids and categories dominate.
+"""
+
+import logging
+
+from pyspark import StorageLevel
+from pyspark.sql.functions import (
+    array, col, concat, element_at, explode, exp, floor, greatest, least, lit, log, md5, pow, rand, randn, round,
+    sequence, when,
+)
+
+from blu.schemas import SCHEMAS, TIMESTAMP_FORMAT
+
+logger = logging.getLogger(__name__)
+
+SOURCE_TABLES = ("products", "orders", "order_items", "order_payments", "order_reviews")
+HOLDOUT_TABLES = ("test_products", "test_orders", "test_order_items", "test_order_payments")
+
+# Shares of the real order_payments.csv (not_defined is rare but exists in the holdout)
+PAYMENT_TYPES = (("credit_card", 0.74), ("mobile", 0.19), ("voucher", 0.055), ("debit_card", 0.0135),
+                 ("not_defined", 0.0015))
+REVIEW_SCORES = ((5.0, 0.57), (4.0, 0.19), (3.0, 0.08), (2.0, 0.03), (1.0, 0.13))
+
+START_SECONDS = 1609459200  # 2021-01-01 00:00:00 UTC
+PERIOD_SECONDS = 2 * 365 * 24 * 3600
+HOUR, DAY = 3600, 24 * 3600
+
+
+def _choice(u, weighted):
+    """Pick a value of the ``(value, weight)`` pairs with the uniform column ``u``."""
+    total = sum(weight for _, weight in weighted)
+    expression, cumulative = None, 0.0
+    for value, weight in weighted[:-1]:
+        cumulative += weight / total
+        expression = (when(u < cumulative, lit(value)) if expression is None
+                      else expression.when(u < cumulative, lit(value)))
+    last = lit(weighted[-1][0])
+    return last if expression is None else expression.otherwise(last)
+
+
+def _zipf_index(size, skew, seed):
+    """Index in ``[0, size)``; ``skew`` > 1 concentrates the draws on the low indices."""
+    return least(floor(pow(rand(seed), skew) * size), lit(size - 1)).cast("long")
+
+
+def _hex_id(prefix, column):
+    return md5(concat(lit(prefix), column.cast("string")))
+
+
+def _orders(spark, num_orders, num_partitions, seed, holdout_fraction, item_repeat_probability,
+            bulk_order_fraction, max_items):
+    """One row per order with its split, item count and timestamps."""
+    purchase = lit(START_SECONDS) + floor(rand(seed + 1) * PERIOD_SECONDS)
+    approved = purchase + floor(rand(seed + 2) * 48 * HOUR)
+    carrier = approved + floor(rand(seed + 3) * 5 * DAY)
+    delivered = carrier + floor(exp(randn(seed + 4) * 0.6 + 1.8) * DAY)
+    estimated = floor((purchase + (10 + floor(rand(seed + 5) * 30)) * DAY) / DAY) * DAY
+    # geometric number of items, plus a few bulk orders with up to max_items items
+    items = 1 + floor(log(1 - rand(seed + 6)) / log(lit(item_repeat_probability)))
+    bulk = 10 + floor(rand(seed + 7) * (max_items - 10))
+    num_items = least(when(rand(seed + 8) < bulk_order_fraction, bulk).otherwise(items), lit(max_items))
+    undelivered = rand(seed + 9) < 0.03
+    return spark.range(0, num_orders, numPartitions=num_partitions).select(
+        col("id"),
+        _hex_id("order-", col("id")).alias("order_id"),
+        (rand(seed) < holdout_fraction).alias("holdout"),
+        num_items.cast("int").alias("num_items"),
+        when(undelivered, _choice(rand(seed + 10), (("shipped", 0.7), ("canceled", 0.3))))
+        .otherwise(lit("delivered")).alias("order_status"),
+        purchase.cast("timestamp").alias("order_purchase_timestamp"),
+        approved.cast("timestamp").alias("order_approved_at"),
+        carrier.cast("timestamp").alias("order_delivered_carrier_date"),
+        when(~undelivered, delivered.cast("timestamp")).alias("order_delivered_customer_date"),
+        estimated.cast("timestamp").alias("order_estimated_delivery_date"),
+        _hex_id("customer-", col("id")).alias("customer_id"),
+    )
+
+
+def _products(spark, num_products, num_partitions, seed, categories, category_skew):
+    index = _zipf_index(len(categories), category_skew, seed)
+    category = element_at(array(*[lit(c) for c in categories]), (index + 1).cast("int"))
+    return spark.range(0, num_products, numPartitions=num_partitions).select(
+        _hex_id("product-", col("id")).alias("product_id"),
+        (20 + floor(rand(seed + 1) * 45)).cast("int").alias("product_name_lenght"),
+        least(floor(exp(randn(seed + 2) * 0.7 + 6.5)), lit(4000)).cast("int").alias("product_description_lenght"),
+        least(1 + floor(-log(1 - rand(seed + 3)) * 1.5), lit(20)).cast("int").alias("product_photos_qty"),
+        round(exp(randn(seed + 4) + 6.5), 0).alias("product_weight_g"),
+        (10 + floor(rand(seed + 5) * 90)).cast("double").alias("product_length_cm"),
+        (2 + floor(rand(seed + 6) * 60)).cast("double").alias("product_height_cm"),
+        (8 + floor(rand(seed + 7) * 70)).cast("double").alias("product_width_cm"),
+        when(rand(seed + 8) >= 0.01, category).alias("product_category_name"),
+    )
+
+
+def _order_items(orders, num_products, seed, product_skew):
+    items = orders.select("order_id", "holdout", explode(sequence(lit(1), col("num_items"))).alias("order_item_id"))
+    price = round(exp(randn(seed + 1) * 0.9 + 4.0), 2)
+    return items.select(
+        "order_id", "holdout", "order_item_id",
+        _hex_id("product-", _zipf_index(num_products, product_skew, seed)).alias("product_id"),
+        price.alias("price"),
+        round(greatest(lit(0.0), price * 0.08 + rand(seed + 2) * 20), 2).alias("shipping_cost"),
+    )
+
+
+def _order_payments(orders, seed):
+    payments = orders.select(
+        "order_id", "holdout",
+        explode(sequence(lit(1), when(rand(seed) < 0.03, 2).otherwise(1))).alias("payment_sequential"),
+    )
+    payment_type = _choice(rand(seed + 1), PAYMENT_TYPES)
+    return payments.withColumn("payment_type", payment_type).select(
+        "order_id", "holdout", "payment_sequential", "payment_type",
+        when(col("payment_type") == "credit_card", 1 + floor(pow(rand(seed + 2), 2) * 10))
+        .otherwise(1).cast("int").alias("payment_installments"),
+        round(exp(randn(seed + 3) * 0.9 + 4.3), 2).alias("payment_value"),
+    )
+
+
+def _order_reviews(orders, seed):
+    purchase_day = floor(col("order_purchase_timestamp").cast("long") / DAY) * DAY
+    created = purchase_day + (10 + floor(rand(seed + 1) * 30)) * DAY
+    return orders.where(~col("holdout")).select(
+        _hex_id("review-", col("id")).alias("review_id"),
+        "order_id",
+        _choice(rand(seed), REVIEW_SCORES).alias("review_score"),
+        created.cast("timestamp").alias("review_creation_date"),
+        (created + floor(rand(seed + 2) * 3 * DAY)).cast("timestamp").alias("review_answer_timestamp"),
+    )
+
+
+def _write_csv(df, table, path):
+    (
+        df.select(*SCHEMAS[table].fieldNames())
+        .write.mode("overwrite")
+        .option("header", "true")
+        .option("nullValue", "NA")
+        .option("timestampFormat", TIMESTAMP_FORMAT)
+        .csv(path)
+    )
+
+
+def generate(spark, output_dir, num_orders, seed=42, num_partitions=None, holdout_fraction=0.2,
+             products_per_order=0.35, num_categories=70, categories=None, item_repeat_probability=0.12,
+             bulk_order_fraction=0.001, max_items=60, product_skew=3.0, category_skew=2.0):
+    """Write all source tables for ``num_orders`` orders under ``output_dir``.
+
+    ``holdout_fraction`` of the orders go to the ``test_`` tables (without
+    reviews); the product catalogue is shared by both. ``categories``
+    defaults to ``num_categories`` generic names. Returns ``{table: path}``,
+    which the readers and ``blu.ingest.ingest`` take as they are.
+    """
+    output_dir = output_dir.rstrip("/")
+    num_partitions = num_partitions or max(spark.sparkContext.defaultParallelism, num_orders // 1_000_000)
+    num_products = max(int(num_orders * products_per_order), 1)
+    categories = list(categories or [f"category_{i:02d}" for i in range(num_categories)])
+    paths = {table: f"{output_dir}/{table}" for table in SOURCE_TABLES + HOLDOUT_TABLES}
+
+    orders = _orders(spark, num_orders, num_partitions, seed, holdout_fraction, item_repeat_probability,
+                     bulk_order_fraction, max_items).persist(StorageLevel.MEMORY_AND_DISK)
+    try:
+        products = _products(spark, num_products, num_partitions, seed + 100, categories, category_skew)
+        items = _order_items(orders, num_products, seed + 200, product_skew)
+        payments = _order_payments(orders, seed + 300)
+
+        _write_csv(products, "products", paths["products"])
+        _write_csv(products, "test_products", paths["test_products"])
+        for table, df in (("orders", orders), ("order_items", items), ("order_payments", payments)):
+            _write_csv(df.where(~col("holdout")), table, paths[table])
+            _write_csv(df.where(col("holdout")), f"test_{table}", paths[f"test_{table}"])
+        _write_csv(_order_reviews(orders, seed + 400), "order_reviews", paths["order_reviews"])
+    finally:
+        orders.unpersist()
+    logger.info("Generated %d orders and %d products under %s", num_orders, num_products, output_dir)
+    return paths
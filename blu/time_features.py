@@ -0,0 +1,130 @@
+"""Delivery-time and calendar features of the orders.
+
+Every timestamp column is parsed at most once (the CSV and Parquet readers
+already deliver ``TimestampType``; string columns are converted with
+``to_timestamp`` in an inner projection), and all interval and calendar
+features are then emitted by a single ``select``. Intervals are plain
+differences of epoch seconds, so no timestamp is formatted or re-parsed.
+"""
+
+from collections import OrderedDict, namedtuple
+from datetime import date, timedelta
+
+from pyspark.sql.functions import col, date_format, dayofweek, hour, round, to_timestamp, when
+from pyspark.sql.types import TimestampType
+
+from blu.schemas import TIMESTAMP_FORMAT
+
+TIMESTAMP_COLUMNS = (
+    "order_purchase_timestamp",
+    "order_approved_at",
+    "order_delivered_carrier_date",
+    "order_delivered_customer_date",
+    "order_estimated_delivery_date",
+)
+
+# feature: (end, start), in hours
+DELIVERY_INTERVALS = OrderedDict([
+    ("approve_efficiency", ("order_approved_at", "order_purchase_timestamp")),
+    ("package_efficiency", ("order_delivered_carrier_date", "order_approved_at")),
+    ("delivery_efficiency", ("order_delivered_customer_date", "order_delivered_carrier_date")),
+    ("on_time", ("order_estimated_delivery_date", "order_delivered_customer_date")),
+    ("total_delivery_time", ("order_delivered_customer_date", "order_purchase_timestamp")),
+])
+
+# feature: timestamp
+HOUR_FEATURES = OrderedDict([
+    ("purchase_hour", "order_purchase_timestamp"),
+    ("delivered_hour", "order_delivered_customer_date"),
+])
+HOLIDAY_FEATURES = OrderedDict([
+    ("purchase_on_holiday", "order_purchase_timestamp"),
+    ("delivered_on_holiday", "order_delivered_customer_date"),
+])
+
+# National holidays of a country: the fixed dates (MM-dd) and the movable ones
+# as days after Easter Sunday
+HolidayCalendar = namedtuple("HolidayCalendar", ["fixed", "easter_offsets"])
+HOLIDAY_CALENDARS = {
+    # New Year, Labour Day, Victory in Europe, Bastille Day, Assumption, All Saints, Armistice, Christmas;
+    # Easter Monday, Ascension, Whit Monday
+    "FR": HolidayCalendar(("01-01", "05-01", "05-08", "07-14", "08-15", "11-01", "11-11", "12-25"), (1, 39, 50)),
+    # New Year, Tiradentes, Labour Day, Independence, Our Lady of Aparecida, All Souls, Republic, Christmas;
+    # Carnival Monday and Tuesday, Good Friday
+    "BR": HolidayCalendar(("01-01", "04-21", "05-01", "09-07", "10-12", "11-02", "11-15", "12-25"), (-48, -47, -2)),
+}
+# BLU sells in France
+DEFAULT_COUNTRY = "FR"
+# Years the movable holidays are generated for
+HOLIDAY_YEARS = range(2000, 2041)
+
+
+def easter_sunday(year):
+    """Date of Easter Sunday in the Gregorian calendar (anonymous Gregorian algorithm)."""
+    a, b, c = year % 19, year // 100, year % 100
+    d, e = divmod(b, 4)
+    g = (8 * b + 13) // 25
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    weekday = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 19 * weekday) // 433
+    month = (h + weekday - 7 * m + 90) // 25
+    return date(year, month, (h + weekday - 7 * m + 33 * month + 19) % 32)
+
+
+def holiday_calendar(country=DEFAULT_COUNTRY):
+    """``(fixed MM-dd dates, movable yyyy-MM-dd dates)`` of the holidays of ``country``."""
+    try:
+        calendar = HOLIDAY_CALENDARS[country]
+    except KeyError:
+        raise ValueError(f"No holiday calendar for '{country}', expected one of {sorted(HOLIDAY_CALENDARS)}") from None
+    movable = [str(easter_sunday(year) + timedelta(days=offset))
+               for year in HOLIDAY_YEARS for offset in calendar.easter_offsets]
+    return calendar.fixed, movable
+
+
+def parse_timestamps(df, columns=TIMESTAMP_COLUMNS):
+    """``df`` with the string ``columns`` converted to ``TimestampType``."""
+    strings = [c for c in columns if not isinstance(df.schema[c].dataType, TimestampType)]
+    if not strings:
+        return df
+    return df.select(*[
+        to_timestamp(col(c), TIMESTAMP_FORMAT).alias(c) if c in strings else col(c)
+        for c in df.columns
+    ])
+
+
+def _hours_between(end, start):
+    return round((col(end).cast("long") - col(start).cast("long")) / 3600, 2)
+
+
+def _is_holiday(column, holidays, country):
+    fixed, movable = holiday_calendar(country)
+    dates = movable + [str(day) for day in holidays]
+    flag = date_format(col(column), "MM-dd").isin(*fixed) | date_format(col(column), "yyyy-MM-dd").isin(*dates)
+    return when(flag, 1.0).when(col(column).isNotNull(), 0.0)
+
+
+def time_feature_columns(holidays=(), country=DEFAULT_COUNTRY):
+    """Column expressions of all time features, in output order.
+
+    The holiday flags follow the national holidays of ``country`` (see
+    ``HOLIDAY_CALENDARS``); ``holidays`` adds dates (``datetime.date`` or
+    ``yyyy-MM-dd`` strings) such as regional holidays.
+    """
+    columns = [
+        when(dayofweek("order_delivered_customer_date") >= 6, 1.0).otherwise(0.0).alias("weekend_delivered"),
+    ]
+    columns += [_hours_between(end, start).alias(name) for name, (end, start) in DELIVERY_INTERVALS.items()]
+    columns += [hour(column).alias(name) for name, column in HOUR_FEATURES.items()]
+    columns += [_is_holiday(column, holidays, country).alias(name) for name, column in HOLIDAY_FEATURES.items()]
+    return columns
+
+
+def time_feature_names():
+    return ["weekend_delivered", *DELIVERY_INTERVALS, *HOUR_FEATURES, *HOLIDAY_FEATURES]
+
+
+def add_time_features(orders, keep, holidays=(), country=DEFAULT_COUNTRY):
+    """The ``keep`` columns of ``orders`` and all time features, in one projection."""
+    return parse_timestamps(orders).select(*keep, *time_feature_columns(holidays, country))
@@ -0,0 +1,120 @@
+"""Successive-halving hyperparameter tuning with the ``CrossValidator`` API.
+
+``SuccessiveHalvingCV`` is configured exactly like ``CrossValidator``
+(estimator, param maps, evaluator, number of folds, seed, parallelism) plus
+``eta`` and ``minFraction``. Instead of cross-validating every param map on
+all folds it:
+
+1. fits all candidates on a ``minFraction`` sample of one fold's training
+   part and scores them on that fold's validation part,
+2. keeps the best ``1/eta`` of them and multiplies the sample fraction by
+   ``eta``, moving on to the next fold,
+3. repeats until one candidate is left or the full data is used, and then
+   cross-validates the survivors on all folds with the full data (skipped
+   when a single candidate is left, which is refitted straight away).
+
+Clearly losing configurations are therefore dropped after a cheap fit.
+"""
+
+import logging
+import math
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from pyspark import inheritable_thread_target
+from pyspark.ml.param import Param, Params, TypeConverters
+from pyspark.ml.tuning import CrossValidator, CrossValidatorModel
+
+from blu.model_search import param_dict, split_folds
+
+logger = logging.getLogger(__name__)
+
+
+class SuccessiveHalvingCV(CrossValidator):
+    """``CrossValidator`` that eliminates weak param maps early.
+
+    ``avgMetrics`` of the returned model holds, per param map, the
+    cross-validated metric for the final survivors and the metric of the
+    rung in which the others were eliminated. A single survivor of the
+    halving keeps the metric of the last rung.
+    """
+
+    eta = Param(Params._dummy(), "eta", "factor by which the candidates are reduced and the budget grows (> 1)",
+                typeConverter=TypeConverters.toFloat)
+    minFraction = Param(Params._dummy(), "minFraction", "fraction of a fold's training rows used in the first rung",
+                        typeConverter=TypeConverters.toFloat)
+
+    def __init__(self, *, eta=3.0, minFraction=0.1, **kwargs):
+        super().__init__(**kwargs)
+        self._setDefault(eta=3.0, minFraction=0.1)
+        self._set(eta=eta, minFraction=minFraction)
+
+    def setEta(self, value):
+        return self._set(eta=value)
+
+    def getEta(self):
+        return self.getOrDefault(self.eta)
+
+    def setMinFraction(self, value):
+        return self._set(minFraction=value)
+
+    def getMinFraction(self):
+        return self.getOrDefault(self.minFraction)
+
+    def _evaluate(self, pool, candidates, train, validation, fraction, seed):
+        estimator, param_maps, evaluator = self.getEstimator(), self.getEstimatorParamMaps(), self.getEvaluator()
+        if fraction < 1.0:
+            train = train.sample(False, fraction, seed)
+
+        def run(index):
+            model = estimator.fit(train, param_maps[index])
+            return evaluator.evaluate(model.transform(validation, param_maps[index]))
+
+        # as in CrossValidator: the pool threads inherit this thread's job group
+        return list(pool.map(inheritable_thread_target(run), candidates))
+
+    def _fit(self, dataset):
+        eta, fraction = self.getEta(), self.getMinFraction()
+        if eta <= 1.0:
+            raise ValueError("eta must be greater than 1")
+        if not 0.0 < fraction <= 1.0:
+            raise ValueError("minFraction must be in (0, 1]")
+        estimator, param_maps, evaluator = self.getEstimator(), self.getEstimatorParamMaps(), self.getEvaluator()
+        num_folds, seed = self.getNumFolds(), self.getSeed()
+        larger_is_better = evaluator.isLargerBetter()
+
+        metrics = [float("nan")] * len(param_maps)
+        candidates = list(range(len(param_maps)))
+        folds = split_folds(dataset, num_folds, seed)
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, self.getParallelism())) as pool:
+                rung = 0
+                while len(candidates) > 1 and fraction < 1.0:
+                    train, validation = folds[rung % num_folds]
+                    scores = self._evaluate(pool, candidates, train, validation, fraction, seed + rung)
+                    for index, score in zip(candidates, scores):
+                        metrics[index] = score
+                    ranked = sorted(zip(scores, candidates), reverse=larger_is_better)
+                    keep = max(1, math.ceil(len(candidates) / eta))
+                    logger.info("Rung %d (%.0f%% of the rows): keeping %s of %d candidates", rung, fraction * 100,
+                                [param_dict(param_maps[i]) for _, i in ranked[:keep]], len(candidates))
+                    candidates = [index for _, index in ranked[:keep]]
+                    fraction = min(1.0, fraction * eta)
+                    rung += 1
+
+                # Full cross validation of the survivors; a single one only needs the final refit
+                if len(candidates) > 1:
+                    fold_scores = [self._evaluate(pool, candidates, train, validation, 1.0, seed)
+                                   for train, validation in folds]
+                    for position, index in enumerate(candidates):
+                        metrics[index] = float(np.mean([scores[position] for scores in fold_scores]))
+        finally:
+            for train, validation in folds:
+                train.unpersist()
+                validation.unpersist()
+
+        survivor_metrics = [metrics[i] for i in candidates]
+        pick = np.argmax if larger_is_better else np.argmin
+        best_index = candidates[int(pick(survivor_metrics))]
+        best_model = estimator.fit(dataset, param_maps[best_index])
+        return self._copyValues(CrossValidatorModel(best_model, metrics))
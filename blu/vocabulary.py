@@ -0,0 +1,57 @@
+"""Persisted category vocabularies for the pivoted and encoded columns.
+
+The values of ``payment_type`` and ``product_category_name`` are learned once
+from the training data and saved next to the model. Every pivot then gets
+its values explicitly, so Spark skips the distinct job it would otherwise
+run first, and training and scoring data always get the same columns.
+"""
+
+import json
+
+from pyspark.sql.functions import col, collect_set
+
+from blu import fs
+
+
+class Vocabulary:
+    """Sorted category values per column."""
+
+    def __init__(self, values=None):
+        self._values = {column: sorted(v) for column, v in (values or {}).items()}
+
+    @classmethod
+    def learn(cls, df, columns):
+        """Learn the non-null values of ``columns`` of ``df`` in one aggregation."""
+        row = df.agg(*[collect_set(col(c)).alias(c) for c in columns]).first()
+        return cls({c: row[c] for c in columns})
+
+    def values(self, column):
+        try:
+            return list(self._values[column])
+        except KeyError:
+            raise KeyError(f"No vocabulary was learned for column '{column}'") from None
+
+    def merge(self, other):
+        """Return a vocabulary holding the columns of both (``other`` wins on clashes)."""
+        return Vocabulary({**self._values, **other._values})
+
+    @property
+    def columns(self):
+        return list(self._values)
+
+    def to_dict(self):
+        return {column: list(values) for column, values in self._values.items()}
+
+    def save(self, spark, path):
+        fs.write_text(spark, path, json.dumps(self.to_dict(), indent=2, sort_keys=True))
+
+    @classmethod
+    def load(cls, spark, path):
+        return cls(json.loads(fs.read_text(spark, path)))
+
+    def __eq__(self, other):
+        return isinstance(other, Vocabulary) and self._values == other._values
+
+    def __repr__(self):
+        sizes = ", ".join(f"{c}: {len(v)}" for c, v in self._values.items())
+        return f"Vocabulary({sizes})"